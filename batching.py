@@ -0,0 +1,89 @@
+import os
+import re
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+DEFAULT_BATCH_SIZE = int(os.getenv("TOON_BATCH_SIZE", 1))
+# Output budget for one batched request (per-case budget × cases, capped here)
+BATCH_MAX_TOKENS = int(os.getenv("TOON_BATCH_MAX_TOKENS", 32000))
+
+CASE_MARKER = "### CASE {index} ###"
+_CASE_MARKER_RE = re.compile(r"^[ \t]*#{3}\s*CASE\s+(\d+)\s*#{3}[ \t]*$", re.MULTILINE)
+
+
+# ============================================================================
+# BATCH PROMPT BUILDING
+# ============================================================================
+def build_batch_prompt(prompt_base, payloads):
+    """
+    Pack several inputs into one prompt that shares a single few-shot preamble.
+
+    Every input is introduced by a `### CASE k ###` line (k starting at 1) and the
+    model is asked to answer with the same markers, in order, so the response can
+    be split back into per-case outputs with `split_batch_response`.
+
+    Args:
+        prompt_base (str): The few-shot preamble (e.g. `toon_to_json_prompt_base`).
+        payloads (list[str]): The per-case inputs, in order.
+
+    Returns:
+        str: The batched prompt.
+    """
+    return prompt_base + "\n" + build_batch_suffix(payloads)
+
+
+def build_batch_suffix(payloads):
+    """The part of a batched prompt that follows the preamble (instructions + marked inputs)."""
+    count = len(payloads)
+    lines = [
+        f"BATCH MODE: there are {count} independent inputs below. Each one starts with a line "
+        f"`{CASE_MARKER.format(index='k')}`. Convert every input on its own, following all the rules above.",
+        f"For each input, in order, output its `{CASE_MARKER.format(index='k')}` line on its own line, "
+        "followed by ONLY the converted output for that input. Do not add any other text.",
+    ]
+    for index, payload in enumerate(payloads, 1):
+        lines.append("")
+        lines.append(CASE_MARKER.format(index=index))
+        lines.append(payload)
+    return "\n".join(lines)
+
+
+def batch_max_tokens(per_case_tokens, count):
+    """Output budget for a batch of `count` cases."""
+    return min(per_case_tokens * count, BATCH_MAX_TOKENS)
+
+
+# ============================================================================
+# BATCH RESPONSE SPLITTING
+# ============================================================================
+def split_batch_response(text, count):
+    """
+    Split a batched completion back into `count` per-case outputs.
+
+    Missing or unparsable sections come back as empty strings, so the case is
+    reported as a normal FAIL by the existing validation.
+
+    Args:
+        text (str): The raw model response.
+        count (int): Number of cases in the batch.
+
+    Returns:
+        list[str]: One output per case, in order.
+    """
+    outputs = [""] * count
+    markers = list(_CASE_MARKER_RE.finditer(text or ""))
+    for position, match in enumerate(markers):
+        index = int(match.group(1))
+        if not 1 <= index <= count or outputs[index - 1]:
+            continue
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        outputs[index - 1] = text[match.end():end].strip()
+    return outputs
+
+
+def chunk_names(names, batch_size):
+    """Group case names into consecutive batches of at most `batch_size`."""
+    names = list(names)
+    batch_size = max(1, batch_size)
+    return [names[i:i + batch_size] for i in range(0, len(names), batch_size)]
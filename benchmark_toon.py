@@ -0,0 +1,255 @@
+import gc
+import os
+import math
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+from datetime import datetime
+import toon_format
+from toon_format import encode, decode
+from synthetic_corpus import SHAPES, SYNTHETIC_DEPTH, SYNTHETIC_SEED, generate, parse_size, rows_for_size
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+BENCHMARK_SIZES = os.getenv("BENCHMARK_SIZES", "1KB,64KB,1MB")
+# Each operation runs at least this many times and for at least this long (whichever is later) ...
+BENCHMARK_MIN_REPEATS = int(os.getenv("BENCHMARK_MIN_REPEATS", 5))
+BENCHMARK_MIN_TIME = float(os.getenv("BENCHMARK_MIN_TIME", 1.0))
+# ... but never more often than this
+BENCHMARK_MAX_REPEATS = int(os.getenv("BENCHMARK_MAX_REPEATS", 10_000))
+
+# Operation → (format, direction); JSON is serialized compactly, like production traffic
+OPERATIONS = {
+    "json.dumps": ("json", "encode"),
+    "json.loads": ("json", "decode"),
+    "toon.encode": ("toon", "encode"),
+    "toon.decode": ("toon", "decode"),
+}
+
+
+def _operation(name, doc, texts):
+    if name == "json.dumps":
+        return lambda: json.dumps(doc, separators=(",", ":"), ensure_ascii=False)
+    if name == "json.loads":
+        return lambda: json.loads(texts["json"])
+    if name == "toon.encode":
+        return lambda: encode(doc)
+    return lambda: decode(texts["toon"])
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+def percentile(samples, q):
+    """Nearest-rank percentile (`q` in 0..100) of an unsorted list."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def time_operation(fn, min_repeats=BENCHMARK_MIN_REPEATS, min_time=BENCHMARK_MIN_TIME, max_repeats=BENCHMARK_MAX_REPEATS):
+    """
+    Call `fn` repeatedly and return the per-call latencies in seconds.
+
+    The garbage collector is paused while timing (as `timeit` does), after one warm-up call.
+    """
+    fn()
+    latencies = []
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        deadline = time.perf_counter() + min_time
+        while len(latencies) < max_repeats and (len(latencies) < min_repeats or time.perf_counter() < deadline):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return latencies
+
+
+def peak_memory(fn):
+    """Peak bytes allocated by one call of `fn` (tracemalloc; measured apart from the timings it would slow down)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_document(shape, size_label, doc, rows, operations=OPERATIONS, **timing):
+    """
+    Time every operation on one document.
+
+    Returns:
+        list[dict]: One row per operation with the latency percentiles, ops/s, MB/s
+            (of the format's text) and the tracemalloc peak.
+    """
+    texts = {"json": json.dumps(doc, separators=(",", ":"), ensure_ascii=False), "toon": encode(doc)}
+    if decode(texts["toon"]) != doc:
+        raise ValueError(f"❌ {shape} {size_label}: TOON round trip changed the document")
+    sizes = {fmt: len(text.encode("utf-8")) for fmt, text in texts.items()}
+
+    rows_out = []
+    for name in operations:
+        fmt, direction = OPERATIONS[name]
+        fn = _operation(name, doc, texts)
+        latencies = time_operation(fn, **timing)
+        mean = sum(latencies) / len(latencies)
+        rows_out.append({
+            "shape": shape,
+            "size": size_label,
+            "rows": rows,
+            "operation": name,
+            "format": fmt,
+            "direction": direction,
+            "text_bytes": sizes[fmt],
+            "json_bytes": sizes["json"],
+            "toon_bytes": sizes["toon"],
+            "repeats": len(latencies),
+            "mean_s": mean,
+            "p50_s": percentile(latencies, 50),
+            "p95_s": percentile(latencies, 95),
+            "p99_s": percentile(latencies, 99),
+            "ops_per_s": 1 / mean if mean else 0.0,
+            "mb_per_s": sizes[fmt] / mean / 1e6 if mean else 0.0,
+            "peak_bytes": peak_memory(fn),
+        })
+    return rows_out
+
+
+# ============================================================================
+# RESULTS FILE
+# ============================================================================
+def git_commit():
+    """(commit hash, dirty flag) of the working tree, or (None, None) outside a git checkout."""
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment():
+    commit, dirty = git_commit()
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "toon_format": getattr(toon_format, "__version__", "unknown"),
+    }
+
+
+def compare(results, baseline):
+    """p50 ratio (current / baseline) per matching (shape, size, operation); < 1 means faster now."""
+    previous = {(r["shape"], r["size"], r["operation"]): r for r in baseline["results"]}
+    ratios = []
+    for row in results:
+        old = previous.get((row["shape"], row["size"], row["operation"]))
+        if old and old["p50_s"]:
+            ratios.append((row, row["p50_s"] / old["p50_s"]))
+    return ratios
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.3f}"
+
+
+def print_results(results):
+    print(f"\n| {'Shape':<13} | {'Size':>6} | {'Operation':<11} | {'Bytes':>11} | {'ops/s':>9} | {'MB/s':>7} "
+          f"| {'p50 ms':>9} | {'p95 ms':>9} | {'p99 ms':>9} | {'Peak KB':>9} |")
+    print("-" * 124)
+    for row in results:
+        print(f"| {row['shape']:<13} | {row['size']:>6} | {row['operation']:<11} | {row['text_bytes']:>11,} | {row['ops_per_s']:>9,.1f} "
+              f"| {row['mb_per_s']:>7.1f} | {_ms(row['p50_s']):>9} | {_ms(row['p95_s']):>9} | {_ms(row['p99_s']):>9} "
+              f"| {row['peak_bytes'] / 1024:>9,.0f} |")
+
+    # TOON cost relative to JSON, per document and direction
+    print(f"\n| {'Shape':<13} | {'Size':>6} | {'TOON/JSON bytes':>15} | {'encode p50 x':>12} | {'decode p50 x':>12} |")
+    print("-" * 73)
+    by_doc = {}
+    for row in results:
+        by_doc.setdefault((row["shape"], row["size"]), {})[row["operation"]] = row
+
+    def ratio(ops, toon_op, json_op):
+        if toon_op in ops and json_op in ops and ops[json_op]["p50_s"]:
+            return f"{ops[toon_op]['p50_s'] / ops[json_op]['p50_s']:.1f}x"
+        return "-"
+
+    for (shape, size), ops in by_doc.items():
+        any_row = next(iter(ops.values()))
+        print(f"| {shape:<13} | {size:>6} | {any_row['toon_bytes'] / any_row['json_bytes']:>14.1%} "
+              f"| {ratio(ops, 'toon.encode', 'json.dumps'):>12} | {ratio(ops, 'toon.decode', 'json.loads'):>12} |")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark: toon_format encode/decode vs json.dumps/json.loads")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"Comma-separated corpus shapes (default: all: {','.join(SHAPES)})")
+    parser.add_argument("--sizes", default=BENCHMARK_SIZES,
+                        help=f"Comma-separated compact-JSON document sizes (default: {BENCHMARK_SIZES}, env BENCHMARK_SIZES)")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="Comma-separated operations (default: all)")
+    parser.add_argument("--min-repeats", type=int, default=BENCHMARK_MIN_REPEATS, help="Minimum calls per operation")
+    parser.add_argument("--min-time", type=float, default=BENCHMARK_MIN_TIME, help="Minimum seconds per operation")
+    parser.add_argument("--max-repeats", type=int, default=BENCHMARK_MAX_REPEATS, help="Maximum calls per operation")
+    parser.add_argument("--depth", type=int, default=SYNTHETIC_DEPTH, help="Nesting depth of the nested shape")
+    parser.add_argument("--seed", type=int, default=SYNTHETIC_SEED, help="Corpus seed")
+    parser.add_argument("-o", "--output", default="benchmark_toon.json", help="Results file (JSON)")
+    parser.add_argument("--compare", metavar="RESULTS", help="Previous results file to compare p50 latencies against")
+    args = parser.parse_args(argv)
+
+    shapes = [shape.strip() for shape in args.shapes.split(",") if shape.strip()]
+    operations = [op.strip() for op in args.operations.split(",") if op.strip()]
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error(f"unknown operation {name!r} (expected: {', '.join(OPERATIONS)})")
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    timing = {"min_repeats": args.min_repeats, "min_time": args.min_time, "max_repeats": args.max_repeats}
+
+    meta = environment()
+    print(f"⏱️  TOON BENCHMARK (toon_format {meta['toon_format']}, Python {meta['python']}, commit {(meta['git_commit'] or 'unknown')[:12]}"
+          f"{' +dirty' if meta['git_dirty'] else ''})")
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            target = parse_size(size)
+            if target is None:
+                parser.error(f"size {size!r} needs a unit (B, KB, MB, GB)")
+            rows = rows_for_size(shape, target, args.depth, args.seed)
+            doc = generate(shape, rows, args.depth, args.seed)
+            print(f"  {shape} {size}: {rows:,} records", file=sys.stderr)
+            results += benchmark_document(shape, size, doc, rows, operations, **timing)
+            del doc
+
+    print_results(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({**meta, "config": {**timing, "shapes": shapes, "sizes": sizes, "operations": operations,
+                                      "depth": args.depth, "seed": args.seed},
+                   "results": results}, f, indent=2)
+        f.write("\n")
+    print(f"\n✅ Results saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n📊 p50 vs {args.compare} (commit {(baseline.get('git_commit') or 'unknown')[:12]}; < 1.00x = faster now)")
+        for row, ratio in compare(results, baseline):
+            print(f"  {row['shape']:<13} {row['size']:>6} {row['operation']:<11} {ratio:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional: `uv pip install zstandard`
+    zstandard = None
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# auto = zstd when the `zstandard` package is installed, zlib otherwise
+CACHE_CODEC = os.getenv("CACHE_CODEC", "auto").lower()
+# Values smaller than this are stored uncompressed (compression would not pay off)
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 64))
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", 3))
+# Dictionary trained on our own responses (`python cache_codec.py --train`), kept with the disk cache
+CACHE_ZSTD_DICT = os.getenv("CACHE_ZSTD_DICT", os.path.join(os.getenv("TOON_CACHE_DIR", ".toon_cache"), "cache_zstd.dict"))
+CACHE_ZSTD_DICT_SIZE = int(os.getenv("CACHE_ZSTD_DICT_SIZE", 16 * 1024))
+# Share of the corpus documents held out of training and used for the benchmark
+CACHE_ZSTD_HOLDOUT = float(os.getenv("CACHE_ZSTD_HOLDOUT", 0.25))
+
+# ----------------------------
+# VALUE FORMAT
+# ----------------------------
+#   legacy : raw zlib stream (first byte 0x78), as written before the codec existed
+#   current: MAGIC | version (1 byte) | codec id (1 byte) | [dict id (4 bytes), zstd-dict only] | payload
+MAGIC = b"\xc7T"
+FORMAT_VERSION = 1
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_ZSTD_DICT = 3
+CODEC_NAMES = {CODEC_RAW: "raw", CODEC_ZLIB: "zlib", CODEC_ZSTD: "zstd", CODEC_ZSTD_DICT: "zstd+dict"}
+_LEGACY_ZLIB_FIRST_BYTE = 0x78
+
+
+class CacheCodecError(ValueError):
+    """A cached value could not be decoded (unknown format, or written with another dictionary)."""
+
+
+# ============================================================================
+# CODEC
+# ============================================================================
+class CacheCodec:
+    """
+    Encode cache value dicts to bytes and back.
+
+    `codec` is "auto", "zstd", "zlib" or "raw". With zstd and a `dictionary`
+    (raw dictionary bytes), values are compressed against it, which is what makes
+    small responses shrink. Every value carries a versioned header, and legacy
+    headerless zlib entries are still decoded.
+    """
+
+    def __init__(self, codec=CACHE_CODEC, dictionary=None, min_size=CACHE_COMPRESS_MIN_BYTES, level=CACHE_ZSTD_LEVEL):
+        if codec == "auto":
+            codec = "zstd" if zstandard is not None else "zlib"
+        if codec not in ("zstd", "zlib", "raw"):
+            raise ValueError(f"❌ Unknown CACHE_CODEC {codec!r} (expected auto, zstd, zlib or raw)")
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("❌ CACHE_CODEC=zstd needs the `zstandard` package")
+
+        self.min_size = min_size
+        self.level = level
+        self.dict_data = None
+        self.dict_id = None
+        if codec == "zstd" and dictionary:
+            self.dict_data = zstandard.ZstdCompressionDict(dictionary)
+            self.dict_id = self.dict_data.dict_id()
+            self.codec_id = CODEC_ZSTD_DICT
+        else:
+            self.codec_id = {"zstd": CODEC_ZSTD, "zlib": CODEC_ZLIB, "raw": CODEC_RAW}[codec]
+        # zstd (de)compressor objects must not be shared between threads
+        self._local = threading.local()
+
+    @property
+    def name(self):
+        return CODEC_NAMES[self.codec_id]
+
+    def _compressor(self):
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dict_data)
+            self._local.compressor = compressor
+        return compressor
+
+    def _decompressor(self, with_dict):
+        attr = "dict_decompressor" if with_dict else "decompressor"
+        decompressor = getattr(self._local, attr, None)
+        if decompressor is None:
+            decompressor = zstandard.ZstdDecompressor(dict_data=self.dict_data if with_dict else None)
+            setattr(self._local, attr, decompressor)
+        return decompressor
+
+    def encode(self, value: dict) -> bytes:
+        raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if self.codec_id == CODEC_RAW or len(raw) < self.min_size:
+            return MAGIC + bytes((FORMAT_VERSION, CODEC_RAW)) + raw
+        if self.codec_id == CODEC_ZLIB:
+            return MAGIC + bytes((FORMAT_VERSION, CODEC_ZLIB)) + zlib.compress(raw)
+        payload = self._compressor().compress(raw)
+        if self.codec_id == CODEC_ZSTD_DICT:
+            return MAGIC + bytes((FORMAT_VERSION, CODEC_ZSTD_DICT)) + struct.pack(">I", self.dict_id) + payload
+        return MAGIC + bytes((FORMAT_VERSION, CODEC_ZSTD)) + payload
+
+    def decode(self, blob: bytes) -> dict:
+        try:
+            return json.loads(self._decode_bytes(blob).decode("utf-8"))
+        except CacheCodecError:
+            raise
+        except Exception as e:
+            raise CacheCodecError(f"corrupt cache value: {e}") from e
+
+    def _decode_bytes(self, blob):
+        if blob[:1] == bytes((_LEGACY_ZLIB_FIRST_BYTE,)):
+            return zlib.decompress(blob)
+        if blob[:2] != MAGIC or len(blob) < 4:
+            raise CacheCodecError("unknown cache value format")
+        version, codec_id = blob[2], blob[3]
+        if version != FORMAT_VERSION:
+            raise CacheCodecError(f"unsupported cache value version {version}")
+        payload = blob[4:]
+        if codec_id == CODEC_RAW:
+            return payload
+        if codec_id == CODEC_ZLIB:
+            return zlib.decompress(payload)
+        if zstandard is None:
+            raise CacheCodecError("zstd cache value but the `zstandard` package is not installed")
+        if codec_id == CODEC_ZSTD:
+            return self._decompressor(with_dict=False).decompress(payload)
+        if codec_id == CODEC_ZSTD_DICT:
+            (dict_id,) = struct.unpack(">I", payload[:4])
+            if dict_id != self.dict_id:
+                raise CacheCodecError(f"cache value needs zstd dictionary {dict_id}, loaded: {self.dict_id}")
+            return self._decompressor(with_dict=True).decompress(payload[4:])
+        raise CacheCodecError(f"unknown codec id {codec_id}")
+
+
+def load_dictionary(path=CACHE_ZSTD_DICT):
+    """Raw dictionary bytes from `path`, or None when there is no trained dictionary."""
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return None
+
+
+def get_codec():
+    """Codec configured from the environment, using the trained dictionary when present."""
+    return CacheCodec(dictionary=load_dictionary() if zstandard is not None else None)
+
+
+# ============================================================================
+# TRAINING CORPUS
+# ============================================================================
+def document_samples(data):
+    """Encoded cache values for one document: the TOON and JSON responses our prompts expect."""
+    from toon_format import encode
+
+    samples = []
+    for text in (encode(data), json.dumps(data, indent=2), json.dumps(data, separators=(",", ":"))):
+        value = {"text": text, "input_tokens": 1000, "output_tokens": len(text) // 4}
+        samples.append(json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return samples
+
+
+def corpus_samples():
+    """Samples of the few-shot cases, grouped by document (list of lists of bytes)."""
+    from generate_toon_few_shots import test_cases
+
+    return [document_samples(case["data"]) for case in test_cases]
+
+
+def synthetic_samples(documents=40, rows=8):
+    """Samples of small generated documents of every synthetic_corpus.py shape, grouped by document."""
+    from synthetic_corpus import SHAPES, SYNTHETIC_SEED, generate
+
+    return [document_samples(generate(shape, rows, seed=SYNTHETIC_SEED + i))
+            for shape in SHAPES for i in range(documents)]
+
+
+def cache_samples(backend, limit=5000):
+    """Encoded cache values taken from a live cache backend (values of any codec, re-serialized), one per group."""
+    reader = get_codec()
+    samples = []
+    for blob in backend.scan_values(limit):
+        try:
+            value = reader.decode(blob)
+        except CacheCodecError:
+            continue
+        samples.append([json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")])
+    return samples
+
+
+def split_samples(groups, holdout=CACHE_ZSTD_HOLDOUT):
+    """
+    Split sample groups into training and test samples, keeping each document's samples together.
+
+    The split is by content hash, so it is the same on every run over the same corpus
+    and a dictionary trained here is always benchmarked on documents it has not seen.
+
+    Returns:
+        tuple: (train samples, test samples), both flat lists of bytes.
+    """
+    ordered = sorted(groups, key=lambda group: hashlib.sha256(b"".join(group)).digest())
+    held_out = min(len(ordered) - 1, max(1, round(len(ordered) * holdout))) if holdout > 0 and len(ordered) > 1 else 0
+    return ([s for group in ordered[held_out:] for s in group],
+            [s for group in ordered[:held_out] for s in group])
+
+
+def train_dictionary(samples, size=CACHE_ZSTD_DICT_SIZE):
+    """Train a zstd dictionary on `samples` (bytes) and return its raw bytes."""
+    if zstandard is None:
+        raise RuntimeError("❌ Training a dictionary needs the `zstandard` package")
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+def benchmark(samples, dictionary=None, repeat=20):
+    """
+    Compression ratio and per-value compress/decompress time of every available codec.
+
+    Returns:
+        list[dict]: One row per codec.
+    """
+    values = [json.loads(sample) for sample in samples]
+    codecs = [CacheCodec("raw"), CacheCodec("zlib")]
+    if zstandard is not None:
+        codecs.append(CacheCodec("zstd"))
+        if dictionary:
+            codecs.append(CacheCodec("zstd", dictionary=dictionary))
+
+    raw_bytes = sum(len(sample) for sample in samples)
+    rows = []
+    for codec in codecs:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            blobs = [codec.encode(value) for value in values]
+        compress_s = (time.perf_counter() - start) / (repeat * len(values))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for blob in blobs:
+                codec.decode(blob)
+        decompress_s = (time.perf_counter() - start) / (repeat * len(values))
+
+        stored_bytes = sum(len(blob) for blob in blobs)
+        rows.append({
+            "codec": codec.name,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": raw_bytes / stored_bytes if stored_bytes else 0,
+            "compress_us": compress_s * 1e6,
+            "decompress_us": decompress_s * 1e6,
+        })
+    return rows
+
+
+def _open_backend():
+    from llm_cache import open_cache_backend
+    return open_cache_backend()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache value codec: train a zstd dictionary or benchmark the codecs")
+    parser.add_argument("--train", action="store_true", help=f"Train a zstd dictionary and write it to --dict ({CACHE_ZSTD_DICT})")
+    parser.add_argument("--benchmark", action="store_true", help="Report ratio and compress/decompress time per codec")
+    parser.add_argument("--from-cache", action="store_true", help="Use the values in the live cache (Redis / disk) as the corpus")
+    parser.add_argument("--synthetic", action="store_true", help="Use small generated documents of every synthetic_corpus.py shape as the corpus")
+    parser.add_argument("--holdout", type=float, default=CACHE_ZSTD_HOLDOUT,
+                        help=f"Share of the corpus documents kept out of training and benchmarked (default: {CACHE_ZSTD_HOLDOUT})")
+    parser.add_argument("--dict", default=CACHE_ZSTD_DICT, help="Dictionary file")
+    parser.add_argument("--dict-size", type=int, default=CACHE_ZSTD_DICT_SIZE, help="Dictionary size in bytes")
+    parser.add_argument("--repeat", type=int, default=20, help="Benchmark repetitions")
+    args = parser.parse_args(argv)
+    if not (args.train or args.benchmark):
+        parser.error("nothing to do: pass --train and/or --benchmark")
+
+    if args.from_cache:
+        groups, source = cache_samples(_open_backend()), "live cache"
+    elif args.synthetic:
+        groups, source = synthetic_samples(), "synthetic documents"
+    else:
+        groups, source = corpus_samples(), "few-shot cases"
+    train, test = split_samples(groups, args.holdout)
+    if not train:
+        sys.exit("❌ No samples found")
+    print(f"📚 Corpus ({source}): {len(groups)} documents; training on {len(train)} values, {sum(map(len, train)):,} bytes; "
+          f"benchmarking on {len(test)} held-out values, {sum(map(len, test)):,} bytes")
+
+    dictionary = load_dictionary(args.dict)
+    if args.train:
+        dictionary = train_dictionary(train, args.dict_size)
+        os.makedirs(os.path.dirname(args.dict) or ".", exist_ok=True)
+        with open(args.dict, "wb") as f:
+            f.write(dictionary)
+        print(f"✅ Trained {len(dictionary):,}-byte zstd dictionary → {args.dict}")
+        print("   Entries written with a previous dictionary are re-fetched from the model (treated as misses).")
+
+    if args.benchmark:
+        print(f"\n| {'Codec':<10} | {'Raw bytes':>10} | {'Stored bytes':>12} | {'Ratio':>6} | {'Compress':>11} | {'Decompress':>11} |")
+        print("-" * 80)
+        if not test:
+            sys.exit("❌ Nothing held out to benchmark on (--holdout 0 or a single document)")
+        for row in benchmark(test, dictionary=dictionary, repeat=args.repeat):
+            print(f"| {row['codec']:<10} | {row['raw_bytes']:>10,} | {row['stored_bytes']:>12,} | {row['ratio']:>5.2f}x "
+                  f"| {row['compress_us']:>8.1f} µs | {row['decompress_us']:>8.1f} µs |")
+        if dictionary is None and zstandard is not None:
+            print("\n(no dictionary: run with --train to include zstd+dict)")
+
+
+if __name__ == "__main__":
+    main()
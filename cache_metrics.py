@@ -0,0 +1,184 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Where `final_test_gemini_with_caching.py` writes its snapshot (.prom/.txt = Prometheus text, else JSON)
+CACHE_METRICS_FILE = os.getenv("CACHE_METRICS_FILE", "")
+
+# Counter name → Prometheus metric and help text
+FIELDS = {
+    "lookups": ("toon_cache_lookups_total", "Cache lookups"),
+    "hits": ("toon_cache_hits_total", "Lookups answered without calling the model (any tier)"),
+    "local_hits": ("toon_cache_local_hits_total", "Hits served by the in-process LRU tier"),
+    "coalesced": ("toon_cache_coalesced_total", "Hits served by an in-flight fill of the same key"),
+    "misses": ("toon_cache_misses_total", "Lookups that called the model, or joined a fill that failed"),
+    "known_failures": ("toon_cache_known_failures_total", "Lookups answered by a remembered failure (model not called)"),
+    "lookup_s": ("toon_cache_lookup_seconds_total", "Time spent resolving lookups (fills excluded)"),
+    "lookup_s_max": ("toon_cache_lookup_seconds_max", "Slowest lookup"),
+    "bytes_read_stored": ("toon_cache_read_stored_bytes_total", "Compressed bytes read from the shared store"),
+    "bytes_read_raw": ("toon_cache_read_raw_bytes_total", "Uncompressed bytes of the values read from the shared store"),
+    "bytes_written_stored": ("toon_cache_written_stored_bytes_total", "Compressed bytes written to the shared store"),
+    "bytes_written_raw": ("toon_cache_written_raw_bytes_total", "Uncompressed bytes of the values written to the shared store"),
+    "llm_latency_s": ("toon_cache_llm_seconds_total", "Model latency paid on misses"),
+    "saved_latency_s": ("toon_cache_saved_seconds_total", "Model latency avoided by hits (latency recorded when the value was filled)"),
+    "saved_input_tokens": ("toon_cache_saved_input_tokens_total", "Input tokens avoided by hits"),
+    "saved_output_tokens": ("toon_cache_saved_output_tokens_total", "Output tokens avoided by hits"),
+}
+
+
+def raw_size(value):
+    """Uncompressed size of a cache value (the JSON the codec compresses)."""
+    return len(json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+class CacheMetrics:
+    """
+    Thread-safe cache counters grouped by (test case, prompt kind).
+
+    `lookup` records how a key was resolved and what the hit saved (the cached
+    value's `latency_s`, `input_tokens` and `output_tokens`); `filled` records
+    what a miss cost and wrote. `snapshot` aggregates the groups per case, per
+    kind and in total.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    @staticmethod
+    def _empty():
+        return {field: 0 for field in FIELDS}
+
+    def _group(self, case, kind):
+        key = (case or "-", kind or "-")
+        if key not in self._groups:
+            self._groups[key] = self._empty()
+        return self._groups[key]
+
+    def lookup(self, case, kind, outcome, lookup_s, value=None, stored_bytes=None):
+        """
+        Record one lookup.
+
+        Args:
+            case (str): Test case (or batch) the lookup belongs to.
+            kind (str): Prompt kind ("decode" / "encode").
+            outcome (str): "local_hit", "hit" (shared store), "coalesced", "miss" or
+                "known_failure" (negative entry, model not called).
+            lookup_s (float): Seconds spent resolving the key (excluding any model call).
+            value (dict): The cached value for hits.
+            stored_bytes (int): Compressed size, when the value was read from the shared store.
+        """
+        with self._lock:
+            group = self._group(case, kind)
+            group["lookups"] += 1
+            group["lookup_s"] += lookup_s
+            group["lookup_s_max"] = max(group["lookup_s_max"], lookup_s)
+            if outcome == "miss":
+                group["misses"] += 1
+                return
+            if outcome == "known_failure":
+                group["known_failures"] += 1
+                return
+            group["hits"] += 1
+            if outcome == "local_hit":
+                group["local_hits"] += 1
+            elif outcome == "coalesced":
+                group["coalesced"] += 1
+            if stored_bytes is not None:
+                group["bytes_read_stored"] += stored_bytes
+                group["bytes_read_raw"] += raw_size(value)
+            if value:
+                group["saved_latency_s"] += value.get("latency_s") or 0
+                group["saved_input_tokens"] += value.get("input_tokens") or 0
+                group["saved_output_tokens"] += value.get("output_tokens") or 0
+
+    def read(self, case, kind, value, stored_bytes):
+        """Record a value read from the shared store outside a lookup (e.g. the up-front prefetch)."""
+        with self._lock:
+            group = self._group(case, kind)
+            group["bytes_read_stored"] += stored_bytes
+            group["bytes_read_raw"] += raw_size(value)
+
+    def filled(self, case, kind, latency_s, value=None, stored_bytes=None):
+        """Record a model call made for a miss and the value it wrote (if it was cached)."""
+        with self._lock:
+            group = self._group(case, kind)
+            group["llm_latency_s"] += latency_s or 0
+            if stored_bytes is not None:
+                group["bytes_written_stored"] += stored_bytes
+                group["bytes_written_raw"] += raw_size(value)
+
+    @staticmethod
+    def _add(total, group):
+        for field, amount in group.items():
+            total[field] = max(total[field], amount) if field == "lookup_s_max" else total[field] + amount
+
+    @staticmethod
+    def _derived(group):
+        group = dict(group)
+        group["hit_ratio"] = group["hits"] / group["lookups"] if group["lookups"] else 0.0
+        group["lookup_s_mean"] = group["lookup_s"] / group["lookups"] if group["lookups"] else 0.0
+        return group
+
+    def snapshot(self, **meta):
+        """
+        All counters as a JSON-serializable dict:
+            {"generated_at", **meta, "totals": {...}, "by_kind": {kind: {...}}, "cases": {case: {kind: {...}}}}
+        """
+        with self._lock:
+            groups = {key: dict(group) for key, group in self._groups.items()}
+        totals, by_kind, cases = self._empty(), {}, {}
+        for (case, kind), group in groups.items():
+            self._add(totals, group)
+            self._add(by_kind.setdefault(kind, self._empty()), group)
+            cases.setdefault(case, {})[kind] = self._derived(group)
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            **meta,
+            "totals": self._derived(totals),
+            "by_kind": {kind: self._derived(group) for kind, group in by_kind.items()},
+            "cases": cases,
+        }
+
+    def summary(self):
+        """One summary line with what the cache saved over the run."""
+        totals = self.snapshot()["totals"]
+        return (f"💰 Cache savings: {totals['saved_latency_s']:.1f}s of model time, "
+                f"{totals['saved_input_tokens']:,} input / {totals['saved_output_tokens']:,} output tokens "
+                f"(mean lookup {totals['lookup_s_mean'] * 1000:.1f} ms, {totals['bytes_written_stored']:,} bytes written)")
+
+    def write(self, path, **meta):
+        """Write a snapshot to `path`: Prometheus text format for .prom/.txt, JSON otherwise."""
+        snapshot = self.snapshot(**meta)
+        if os.path.splitext(path)[1].lower() in (".prom", ".txt"):
+            content = format_prometheus(snapshot)
+        else:
+            content = json.dumps(snapshot, indent=2, ensure_ascii=False) + "\n"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+# ============================================================================
+# PROMETHEUS TEXT FORMAT
+# ============================================================================
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(snapshot):
+    """Render a snapshot as Prometheus text exposition format (one series per case and kind)."""
+    lines = []
+    for field, (metric, help_text) in FIELDS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {'gauge' if field == 'lookup_s_max' else 'counter'}")
+        for case, kinds in sorted(snapshot["cases"].items()):
+            for kind, group in sorted(kinds.items()):
+                lines.append(f'{metric}{{case="{_label(case)}",kind="{_label(kind)}"}} {group[field]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,185 @@
+import os
+import time
+import argparse
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from batching import DEFAULT_BATCH_SIZE
+from cache_codec import CacheCodecError
+from llm_cache import NEGATIVE_PREFIX
+from pipeline_runner import DEFAULT_CONCURRENCY, DEFAULT_PREFIX_CACHE, DEFAULT_SYNTHETIC
+from synthetic_corpus import synthetic_cases
+from rate_limiter import estimate_tokens
+import final_test_gemini_with_caching as runner
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Assumed model latency per call when no cached entry has a measured one
+WARMUP_CALL_LATENCY = float(os.getenv("WARMUP_CALL_LATENCY", 10.0))
+
+
+def _duration(seconds):
+    return str(timedelta(seconds=round(seconds)))
+
+
+# ============================================================================
+# PLAN (dry run)
+# ============================================================================
+def build_plan(cases, batch_size=1, concurrency=DEFAULT_CONCURRENCY, call_latency=WARMUP_CALL_LATENCY,
+               retry_failures=False):
+    """
+    Check every cache key a `final_test_gemini_with_caching.py` run would use, in one bulk read.
+
+    Nothing is written and no TTL is refreshed. Calls with a remembered failure
+    (negative entry) are skipped by a run, so they are not planned unless `retry_failures`.
+
+    Returns:
+        dict: {"calls": every planned call (see `plan_cache_calls`), "missing": the calls that
+            need a real API call, "cached": number of keys already cached, "known_failures":
+            the calls skipped because of a negative entry, "input_tokens" /
+            "output_tokens": estimated for the missing calls, "call_latency": seconds assumed
+            per call, "rate_limit": `RateLimiter.estimate_duration`, "latency_seconds",
+            "seconds": overall estimate}
+    """
+    calls = list({call["key"]: call for call in runner.plan_cache_calls(cases, batch_size)}.values())
+    keys = [call["key"] for call in calls]
+    stored = runner.cache.get_many(keys + ([] if retry_failures else [NEGATIVE_PREFIX + key for key in keys]))
+
+    missing, known_failures, latencies = [], [], []
+    for call in calls:
+        value = None
+        if call["key"] in stored:
+            try:
+                value = runner.codec.decode(stored[call["key"]])
+            except CacheCodecError:
+                pass  # unreadable entries are re-fetched by the run, like misses
+        if value is None and NEGATIVE_PREFIX + call["key"] in stored:
+            known_failures.append(call)
+        elif value is None:
+            missing.append(call)
+        elif value.get("latency_s"):
+            latencies.append(value["latency_s"])
+
+    for call in missing:
+        call["input_tokens"] = estimate_tokens(call["template"].render(call["payload"]))
+        call["output_tokens"] = estimate_tokens(call["expected"])
+    input_tokens = sum(call["input_tokens"] for call in missing)
+    output_tokens = sum(call["output_tokens"] for call in missing)
+
+    # Measured latencies of cached entries are the best guess for the missing ones
+    if latencies:
+        call_latency = sorted(latencies)[len(latencies) // 2]
+    rate_limit = runner.client.rate_limiter.estimate_duration(len(missing), input_tokens + output_tokens)
+    waves = -(-len(missing) // max(1, concurrency))
+    latency_seconds = waves * call_latency
+    return {
+        "calls": calls,
+        "missing": missing,
+        "cached": len(calls) - len(missing) - len(known_failures),
+        "known_failures": known_failures,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "call_latency": call_latency,
+        "measured_latency": bool(latencies),
+        "rate_limit": rate_limit,
+        "latency_seconds": latency_seconds,
+        "seconds": max(rate_limit["seconds"], latency_seconds),
+    }
+
+
+def print_plan(plan, concurrency, window_minutes=None):
+    print(f"\n🗺️  CACHE WARM-UP PLAN ({runner.MODEL_NAME}, cache: {runner.cache.description})")
+    print(f"| {'Kind':<8} | {'Keys':>6} | {'Cached':>6} | {'Failed':>6} | {'Missing':>7} | {'Input tok':>10} | {'Output tok':>10} |")
+    print("-" * 75)
+    for kind in ("decode", "encode"):
+        calls = [call for call in plan["calls"] if call["kind"] == kind]
+        failed = [call for call in plan["known_failures"] if call["kind"] == kind]
+        missing = [call for call in plan["missing"] if call["kind"] == kind]
+        print(f"| {kind:<8} | {len(calls):>6} | {len(calls) - len(failed) - len(missing):>6} | {len(failed):>6} | {len(missing):>7} "
+              f"| {sum(c['input_tokens'] for c in missing):>10,} | {sum(c['output_tokens'] for c in missing):>10,} |")
+    if plan["known_failures"]:
+        print(f"\n⛔ {len(plan['known_failures'])} call(s) with a remembered failure are skipped (--retry-failures to include them)")
+
+    rate_limit = plan["rate_limit"]
+    limiter = runner.client.rate_limiter
+    rpm = int(limiter.requests.capacity) if limiter.requests else "unlimited"
+    tpm = int(limiter.tokens.capacity) if limiter.tokens else "unlimited"
+    print(f"\n🌐 Real API calls needed: {len(plan['missing'])} of {len(plan['calls'])} "
+          f"(~{plan['input_tokens'] + plan['output_tokens']:,} tokens)")
+    print(f"⏳ Rate limits ({runner.client.provider}: {rpm} RPM, {tpm} TPM): at least {_duration(rate_limit['seconds'])} "
+          f"(requests {_duration(rate_limit['rpm_seconds'])}, tokens {_duration(rate_limit['tpm_seconds'])})")
+    print(f"🐢 Model latency: {_duration(plan['latency_seconds'])} at concurrency {concurrency}, "
+          f"{plan['call_latency']:.1f}s per call ({'median of cached entries' if plan['measured_latency'] else 'assumed, WARMUP_CALL_LATENCY'})")
+    print(f"🕒 Estimated duration: {_duration(plan['seconds'])}")
+    if window_minutes is not None:
+        fits = plan["seconds"] <= window_minutes * 60
+        print(f"{'✅' if fits else '❌'} {'Fits' if fits else 'Does not fit'} in a {window_minutes:g}-minute window")
+
+
+# ============================================================================
+# WARM (fill only the missing keys)
+# ============================================================================
+def warm(missing, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Fill the missing keys through `call_gemini_cached` (same keys, leases and codec as a run).
+
+    Throughput is bounded by the provider rate limiter, which every real call goes through.
+
+    Returns:
+        int: Number of calls that produced a non-empty response.
+    """
+    filled = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(runner.call_gemini_cached, call["template"], call["payload"],
+                            max_tokens=call["max_tokens"], temperature=0.0, case=call["case"]): call
+            for call in missing
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            call = futures[future]
+            ok = bool(future.result())
+            filled += ok
+            print(f"[{done}/{len(missing)}] {'✅' if ok else '❌'} {call['kind']:<6} {call['case']}")
+    return filled
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dry-run planner and cache warm-up for final_test_gemini_with_caching.py")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Plan the keys of a run with this batch size (default: {DEFAULT_BATCH_SIZE}, env TOON_BATCH_SIZE)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Parallel calls for the estimate and for --warm (default: {DEFAULT_CONCURRENCY}, env TOON_CONCURRENCY)")
+    parser.add_argument("--window", type=float, default=None,
+                        help="Available time in minutes; report whether the run fits in it")
+    parser.add_argument("--warm", action="store_true",
+                        help="Fill the missing keys now, as fast as the rate limits allow")
+    parser.add_argument("--retry-failures", action="store_true",
+                        help="Plan (and warm) calls with a remembered failure too")
+    parser.add_argument("--prefix-cache", action="store_true", default=DEFAULT_PREFIX_CACHE,
+                        help="Send the few-shot preamble as a provider-cached prefix while warming (env TOON_PREFIX_CACHE=1)")
+    parser.add_argument("--synthetic", default=DEFAULT_SYNTHETIC, metavar="SPEC",
+                        help="Plan the generated cases of a run with the same --synthetic spec (env TOON_SYNTHETIC)")
+    args = parser.parse_args(argv)
+    runner.test_data.update(synthetic_cases(args.synthetic))
+
+    plan = build_plan(runner.test_data, batch_size=args.batch_size, concurrency=args.concurrency,
+                      retry_failures=args.retry_failures)
+    print_plan(plan, args.concurrency, args.window)
+    if not args.warm:
+        return
+    if not plan["missing"]:
+        print("\n✅ Nothing to warm: every key is cached")
+        return
+
+    runner.client.prefix_cache = args.prefix_cache
+    runner.RETRY_FAILURES = args.retry_failures
+    print(f"\n🔥 Warming {len(plan['missing'])} keys (concurrency={args.concurrency})")
+    start = time.perf_counter()
+    filled = warm(plan["missing"], concurrency=args.concurrency)
+    print(f"\n🔥 Warmed {filled}/{len(plan['missing'])} keys in {_duration(time.perf_counter() - start)}")
+    print(runner.cache_metrics.summary())
+    print(runner.client.usage_summary())
+
+
+if __name__ == "__main__":
+    main()
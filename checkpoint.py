@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def checkpoint_path(log_file):
+    """Checkpoint file that sits next to a runner's log file."""
+    return os.path.splitext(log_file)[0] + ".checkpoint.jsonl"
+
+
+def case_fingerprint(python_data):
+    """Content hash of a case, so edited test data is never restored from a stale checkpoint."""
+    return hashlib.sha256(json.dumps(python_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ============================================================================
+# PER-CASE CHECKPOINT (append-only JSON lines)
+# ============================================================================
+class Checkpoint:
+    """
+    Persist every finished case as soon as it completes so a crashed run can resume.
+
+    The file holds two kinds of records:
+        {"test_name": ..., "fingerprint": ..., "result": {...}}   case finished
+        {"test_name": ..., "logged": true}                        case written to the log file
+    Each record is flushed and fsync'ed before `save`/`mark_logged` return.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.logged = set()
+        if resume and os.path.exists(path):
+            self._load()
+        else:
+            open(path, "w", encoding="utf-8").close()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write
+                    continue
+                if "result" in record:
+                    self.entries[record["test_name"]] = record
+                elif record.get("logged"):
+                    self.logged.add(record["test_name"])
+
+    def _append(self, record):
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed(self, cases):
+        """Results of the cases in `cases` that finished in a previous run with the same data."""
+        restored = {}
+        for name, python_data in cases.items():
+            entry = self.entries.get(name)
+            if entry and entry["fingerprint"] == case_fingerprint(python_data):
+                restored[name] = dict(entry["result"], resumed=True, already_logged=name in self.logged)
+        return restored
+
+    def save(self, test_name, python_data, result):
+        self._append({"test_name": test_name, "fingerprint": case_fingerprint(python_data), "result": result})
+
+    def mark_logged(self, test_name):
+        if test_name not in self.logged:
+            self.logged.add(test_name)
+            self._append({"test_name": test_name, "logged": True})
@@ -1,20 +1,25 @@
 import os
 import re
 import json
-import time
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from toon_format import encode, decode
+import argparse
+import datetime
+from toon_format import decode
+from pipeline_runner import add_runner_arguments, run_cases_sync, run_parallel, DEFAULT_STREAM
+from synthetic_corpus import synthetic_cases
+from batching import build_batch_suffix, split_batch_response, batch_max_tokens
+from checkpoint import Checkpoint, checkpoint_path
+from ground_truth import ground_truth, ground_truth_summary
+from stream_guard import decode_guard, encode_guard, format_stream_stats, summarize_stream_stats
+from llm_clients import get_client
+from token_counter import get_token_counter
+from size_report import size_matrix, add_size_matrix, format_size_matrix
+from retry_policy import RetryPolicy, RetryError, RETRY_MAX_ATTEMPTS
 from dotenv import load_dotenv
 
 # Load API key from .env file
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("❌ Missing GEMINI_API_KEY in .env file")
 
-# 🔑 CONFIG: Gemini setup
-genai.configure(api_key=api_key)
+# 🔑 CONFIG: Gemini setup (GEMINI_API_KEY is checked by the client)
 MODEL_NAME = "gemini-2.5-flash"  # or "gemini-2.5-flash"
 
 # Sanitize model name for use in filenames
@@ -25,8 +30,13 @@ def sanitize_filename(name):
 safe_model_name = sanitize_filename(MODEL_NAME)
 LOG_FILE = f"full_test_run_log_openrouter_{safe_model_name}.txt"
 
-# Create model instance
-model = genai.GenerativeModel(MODEL_NAME)
+# Create the long-lived client (one model instance, rate limited via GEMINI_RPM / GEMINI_TPM)
+client = get_client("gemini", MODEL_NAME)
+# Token counts for the size report (provider count_tokens, else tiktoken / offline estimate)
+token_counter = get_token_counter(client)
+
+# Stream completions and abort them early once they can no longer pass (--stream)
+STREAM_RESPONSES = DEFAULT_STREAM
 
 # ============================================================================
 # PROMPT 1: JSON → TOON CONVERSION (ENCODING)
@@ -267,68 +277,43 @@ def make_validation_prompt(json_llm, json_original):
     return f'''Compare these two JSON objects. JSON_LLM (decoded by the LLM):\n{json_llm}\n\nJSON_ORIGINAL (the original source data):\n{json_original}\n\nRules:\n- All fields must match exactly in type and value. `null` in JSON is equivalent to Python's `None`.\n- Ignore key order and whitespace.\n\nAre they semantically equivalent?\n\nAnswer ONLY the word "YES" or "NO". Do not add any other text.'''
 
 # ============================================================================
-# GEMINI HELPER FUNCTION (with retry mechanism)
+# GEMINI HELPER FUNCTION (with retry policy: backoff + jitter + Retry-After)
 # ============================================================================
-def call_gemini(prompt, max_tokens=4000, temperature=0.0, retries=3, delay=5):
+def call_gemini(prompt, max_tokens=4000, temperature=0.0, retries=RETRY_MAX_ATTEMPTS,
+                guard_factory=None, stream_stats=None, prefix=None):
     """
     Call Gemini model with a retry mechanism.
 
+    Throttling (429) and server errors (5xx) are retried with jittered exponential
+    backoff (honouring the server's retry delay); permanent failures are not.
+    With STREAM_RESPONSES, the completion is streamed and cut off as soon as the
+    guard built by `guard_factory` reports that it can no longer pass.
+
     Args:
-        prompt (str): The prompt to send to the model.
+        prompt (str): The prompt to send to the model (the part after `prefix`).
         max_tokens (int): The maximum number of tokens to generate.
         temperature (float): The sampling temperature.
-        retries (int): The number of times to retry on failure.
-        delay (int): The number of seconds to wait between retries.
+        retries (int): The maximum number of attempts.
+        guard_factory (callable): Builds a stream guard (see stream_guard.py); streaming only.
+        stream_stats (dict): Filled with latency_s, ttft_s and aborted when given.
+        prefix (str): The static few-shot preamble (cached by Gemini with --prefix-cache).
 
     Returns:
-        str: The model's response text, or an empty string if all retries fail.
+        str: The model's response text (partial if aborted), or an empty string if all retries fail.
     """
-    # Define safety settings to be permissive for this testing script
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    }
-
-    for attempt in range(retries):
-        try:
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=0.95,
-                ),
-                safety_settings=safety_settings
-            )
-            
-            # Check if the response has text
-            result_text = response.text.strip()
-            
-            # SUCCESS CONDITION: If we get non-empty text, return it immediately.
-            if result_text:
-                return result_text
-
-            # If we get here, the response was empty but there was no error.
-            # We'll treat this as a failure and retry.
-            print(f"❗️ API call successful but returned empty content on attempt {attempt + 1} of {retries}.")
-
-        except ValueError:
-            # This catches cases where response.text is invalid due to safety filters, etc.
-            print(f"❗️ API call failed with a ValueError on attempt {attempt + 1} of {retries}.")
-        except Exception as e:
-            # Catch any other unexpected errors (e.g., network issues)
-            print(f"❗️ An unexpected error occurred on attempt {attempt + 1} of {retries}: {e}")
-
-        # If this isn't the last attempt, wait before retrying.
-        if attempt < retries - 1:
-            print(f"   Retrying in {delay} seconds...")
-            time.sleep(delay)
-
-    # If the loop completes without a successful return, all retries have failed.
-    print(f"❌ All {retries} retry attempts failed for the prompt.")
-    return "" # Return empty string as the final failure signal
+    try:
+        response = client.generate(prompt, max_tokens=max_tokens, temperature=temperature,
+                                   retry_policy=RetryPolicy(max_attempts=retries),
+                                   stream=STREAM_RESPONSES, guard_factory=guard_factory, prefix=prefix)
+        if stream_stats is not None:
+            stream_stats.update(latency_s=response["latency_s"], ttft_s=response.get("ttft_s"),
+                                aborted=response.get("aborted"))
+        if response.get("aborted"):
+            print(f"⏹️  Generation aborted early: {response['aborted']}")
+        return response["text"]
+    except RetryError as e:
+        print(f"❌ Giving up on the prompt after {e.attempts} attempt(s): {e}")
+        return "" # Return empty string as the final failure signal
 
 # ============================================================================
 # MODIFIED TEST FUNCTION (uses programmatic validation and rate-limit delays)
@@ -339,18 +324,76 @@ def run_test_case(python_data, test_name="Test"):
     print('='*90)
 
     # --- Ground Truth Generation ---
-    json_A_original = json.dumps(python_data, indent=2)
-    toon_out_official = encode(python_data)
+    truth = ground_truth(python_data)  # memoized by content hash
+    json_A_original = truth["json_pretty"]
+    toon_out_official = truth["toon"]
 
     # ===========================================================
-    # PART 1: DECODING TEST (TOON → JSON)
+    # LLM CALLS: both legs are independent, so dispatch them together
     # ===========================================================
-    print(">>> RUNNING DECODING TEST (TOON → JSON)")
-    conv_prompt = toon_to_json_prompt_base + "\n" + toon_out_official
-    json_B_from_llm = call_gemini(conv_prompt, max_tokens=4000, temperature=0.0)
+    print(">>> RUNNING DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    stream_stats = {"decode": {}, "encode": {}}
+    json_B_from_llm, toon_out_from_llm = run_parallel(
+        lambda: call_gemini(toon_out_official, max_tokens=4000, temperature=0.0, prefix=toon_to_json_prompt_base,
+                            guard_factory=lambda: decode_guard(python_data), stream_stats=stream_stats["decode"]),
+        lambda: call_gemini(json_A_original, max_tokens=4000, temperature=0.0, prefix=json_to_toon_prompt_base,
+                            guard_factory=lambda: encode_guard(toon_out_official, python_data), stream_stats=stream_stats["encode"]),
+    )
+    return evaluate_test_case(python_data, test_name, json_A_original, toon_out_official, json_B_from_llm, toon_out_from_llm,
+                              stream_stats=stream_stats if STREAM_RESPONSES else None)
+
+# ============================================================================
+# BATCHED TEST FUNCTION (N cases per request, preamble sent once)
+# ============================================================================
+def run_test_batch(batch):
+    """
+    Run several test cases with one decoding and one encoding request in total.
+
+    Args:
+        batch (dict): Mapping of test name → python data.
+
+    Returns:
+        dict: Mapping of test name → result dict (same shape as `run_test_case`).
+    """
+    names = list(batch)
+    print(f"\n{'='*90}")
+    print(f"🧪 RUNNING BATCH OF {len(names)}: {', '.join(names)}")
+    print('='*90)
+
+    # --- Ground Truth Generation ---
+    truths = [ground_truth(batch[name]) for name in names]
+    json_originals = [truth["json_pretty"] for truth in truths]
+    toon_officials = [truth["toon"] for truth in truths]
+
+    print(">>> RUNNING BATCHED DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    conv_suffix = build_batch_suffix(toon_officials)
+    encode_suffix = build_batch_suffix(json_originals)
+    max_tokens = batch_max_tokens(4000, len(names))
+    decode_response, encode_response = run_parallel(
+        lambda: call_gemini(conv_suffix, max_tokens=max_tokens, temperature=0.0, prefix=toon_to_json_prompt_base),
+        lambda: call_gemini(encode_suffix, max_tokens=max_tokens, temperature=0.0, prefix=json_to_toon_prompt_base),
+    )
+    decoded_parts = split_batch_response(decode_response, len(names))
+    encoded_parts = split_batch_response(encode_response, len(names))
+
+    return {
+        name: evaluate_test_case(batch[name], name, json_originals[i], toon_officials[i], decoded_parts[i], encoded_parts[i])
+        for i, name in enumerate(names)
+    }
+
+# ============================================================================
+# VALIDATION + LOGGING (shared by single and batched runs)
+# ============================================================================
+def evaluate_test_case(python_data, test_name, json_A_original, toon_out_official, json_B_from_llm, toon_out_from_llm,
+                       stream_stats=None):
+    """Validate one case's LLM outputs against the ground truth and build its log entry."""
     # Clean markdown
     json_B_from_llm = json_B_from_llm.replace("```json", "").replace("```", "").strip()
+    toon_out_from_llm = toon_out_from_llm.replace("```toon", "").replace("```", "").strip()
 
+    # ===========================================================
+    # PART 1: DECODING TEST (TOON → JSON)
+    # ===========================================================
     decode_passed = False
     if not json_B_from_llm:
         print("   [ERROR] LLM returned an empty string for JSON decoding.")
@@ -369,18 +412,9 @@ def run_test_case(python_data, test_name="Test"):
             print(f"   [ERROR] An unexpected error occurred during JSON validation: {e}")
             decode_passed = False
 
-    # === ADD A SMALL DELAY TO RESPECT RATE LIMITS ===
-    print("   ...waiting 5s before next API call...")
-    time.sleep(5)
-
     # ===========================================================
     # PART 2: ENCODING TEST (JSON → TOON)
     # ===========================================================
-    print("\n>>> RUNNING ENCODING TEST (JSON → TOON)")
-    encode_prompt = json_to_toon_prompt_base + "\n" + json_A_original
-    toon_out_from_llm = call_gemini(encode_prompt, max_tokens=4000, temperature=0.0)
-    toon_out_from_llm = toon_out_from_llm.replace("```toon", "").replace("```", "").strip()
-
     encode_passed = False
     if not toon_out_from_llm:
         print("   [ERROR] LLM returned an empty string for TOON encoding.")
@@ -399,6 +433,11 @@ def run_test_case(python_data, test_name="Test"):
     json_bytes = len(json_A_original.encode('utf-8'))
     toon_bytes = len(toon_out_official.encode('utf-8'))
     reduction = (1 - toon_bytes / json_bytes) * 100 if json_bytes > 0 else 0
+    json_tokens = token_counter.count(json_A_original)
+    toon_tokens = token_counter.count(toon_out_official)
+    token_reduction = (1 - toon_tokens / json_tokens) * 100 if json_tokens > 0 else 0
+    # Every JSON baseline and TOON encoder option: raw, gzip, zstd and tokens
+    sizes = size_matrix(python_data, token_counter)
 
     # === LOG EVERYTHING TO FILE ===
     log_lines = []
@@ -420,21 +459,36 @@ def run_test_case(python_data, test_name="Test"):
     
     # Add metrics to log
     log_lines.append(f"\n📊 MEMORY COMPARISON (for this case)")
-    log_lines.append(f"  JSON size  : {json_bytes:,} bytes")
-    log_lines.append(f"  TOON size  : {toon_bytes:,} bytes")
-    log_lines.append(f"  Reduction  : {reduction:.1f}%")
+    log_lines.append(f"  JSON size  : {json_bytes:,} bytes, {json_tokens:,} tokens")
+    log_lines.append(f"  TOON size  : {toon_bytes:,} bytes, {toon_tokens:,} tokens")
+    log_lines.append(f"  Reduction  : {reduction:.1f}% bytes, {token_reduction:.1f}% tokens")
+    log_lines.append(f"\n📏 WIRE SIZE (for this case)")
+    log_lines += format_size_matrix(sizes)
+
+    if stream_stats:
+        log_lines.append(format_stream_stats(stream_stats))
     
     log_lines.append(f"\n✅ RESULTS FOR: {test_name}")
     log_lines.append(f"  DECODING (TOON → JSON) : {'PASS' if decode_passed else 'FAIL'}")
     log_lines.append(f"  ENCODING (JSON → TOON) : {'PASS' if encode_passed else 'FAIL'}")
     log_lines.append("="*90)
 
+    # Printed and written to LOG_FILE by the runner, in test_data order
     full_log = "\n".join(log_lines)
-    print(full_log)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(full_log + "\n")
 
-    return decode_passed, encode_passed, json_bytes, toon_bytes
+    return {
+        "decode_passed": decode_passed,
+        "encode_passed": encode_passed,
+        "json_bytes": json_bytes,
+        "toon_bytes": toon_bytes,
+        "json_tokens": json_tokens,
+        "toon_tokens": toon_tokens,
+        "size_matrix": sizes,
+        "llm_decoded_json": json_B_from_llm,
+        "llm_encoded_toon": toon_out_from_llm,
+        "log": full_log,
+        "stream_stats": stream_stats,
+    }
 
 # ============================================================================
 # TEST CASES (Unchanged)
@@ -453,66 +507,106 @@ test_data = {
     "Ambiguous Data Types": {"product_id":"007","quantity":25,"is_active":"true","version":"1.0","null_value":"null"}
 }
 
+# ============================================================================
+# RUNNER WORKER
+# ============================================================================
+def run_test_case_worker(test_name, python_data):
+    """Runner worker: adapt run_test_case to the runner's (name, data) call order."""
+    return run_test_case(python_data, test_name)
+
 # ============================================================================
 # RUNNER WITH FULL METRICS LOGGING
 # ============================================================================
-import datetime
-start_time = datetime.datetime.now()
-with open(LOG_FILE, "w", encoding="utf-8") as f:
-    f.write(f"TOON Format Validation - Full Test Log\n")
-    f.write(f"Run started at: {start_time}\n")
-    f.write(f"Model: {MODEL_NAME}\n")
-    f.write("="*90 + "\n\n")
-
-print(f"🚀 STARTING ROBUST TOON VALIDATION PIPELINE ({MODEL_NAME})")
-results = {}
-total_json_bytes = 0
-total_toon_bytes = 0
-
-for test_name, python_data in test_data.items():
-    decode_passed, encode_passed, json_bytes, toon_bytes = run_test_case(python_data, test_name)
-    results[test_name] = (decode_passed, encode_passed)
-    total_json_bytes += json_bytes
-    total_toon_bytes += toon_bytes
-
-    # ADDED DELAY TO AVOID RATE LIMITING
-    print("\n⏳ Waiting 60 seconds to respect API rate limits (2 RPM)...")
-    time.sleep(60)
-
-# Final metrics
-total_reduction = (1 - total_toon_bytes / total_json_bytes) * 100 if total_json_bytes > 0 else 0
-overall_passed = all(decode and encode for decode, encode in results.values())
-
-# Build final summary for log
-summary_lines = []
-summary_lines.append("\n" + "="*90)
-summary_lines.append("🎯 FINAL SUMMARY")
-summary_lines.append("="*90)
-summary_lines.append(f"| {'Test Case':<30} | {'DECODE':<10} | {'ENCODE':<10} |")
-summary_lines.append("-"*55)
-for test_name, (decode_passed, encode_passed) in results.items():
-    decode_status = 'PASS' if decode_passed else 'FAIL'
-    encode_status = 'PASS' if encode_passed else 'FAIL'
-    summary_lines.append(f"| {test_name:<30} | {decode_status:<10} | {encode_status:<10} |")
-
-summary_lines.append("\n" + "="*58)
-summary_lines.append("📊 AGGREGATE MEMORY ANALYSIS (ALL TEST CASES)")
-summary_lines.append(f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} |")
-summary_lines.append("-"*58)
-summary_lines.append(f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} |")
-summary_lines.append(f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} |")
-
-summary_lines.append(f"\nOVERALL RESULT: {'ALL PASSED' if overall_passed else 'SOME FAILED'}")
-end_time = datetime.datetime.now()
-summary_lines.append(f"\nRun completed at: {end_time}")
-summary_lines.append(f"Total duration: {end_time - start_time}")
-summary_lines.append("="*90)
-
-final_summary = "\n".join(summary_lines)
-print(final_summary)
-
-# Append final summary to log file
-with open(LOG_FILE, "a", encoding="utf-8") as f:
-    f.write(final_summary + "\n")
-
-print(f"\n✅ Full log (including all metrics) saved to: {LOG_FILE}")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = add_runner_arguments(argparse.ArgumentParser(description="TOON validation pipeline (Gemini)"))
+    args = parser.parse_args()
+    test_data.update(synthetic_cases(args.synthetic))
+    STREAM_RESPONSES = args.stream
+    client.prefix_cache = args.prefix_cache
+
+    start_time = datetime.datetime.now()
+    # Finished cases are persisted right away; --resume skips them and keeps the old log
+    checkpoint = Checkpoint(checkpoint_path(LOG_FILE), resume=args.resume)
+    with open(LOG_FILE, "a" if args.resume else "w", encoding="utf-8") as f:
+        if args.resume:
+            f.write(f"\n♻️  Run resumed at: {start_time}\n")
+        f.write(f"TOON Format Validation - Full Test Log\n")
+        f.write(f"Run started at: {start_time}\n")
+        f.write(f"Model: {MODEL_NAME}\n")
+        f.write("="*90 + "\n\n")
+
+    print(f"🚀 STARTING ROBUST TOON VALIDATION PIPELINE ({MODEL_NAME}, concurrency={args.concurrency}, batch size={args.batch_size}, stream={args.stream}, prefix cache={args.prefix_cache})")
+    results = {}
+    all_stream_stats = []
+    total_json_bytes = 0
+    total_toon_bytes = 0
+    total_json_tokens = 0
+    total_toon_tokens = 0
+    total_sizes = {}
+
+    def record_result(test_name, result):
+        global total_json_bytes, total_toon_bytes, total_json_tokens, total_toon_tokens
+        # Cases restored by --resume were already written to the log by the previous run
+        if not result.get("already_logged"):
+            print(result["log"])
+            with open(LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(result["log"] + "\n")
+        results[test_name] = (result["decode_passed"], result["encode_passed"])
+        all_stream_stats.append(result.get("stream_stats"))
+        total_json_bytes += result["json_bytes"]
+        total_toon_bytes += result["toon_bytes"]
+        # Checkpoints written before token counting have no counts
+        total_json_tokens += result.get("json_tokens", 0)
+        total_toon_tokens += result.get("toon_tokens", 0)
+        add_size_matrix(total_sizes, result.get("size_matrix"))
+
+    run_cases_sync(test_data, run_test_case_worker, concurrency=args.concurrency, on_result=record_result,
+                   batch_size=args.batch_size, batch_worker=run_test_batch, checkpoint=checkpoint)
+
+    # Final metrics
+    total_reduction = (1 - total_toon_bytes / total_json_bytes) * 100 if total_json_bytes > 0 else 0
+    total_token_reduction = (1 - total_toon_tokens / total_json_tokens) * 100 if total_json_tokens > 0 else 0
+    overall_passed = all(decode and encode for decode, encode in results.values())
+
+    # Build final summary for log
+    summary_lines = []
+    summary_lines.append("\n" + "="*90)
+    summary_lines.append("🎯 FINAL SUMMARY")
+    summary_lines.append("="*90)
+    summary_lines.append(f"| {'Test Case':<30} | {'DECODE':<10} | {'ENCODE':<10} |")
+    summary_lines.append("-"*55)
+    for test_name, (decode_passed, encode_passed) in results.items():
+        decode_status = 'PASS' if decode_passed else 'FAIL'
+        encode_status = 'PASS' if encode_passed else 'FAIL'
+        summary_lines.append(f"| {test_name:<30} | {decode_status:<10} | {encode_status:<10} |")
+
+    summary_lines.append("\n" + "="*95)
+    summary_lines.append("📊 AGGREGATE MEMORY ANALYSIS (ALL TEST CASES)")
+    summary_lines.append(f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} | {'Total Tokens':<14} | {'Reduction':<12} |")
+    summary_lines.append("-"*95)
+    summary_lines.append(f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} | {total_json_tokens:<14,} | {'-':<12} |")
+    summary_lines.append(f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} | {total_toon_tokens:<14,} | {f'{total_token_reduction:.1f}%':<12} |")
+    summary_lines.append("\n📏 AGGREGATE WIRE SIZE (ALL TEST CASES)")
+    summary_lines += format_size_matrix(total_sizes)
+
+    stream_summary = summarize_stream_stats(all_stream_stats)
+    if stream_summary:
+        summary_lines.append("\n" + stream_summary)
+    summary_lines.append("\n" + client.usage_summary())
+    summary_lines.append(token_counter.summary())
+    summary_lines.append(ground_truth_summary())
+
+    summary_lines.append(f"\nOVERALL RESULT: {'ALL PASSED' if overall_passed else 'SOME FAILED'}")
+    end_time = datetime.datetime.now()
+    summary_lines.append(f"\nRun completed at: {end_time}")
+    summary_lines.append(f"Total duration: {end_time - start_time}")
+    summary_lines.append("="*90)
+
+    final_summary = "\n".join(summary_lines)
+    print(final_summary)
+
+    # Append final summary to log file
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(final_summary + "\n")
+
+    print(f"\n✅ Full log (including all metrics) saved to: {LOG_FILE}")
\ No newline at end of file
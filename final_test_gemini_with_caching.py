@@ -1,27 +1,44 @@
 import os
 import re
 import json
+import argparse
 import time
-import hashlib
-import zlib
-import redis
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from toon_format import encode, decode
+from toon_format import decode
+from pipeline_runner import add_runner_arguments, run_cases_sync, run_parallel, DEFAULT_STREAM
+from synthetic_corpus import synthetic_cases
+from batching import split_batch_response, batch_max_tokens, chunk_names
+from checkpoint import Checkpoint, checkpoint_path
+from ground_truth import ground_truth, ground_truth_summary
+from llm_clients import get_client, failure_class
+from token_counter import get_token_counter
+from size_report import size_matrix, add_size_matrix, format_size_matrix
+from llm_cache import (SingleFlight, LRUCache, PromptTemplate, open_cache_backend, make_cache_key, key_report,
+                       NEGATIVE_PREFIX, NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_CLASSES, CACHE_TTL, LOCAL_CACHE_HIT_FLUSH)
+from cache_codec import CacheCodecError, get_codec
+from cache_metrics import CacheMetrics, CACHE_METRICS_FILE
+from retry_policy import RetryPolicy, RetryError, RETRY_MAX_ATTEMPTS
+from stream_guard import decode_guard, encode_guard, format_stream_stats, summarize_stream_stats
 
 # ----------------------------
 # LOAD CONFIG
 # ----------------------------
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("❌ Missing GEMINI_API_KEY in .env file")
-
-genai.configure(api_key=api_key)
 MODEL_NAME = "gemini-2.5-flash"
 
+# Long-lived Gemini client (checks GEMINI_API_KEY; rate limited via GEMINI_RPM / GEMINI_TPM on cache misses)
+client = get_client("gemini", MODEL_NAME)
+# Token counts for the size report (provider count_tokens, else tiktoken / offline estimate)
+token_counter = get_token_counter(client)
+
+# Stream cache-miss completions and abort them early once they can no longer pass (--stream)
+STREAM_RESPONSES = DEFAULT_STREAM
+
+# Call the model even for prompts whose last attempt failed deterministically (--retry-failures)
+RETRY_FAILURES = False
+
 # Sanitize model name for log file
 def sanitize_filename(name):
     return re.sub(r'[\\/*?:"<>|]', "_", name)
@@ -30,30 +47,83 @@ safe_model_name = sanitize_filename(MODEL_NAME)
 LOG_FILE = f"full_test_run_log_{safe_model_name}_final_caching.txt"
 
 # ----------------------------
-# REDIS SETUP
+# CACHE SETUP (Redis, or the on-disk store when Redis is unreachable; see CACHE_BACKEND)
 # ----------------------------
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_TTL = 3600  # 1 hour (sliding)
+# Sliding TTL (CACHE_TTL, default 1 hour) and optional byte budget with LFU eviction (CACHE_MAX_BYTES)
+cache = open_cache_backend()
+
+# Cache stats (shared by concurrent workers); "coalesced" counts hits served by
+# another worker's or another process's in-flight LLM call, "local_hits" counts
+# hits served by the in-process LRU tier without touching the shared store,
+# "known_failures" counts prompts skipped because of a negative cache entry
+cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "local_hits": 0, "known_failures": 0}
+_cache_stats_lock = threading.Lock()
+
+def _record_cache_event(event, case_stats=None):
+    with _cache_stats_lock:
+        cache_stats[event] += 1
+        if case_stats is not None:
+            case_stats[event] = case_stats.get(event, 0) + 1
 
-try:
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=2)
-    r.ping()
-    print("✅ Connected to Redis")
-except Exception as e:
-    raise RuntimeError(f"❌ Redis connection failed: {e}")
+# Per case / prompt kind: lookup latency, value sizes, model time and tokens saved (--metrics-file)
+cache_metrics = CacheMetrics()
 
-# Cache stats
-cache_stats = {"hits": 0, "misses": 0}
+# One in-flight LLM call per cache key inside this process
+_inflight = SingleFlight()
+
+# Hot keys are served from memory (LOCAL_CACHE_MAX_ENTRIES / LOCAL_CACHE_MAX_BYTES),
+# expiring CACHE_TTL after the shared read or write that stored them
+local_cache = LRUCache(ttl=CACHE_TTL)
+
+
+def flush_local_hits(force=False):
+    """Report local hits to the shared store (TTL refresh + LFU count) every LOCAL_CACHE_HIT_FLUSH hits, or now."""
+    if force or local_cache.pending_hits >= LOCAL_CACHE_HIT_FLUSH:
+        cache.record_hits(local_cache.drain_hits(), CACHE_TTL)
 
 # ----------------------------
-# COMPRESSION HELPERS
+# COMPRESSION HELPERS (zstd + trained dictionary when available; see cache_codec.py)
 # ----------------------------
+codec = get_codec()
+
 def _compress_cache_value(data: dict) -> bytes:
-    return zlib.compress(json.dumps(data).encode("utf-8"))
+    return codec.encode(data)
 
-def _decompress_cache_value(compressed: bytes) -> dict:
-    return json.loads(zlib.decompress(compressed).decode("utf-8"))
+def _decompress_cache_value(compressed: bytes):
+    """Decoded value, or None for an entry this codec cannot read (treated as a miss)."""
+    try:
+        return codec.decode(compressed)
+    except CacheCodecError as e:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️  Unreadable cache entry ({e}) - treating as a miss")
+        return None
+
+# ----------------------------
+# NEGATIVE CACHE (prompts that failed deterministically; NEGATIVE_CACHE_TTL seconds)
+# ----------------------------
+def _known_failure(cache_key):
+    """The negative entry for `cache_key` ({"failure", "error", "attempts", "at"}), or None."""
+    compressed = cache.get(NEGATIVE_PREFIX + cache_key)
+    if not compressed:
+        return None
+    try:
+        return codec.decode(compressed)
+    except CacheCodecError:
+        return None
+
+def _remember_failure(cache_key, error):
+    """Store a negative entry when a RetryError's final failure says something about the prompt itself."""
+    failure = failure_class(error.last_error)
+    if failure not in NEGATIVE_CACHE_CLASSES:
+        return
+    entry = {
+        "failure": failure,
+        "error": f"{type(error.last_error).__name__}: {error.last_error}"[:300],
+        "attempts": error.attempts,
+        "at": datetime.now().isoformat(timespec="seconds"),
+    }
+    # Fixed TTL (never touched), so a remembered failure always expires
+    cache.set(NEGATIVE_PREFIX + cache_key, codec.encode(entry), NEGATIVE_CACHE_TTL)
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🚫 Remembering {failure} failure for {NEGATIVE_CACHE_TTL}s")
 
 # ============================================================================
 # PROMPT 1: JSON → TOON CONVERSION (ENCODING)
@@ -287,83 +357,301 @@ JSON:
 Now convert the following TOON to JSON. Output ONLY valid JSON. No extra text.
 '''
 
+# ----------------------------
+# VERSIONED TEMPLATES (cache keys = template version + fingerprint + canonical payload)
+# Bump a version when its prompt changes on purpose; whitespace-only edits keep the cache.
+# ----------------------------
+JSON_TO_TOON_TEMPLATE = PromptTemplate("json_to_toon", json_to_toon_prompt_base, version=1)
+TOON_TO_JSON_TEMPLATE = PromptTemplate("toon_to_json", toon_to_json_prompt_base, version=1)
+# Prompt kind reported in the cache metrics
+TEMPLATE_KINDS = {TOON_TO_JSON_TEMPLATE.name: "decode", JSON_TO_TOON_TEMPLATE.name: "encode"}
+
 # ----------------------------
 # CACHED LLM CALL
 # ----------------------------
-def call_gemini_cached(prompt, max_tokens=4000, temperature=0.0, retries=3, delay=5):
-    key_str = f"toon:{MODEL_NAME}:{max_tokens}:{temperature}:{prompt}"
-    cache_key = hashlib.sha256(key_str.encode("utf-8")).hexdigest()
-
-    # Check cache with sliding TTL
-    compressed = r.get(cache_key)
-    if compressed:
-        r.expire(cache_key, REDIS_TTL)  # Refresh TTL
-        cache_stats["hits"] += 1
+def call_gemini_cached(template, payload, max_tokens=4000, temperature=0.0, retries=RETRY_MAX_ATTEMPTS, case_stats=None,
+                       guard_factory=None, stream_stats=None, case=None):
+    """
+    Call Gemini through the two cache tiers.
+
+    Args:
+        template (PromptTemplate): The few-shot preamble.
+        payload (str | list[str]): The input, or the inputs of a batch; the prompt is
+            only rendered on a cache miss, with the preamble as the provider-cached prefix
+            under --prefix-cache.
+        case (str): Test case (or batch) name the call is reported under in the cache metrics.
+    """
+    kind = TEMPLATE_KINDS.get(template.name, template.name)
+    start = time.perf_counter()
+    cache_key = make_cache_key(MODEL_NAME, template, payload, max_tokens, temperature)
+
+    # Tier 1: in-process LRU (no network round trip, no decompression)
+    cached = local_cache.get(cache_key)
+    if cached is not None:
+        _record_cache_event("hits", case_stats)
+        _record_cache_event("local_hits", case_stats)
+        cache_metrics.lookup(case, kind, "local_hit", time.perf_counter() - start, value=cached)
+        flush_local_hits()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚡ LOCAL CACHE HIT")
+        return cached["text"]
+
+    # Tier 2: shared store (Redis or disk), TTL refreshed in the same command
+    compressed = cache.get_touch(cache_key, CACHE_TTL)
+    cached = _decompress_cache_value(compressed) if compressed else None
+    if cached is not None:
+        local_cache.put(cache_key, cached)
+        _record_cache_event("hits", case_stats)
+        cache_metrics.lookup(case, kind, "hit", time.perf_counter() - start, value=cached, stored_bytes=len(compressed))
         print(f"[{datetime.now().strftime('%H:%M:%S')}] 🗃️ CACHE HIT")
-        return _decompress_cache_value(compressed)["text"]
-
-    cache_stats["misses"] += 1
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🌐 CACHE MISS → calling LLM")
-
-    for attempt in range(retries):
+        return cached["text"]
+
+    # Known deterministic failure: fail fast instead of spending every retry on it again
+    failure = None if RETRY_FAILURES else _known_failure(cache_key)
+    if failure is not None:
+        _record_cache_event("known_failures", case_stats)
+        cache_metrics.lookup(case, kind, "known_failure", time.perf_counter() - start)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⛔ KNOWN FAILURE ({failure['failure']} after {failure['attempts']} "
+              f"attempt(s) at {failure['at']}) - skipped, use --retry-failures to call the model")
+        return ""
+
+    # Single-flight: concurrent workers asking for the same key share one fill
+    lookup_s = time.perf_counter() - start
+    (value, called_llm, stored_bytes), shared = _inflight.do(
+        cache_key, lambda: _fill_cache_entry(cache_key, template, payload, max_tokens, temperature, retries,
+                                             guard_factory, stream_stats))
+    if shared and called_llm and stored_bytes is None:
+        # The fill we joined failed or was aborted: nothing was cached, so this is no hit
+        _record_cache_event("misses", case_stats)
+        cache_metrics.lookup(case, kind, "miss", time.perf_counter() - start)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔗 Joined an in-flight request that failed or was aborted")
+    elif shared or not called_llm:
+        _record_cache_event("hits", case_stats)
+        _record_cache_event("coalesced")
+        # Waiting for someone else's fill is lookup time too
+        cache_metrics.lookup(case, kind, "coalesced", time.perf_counter() - start, value=value)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔗 CACHE COALESCED (served by an in-flight request)")
+    else:
+        _record_cache_event("misses", case_stats)
+        cache_metrics.lookup(case, kind, "miss", lookup_s)
+        cache_metrics.filled(case, kind, value.get("latency_s"), value=value, stored_bytes=stored_bytes)
+    return value["text"]
+
+def _fill_cache_entry(cache_key, template, payload, max_tokens, temperature, retries, guard_factory=None, stream_stats=None):
+    """
+    Cache-miss path, run by one worker per key: take the cache lease (or wait for
+    the process holding it to write the entry), then call the model and cache it.
+    Streamed completions cut off by their guard are returned but never cached.
+
+    Returns:
+        tuple: (value, called_llm, stored_bytes) where value is the cache value dict
+            ({"text", "input_tokens", "output_tokens", "latency_s"}; only "text" is
+            guaranteed) and stored_bytes is the compressed size written, or None.
+    """
+    token = cache.acquire_lease(cache_key)
+    while token is None:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏳ Another process is filling this key - waiting")
+        compressed = cache.wait_for_fill(cache_key)
+        cached = _decompress_cache_value(compressed) if compressed else None
+        if cached is not None:
+            cache.touch(cache_key, CACHE_TTL)
+            local_cache.put(cache_key, cached)
+            return cached, False, None
+        # The holder gave up (or its lease expired): try to take over
+        token = cache.acquire_lease(cache_key)
+
+    filled = False
+    try:
+        # The previous lease holder may have written the entry just before we took over
+        compressed = cache.get(cache_key)
+        cached = _decompress_cache_value(compressed) if compressed else None
+        if cached is not None:
+            local_cache.put(cache_key, cached)
+            return cached, False, None
+
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 🌐 CACHE MISS → calling LLM")
+        prompt = template.render_suffix(payload)
         try:
-            model = genai.GenerativeModel(MODEL_NAME)
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=0.95,
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
-            )
-            result_text = response.text.strip()
-            if result_text:
-                # Use real token counts if available
-                try:
-                    usage = response.usage_metadata
-                    input_tokens = usage.prompt_token_count
-                    output_tokens = usage.candidates_token_count
-                except:
-                    input_tokens = len(prompt) // 4
-                    output_tokens = len(result_text) // 4
-
-                # Cache with compression
-                cache_value = {"text": result_text, "input_tokens": input_tokens, "output_tokens": output_tokens}
-                r.setex(cache_key, REDIS_TTL, _compress_cache_value(cache_value))
-                return result_text
-
-        except Exception as e:
-            if attempt < retries - 1:
-                time.sleep(delay)
-    return ""
+            response = client.generate(prompt, max_tokens=max_tokens, temperature=temperature,
+                                       retry_policy=RetryPolicy(max_attempts=retries),
+                                       stream=STREAM_RESPONSES, guard_factory=guard_factory, prefix=template.base)
+        except RetryError as e:
+            _remember_failure(cache_key, e)
+            return {"text": ""}, True, None
+
+        result_text = response["text"]
+        if stream_stats is not None:
+            stream_stats.update(latency_s=response["latency_s"], ttft_s=response.get("ttft_s"),
+                                aborted=response.get("aborted"))
+        if response.get("aborted"):
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏹️  Generation aborted early: {response['aborted']}")
+            return {"text": result_text, "latency_s": response["latency_s"]}, True, None
+
+        # Use real token counts if available
+        input_tokens = response["input_tokens"]
+        output_tokens = response["output_tokens"]
+        if input_tokens is None or output_tokens is None:
+            input_tokens = token_counter.count(template.base) + token_counter.count(prompt)
+            output_tokens = token_counter.count(result_text)
+
+        # Cache with compression; latency_s is what a later hit saves
+        cache_value = {"text": result_text, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                       "latency_s": round(response["latency_s"], 3)}
+        local_cache.put(cache_key, cache_value)
+        compressed = _compress_cache_value(cache_value)
+        # Write + lease release in one pipelined round trip
+        cache.set_and_release(cache_key, compressed, CACHE_TTL, token)
+        filled = True
+        return cache_value, True, len(compressed)
+    finally:
+        if not filled:
+            cache.release_lease(cache_key, token)
+
+# ----------------------------
+# RUN PLAN (every cached call a run will make) + PREFETCH (all of them in one pipelined round trip)
+# ----------------------------
+def plan_cache_calls(cases, batch_size=1):
+    """
+    Every `call_gemini_cached` call that `run_test_case` / `run_test_batch` would make for `cases`.
+
+    Returns:
+        list[dict]: One entry per call, in run order, with "case" (test name or batch
+            label), "kind", "template", "payload", "max_tokens", "key" and "expected"
+            (the ground-truth output, used to estimate output tokens).
+    """
+    calls = []
+    if batch_size > 1:
+        for names in chunk_names(cases, batch_size):
+            truths = [ground_truth(cases[name]) for name in names]
+            toon_officials = [truth["toon"] for truth in truths]
+            json_originals = [truth["json_pretty"] for truth in truths]
+            max_tokens = batch_max_tokens(4000, len(names))
+            label = "batch: " + ", ".join(names)
+            calls += [
+                {"case": label, "kind": "decode", "template": TOON_TO_JSON_TEMPLATE, "payload": toon_officials,
+                 "max_tokens": max_tokens, "expected": "\n".join(json_originals)},
+                {"case": label, "kind": "encode", "template": JSON_TO_TOON_TEMPLATE, "payload": json_originals,
+                 "max_tokens": max_tokens, "expected": "\n".join(toon_officials)},
+            ]
+    else:
+        for name, python_data in cases.items():
+            truth = ground_truth(python_data)
+            calls += [
+                {"case": name, "kind": "decode", "template": TOON_TO_JSON_TEMPLATE, "payload": truth["toon"],
+                 "max_tokens": 4000, "expected": truth["json_pretty"]},
+                {"case": name, "kind": "encode", "template": JSON_TO_TOON_TEMPLATE, "payload": truth["json_pretty"],
+                 "max_tokens": 4000, "expected": truth["toon"]},
+            ]
+    for call in calls:
+        call["key"] = make_cache_key(MODEL_NAME, call["template"], call["payload"], call["max_tokens"], 0.0)
+    return calls
+
+
+def prefetch_cache(cases, batch_size=1):
+    """
+    Resolve every cache key the run will ask for up front and load the hits into the local tier.
+
+    Uses the same payloads (and the same batches) as the test functions, so a run
+    served entirely from cache needs one round trip instead of one (or two) per call.
+    Keys that miss are filled as usual when their case runs.
+
+    Returns:
+        tuple: (keys found, keys requested)
+    """
+    kinds = {call["key"]: call["kind"] for call in plan_cache_calls(cases, batch_size)}
+    found = 0
+    for cache_key, compressed in cache.get_many_touch(list(kinds), CACHE_TTL).items():
+        cached = _decompress_cache_value(compressed)
+        if cached is not None:
+            local_cache.put(cache_key, cached)
+            # The hits themselves are counted per case when the cases run
+            cache_metrics.read("(prefetch)", kinds[cache_key], cached, len(compressed))
+            found += 1
+    return found, len(kinds)
 
 # ----------------------------
 # TEST FUNCTION
 # ----------------------------
 def run_test_case(python_data, test_name="Test"):
 
-    # Store initial cache stats
-    initial_misses = cache_stats["misses"]
+    # Per-case cache stats (the global counters are shared by concurrent cases)
+    case_stats = {"hits": 0, "misses": 0, "local_hits": 0}
 
     print(f"\n{'='*90}")
     print(f"🧪 RUNNING: {test_name}")
     print('='*90)
 
-    json_A_original = json.dumps(python_data, indent=2)
-    toon_out_official = encode(python_data)
+    truth = ground_truth(python_data)  # memoized by content hash
+    json_A_original = truth["json_pretty"]
+    toon_out_official = truth["toon"]
+
+    # LLM CALLS (independent legs, dispatched together)
+    print(">>> RUNNING DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    stream_stats = {"decode": {}, "encode": {}}
+    json_B_from_llm, toon_out_from_llm = run_parallel(
+        lambda: call_gemini_cached(TOON_TO_JSON_TEMPLATE, toon_out_official, max_tokens=4000, temperature=0.0, case_stats=case_stats,
+                                   guard_factory=lambda: decode_guard(python_data), stream_stats=stream_stats["decode"], case=test_name),
+        lambda: call_gemini_cached(JSON_TO_TOON_TEMPLATE, json_A_original, max_tokens=4000, temperature=0.0, case_stats=case_stats,
+                                   guard_factory=lambda: encode_guard(toon_out_official, python_data), stream_stats=stream_stats["encode"], case=test_name),
+    )
+    return evaluate_test_case(python_data, test_name, json_A_original, toon_out_official,
+                              json_B_from_llm, toon_out_from_llm, case_stats,
+                              stream_stats=stream_stats if STREAM_RESPONSES else None)
 
-    # DECODING TEST
-    print(">>> RUNNING DECODING TEST (TOON → JSON)")
-    conv_prompt = toon_to_json_prompt_base + "\n" + toon_out_official
-    json_B_from_llm = call_gemini_cached(conv_prompt, max_tokens=4000, temperature=0.0)
+# ----------------------------
+# BATCHED TEST FUNCTION (N cases per request, preamble sent once)
+# ----------------------------
+def run_test_batch(batch):
+    """
+    Run several test cases with one (cached) decoding and encoding request in total.
+
+    The whole batch prompt is one cache entry, so every case in the batch shares
+    the batch's cache stats.
+
+    Args:
+        batch (dict): Mapping of test name → python data.
+
+    Returns:
+        dict: Mapping of test name → result dict (same shape as `run_test_case`).
+    """
+    names = list(batch)
+    batch_stats = {"hits": 0, "misses": 0, "local_hits": 0}
+
+    print(f"\n{'='*90}")
+    print(f"🧪 RUNNING BATCH OF {len(names)}: {', '.join(names)}")
+    print('='*90)
+
+    truths = [ground_truth(batch[name]) for name in names]
+    json_originals = [truth["json_pretty"] for truth in truths]
+    toon_officials = [truth["toon"] for truth in truths]
+    max_tokens = batch_max_tokens(4000, len(names))
+    batch_label = "batch: " + ", ".join(names)
+
+    print(">>> RUNNING BATCHED DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    decode_response, encode_response = run_parallel(
+        lambda: call_gemini_cached(TOON_TO_JSON_TEMPLATE, toon_officials, max_tokens=max_tokens, temperature=0.0,
+                                   case_stats=batch_stats, case=batch_label),
+        lambda: call_gemini_cached(JSON_TO_TOON_TEMPLATE, json_originals, max_tokens=max_tokens, temperature=0.0,
+                                   case_stats=batch_stats, case=batch_label),
+    )
+    decoded_parts = split_batch_response(decode_response, len(names))
+    encoded_parts = split_batch_response(encode_response, len(names))
+
+    return {
+        name: evaluate_test_case(batch[name], name, json_originals[i], toon_officials[i],
+                                 decoded_parts[i], encoded_parts[i], batch_stats)
+        for i, name in enumerate(names)
+    }
+
+# ----------------------------
+# VALIDATION + LOGGING (shared by single and batched runs)
+# ----------------------------
+def evaluate_test_case(python_data, test_name, json_A_original, toon_out_official,
+                       json_B_from_llm, toon_out_from_llm, case_stats, stream_stats=None):
+    """Validate one case's LLM outputs against the ground truth and build its log entry."""
     json_B_from_llm = json_B_from_llm.replace("```json", "").replace("```", "").strip()
+    toon_out_from_llm = toon_out_from_llm.replace("```toon", "").replace("```", "").strip()
 
+    # DECODING TEST
     decode_passed = False
     if json_B_from_llm:
         try:
@@ -373,14 +661,7 @@ def run_test_case(python_data, test_name="Test"):
         except:
             pass
 
-    time.sleep(5)
-
     # ENCODING TEST
-    print("\n>>> RUNNING ENCODING TEST (JSON → TOON)")
-    encode_prompt = json_to_toon_prompt_base + "\n" + json_A_original
-    toon_out_from_llm = call_gemini_cached(encode_prompt, max_tokens=4000, temperature=0.0)
-    toon_out_from_llm = toon_out_from_llm.replace("```toon", "").replace("```", "").strip()
-
     encode_passed = False
     if toon_out_from_llm:
         try:
@@ -392,6 +673,11 @@ def run_test_case(python_data, test_name="Test"):
     json_bytes = len(json_A_original.encode('utf-8'))
     toon_bytes = len(toon_out_official.encode('utf-8'))
     reduction = (1 - toon_bytes / json_bytes) * 100 if json_bytes > 0 else 0
+    json_tokens = token_counter.count(json_A_original)
+    toon_tokens = token_counter.count(toon_out_official)
+    token_reduction = (1 - toon_tokens / json_tokens) * 100 if json_tokens > 0 else 0
+    # Every JSON baseline and TOON encoder option: raw, gzip, zstd and tokens
+    sizes = size_matrix(python_data, token_counter)
 
     log_lines = [
         f"\n{'='*90}",
@@ -410,24 +696,43 @@ def run_test_case(python_data, test_name="Test"):
         "-" * 40,
         toon_out_from_llm,
         f"\n📊 MEMORY COMPARISON (for this case)",
-        f"  JSON size  : {json_bytes:,} bytes",
-        f"  TOON size  : {toon_bytes:,} bytes",
-        f"  Reduction  : {reduction:.1f}%",
+        f"  JSON size  : {json_bytes:,} bytes, {json_tokens:,} tokens",
+        f"  TOON size  : {toon_bytes:,} bytes, {toon_tokens:,} tokens",
+        f"  Reduction  : {reduction:.1f}% bytes, {token_reduction:.1f}% tokens",
+        f"\n📏 WIRE SIZE (for this case)",
+        *format_size_matrix(sizes),
+    ]
+    if stream_stats and any(stream_stats.values()):
+        log_lines.append(format_stream_stats(stream_stats))
+    log_lines += [
         f"\n✅ RESULTS FOR: {test_name}",
         f"  DECODING (TOON → JSON) : {'PASS' if decode_passed else 'FAIL'}",
         f"  ENCODING (JSON → TOON) : {'PASS' if encode_passed else 'FAIL'}",
         "="*90,
     ]
 
+    # Printed and written to LOG_FILE by the runner, in test_data order
     full_log = "\n".join(log_lines)
-    print(full_log)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(full_log + "\n")
 
-    # Calculate how many misses happened in THIS test
-    misses_in_this_test = cache_stats["misses"] - initial_misses
-
-    return decode_passed, encode_passed, json_bytes, toon_bytes, (misses_in_this_test > 0)
+    return {
+        "decode_passed": decode_passed,
+        "encode_passed": encode_passed,
+        "json_bytes": json_bytes,
+        "toon_bytes": toon_bytes,
+        "json_tokens": json_tokens,
+        "toon_tokens": toon_tokens,
+        "size_matrix": sizes,
+        "llm_decoded_json": json_B_from_llm,
+        "llm_encoded_toon": toon_out_from_llm,
+        "cache_stats": case_stats,
+        "stream_stats": stream_stats,
+        "log": full_log,
+    }
+
+
+def run_test_case_worker(test_name, python_data):
+    """Runner worker: adapt run_test_case to the runner's (name, data) call order."""
+    return run_test_case(python_data, test_name)
 
 # ----------------------------
 # TEST DATA (UNCHANGED)
@@ -450,34 +755,83 @@ test_data = {
 # MAIN
 # ----------------------------
 if __name__ == "__main__":
+    parser = add_runner_arguments(argparse.ArgumentParser(description="TOON validation pipeline (Gemini + Redis/disk cache)"))
+    parser.add_argument("--key-report", action="store_true",
+                        help="Print how many cache keys each template version owns, then exit")
+    parser.add_argument("--retry-failures", action="store_true",
+                        help="Call the model again for prompts with a remembered failure (blocked, empty, repeated 5xx)")
+    parser.add_argument("--metrics-file", default=CACHE_METRICS_FILE or os.path.splitext(LOG_FILE)[0] + ".cache_metrics.json",
+                        help="Cache metrics snapshot: Prometheus text for .prom/.txt, JSON otherwise (env CACHE_METRICS_FILE)")
+    args = parser.parse_args()
+    test_data.update(synthetic_cases(args.synthetic))
+
+    if args.key_report:
+        current = {(t.label, t.fingerprint) for t in (JSON_TO_TOON_TEMPLATE, TOON_TO_JSON_TEMPLATE)}
+        print(f"\n🔑 CACHE KEYS BY TEMPLATE VERSION ({cache.description})")
+        print(f"| {'Template':<28} | {'Fingerprint':<12} | {'Keys':>8} | {'Current':<7} |")
+        print("-"*68)
+        for (label, fingerprint), count in key_report(cache):
+            is_current = (label.replace("+batch", ""), fingerprint) in current
+            print(f"| {label:<28} | {fingerprint:<12} | {count:>8,} | {'yes' if is_current else '':<7} |")
+        raise SystemExit(0)
+    STREAM_RESPONSES = args.stream
+    RETRY_FAILURES = args.retry_failures
+    client.prefix_cache = args.prefix_cache
+
     start_time = datetime.now()
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
+    # Finished cases are persisted right away; --resume skips them and keeps the old log
+    checkpoint = Checkpoint(checkpoint_path(LOG_FILE), resume=args.resume)
+    with open(LOG_FILE, "a" if args.resume else "w", encoding="utf-8") as f:
+        if args.resume:
+            f.write(f"\n♻️  Run resumed at: {start_time}\n")
         f.write(f"TOON Format Validation - Full Test Log\n")
         f.write(f"Run started at: {start_time}\n")
-        f.write(f"Model: {MODEL_NAME} | Redis: {REDIS_HOST}:{REDIS_PORT}\n")
+        f.write(f"Model: {MODEL_NAME} | Cache: {cache.description} ({codec.name})\n")
         f.write("="*90 + "\n\n")
 
-    print(f"🚀 STARTING ROBUST TOON VALIDATION PIPELINE ({MODEL_NAME})")
+    print(f"🚀 STARTING ROBUST TOON VALIDATION PIPELINE ({MODEL_NAME}, concurrency={args.concurrency}, batch size={args.batch_size}, stream={args.stream}, prefix cache={args.prefix_cache})")
     results = {}
+    all_stream_stats = []
     total_json_bytes = 0
     total_toon_bytes = 0
-
-    for test_name, python_data in test_data.items():
-        decode_passed, encode_passed, json_bytes, toon_bytes, had_cache_misses = run_test_case(python_data, test_name)
-        results[test_name] = (decode_passed, encode_passed)
-        total_json_bytes += json_bytes
-        total_toon_bytes += toon_bytes
-        
-        # ONLY sleep if we had cache misses (actual LLM calls)
-        if had_cache_misses:
-            print(f"⏳ Had cache misses - sleeping 60 seconds to respect rate limits...")
-            time.sleep(60)
-        else:
-            print(f"⚡ All cache hits - proceeding immediately to next test!")
+    total_json_tokens = 0
+    total_toon_tokens = 0
+    total_sizes = {}
+
+    def record_result(test_name, result):
+        global total_json_bytes, total_toon_bytes, total_json_tokens, total_toon_tokens
+        # Cases restored by --resume were already written to the log by the previous run
+        if not result.get("already_logged"):
+            print(result["log"])
+            with open(LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(result["log"] + "\n")
+        results[test_name] = (result["decode_passed"], result["encode_passed"])
+        all_stream_stats.append(result.get("stream_stats"))
+        total_json_bytes += result["json_bytes"]
+        total_toon_bytes += result["toon_bytes"]
+        # Checkpoints written before token counting have no counts
+        total_json_tokens += result.get("json_tokens", 0)
+        total_toon_tokens += result.get("toon_tokens", 0)
+        add_size_matrix(total_sizes, result.get("size_matrix"))
+
+    # Resolve the whole run's cache keys at once (cases restored by --resume are skipped)
+    restored = checkpoint.completed(test_data)
+    prefetched, prefetch_total = prefetch_cache({name: data for name, data in test_data.items() if name not in restored},
+                                                batch_size=args.batch_size)
+    print(f"🔎 Prefetch: {prefetched}/{prefetch_total} cache keys already cached (one round trip)")
+
+    run_cases_sync(test_data, run_test_case_worker, concurrency=args.concurrency, on_result=record_result,
+                   batch_size=args.batch_size, batch_worker=run_test_batch, checkpoint=checkpoint)
 
     # Final metrics
     total_reduction = (1 - total_toon_bytes / total_json_bytes) * 100 if total_json_bytes > 0 else 0
+    total_token_reduction = (1 - total_toon_tokens / total_json_tokens) * 100 if total_json_tokens > 0 else 0
     overall_passed = all(decode and encode for decode, encode in results.values())
+    stream_summary = summarize_stream_stats(all_stream_stats)
+    local_stats = local_cache.stats()
+    flush_local_hits(force=True)
+    footprint = cache.footprint()
+    budget = f"budget {footprint['max_bytes']:,} bytes, LFU eviction" if footprint["max_bytes"] else "unbounded"
     hit_rate = cache_stats["hits"] / (cache_stats["hits"] + cache_stats["misses"]) if (cache_stats["hits"] + cache_stats["misses"]) > 0 else 0
 
     summary_lines = [
@@ -491,13 +845,28 @@ if __name__ == "__main__":
         summary_lines.append(f"| {test_name:<30} | {'PASS' if decode_passed else 'FAIL':<10} | {'PASS' if encode_passed else 'FAIL':<10} |")
 
     summary_lines += [
-        "\n" + "="*58,
+        "\n" + "="*95,
         "📊 AGGREGATE MEMORY ANALYSIS (ALL TEST CASES)",
-        f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} |",
-        "-"*58,
-        f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} |",
-        f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} |",
-        f"\n📦 Cache Hit Rate: {hit_rate:.1%} ({cache_stats['hits']} hits / {cache_stats['misses']} misses)",
+        f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} | {'Total Tokens':<14} | {'Reduction':<12} |",
+        "-"*95,
+        f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} | {total_json_tokens:<14,} | {'-':<12} |",
+        f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} | {total_toon_tokens:<14,} | {f'{total_token_reduction:.1f}%':<12} |",
+        "\n📏 AGGREGATE WIRE SIZE (ALL TEST CASES)",
+        *format_size_matrix(total_sizes),
+        f"\n📦 Cache Hit Rate: {hit_rate:.1%} ({cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['coalesced']} coalesced, "
+        f"{cache_stats['known_failures']} known failures skipped)",
+        f"⚡ Local LRU tier: {cache_stats['local_hits']} of {cache_stats['hits']} hits served from memory "
+        f"({local_stats['entries']} entries, {local_stats['bytes']:,} bytes, {local_stats['evictions']} evictions)",
+        f"🔎 Prefetch: {prefetched}/{prefetch_total} keys resolved up front",
+        f"💾 Cache footprint: {footprint['entries']} entries, {footprint['bytes']:,} bytes ({budget}, TTL {CACHE_TTL}s)",
+        cache_metrics.summary(),
+        ground_truth_summary(),
+    ]
+    if stream_summary:
+        summary_lines.append(stream_summary)
+    summary_lines.append(client.usage_summary())
+    summary_lines.append(token_counter.summary())
+    summary_lines += [
         f"\nOVERALL RESULT: {'ALL PASSED' if overall_passed else 'SOME FAILED'}",
         f"\nRun completed at: {datetime.now()}",
         f"Total duration: {datetime.now() - start_time}",
@@ -509,4 +878,7 @@ if __name__ == "__main__":
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(final_summary + "\n")
 
+    cache_metrics.write(args.metrics_file, model=MODEL_NAME, backend=cache.description, codec=codec.name,
+                        footprint=footprint)
+    print(f"📈 Cache metrics snapshot saved to: {args.metrics_file}")
     print(f"\n✅ Full log saved to: {LOG_FILE}")
\ No newline at end of file
@@ -1,22 +1,31 @@
 import os
 import re
 import json
-from sambanova import SambaNova
-from toon_format import encode, decode
+import argparse
+import datetime
+from toon_format import decode
+from pipeline_runner import add_runner_arguments, run_cases_sync, run_parallel, DEFAULT_STREAM
+from synthetic_corpus import synthetic_cases
+from batching import build_batch_prompt, build_batch_suffix, split_batch_response, batch_max_tokens
+from checkpoint import Checkpoint, checkpoint_path
+from ground_truth import ground_truth, ground_truth_summary
+from llm_clients import get_client
+from token_counter import get_token_counter
+from size_report import size_matrix, add_size_matrix, format_size_matrix
+from retry_policy import RetryError
+from stream_guard import decode_guard, encode_guard, format_stream_stats, summarize_stream_stats
 from dotenv import load_dotenv
 
 # Load API key from .env file
 load_dotenv()
-api_key = os.getenv("SAMBANOVA_API_KEY")
-if not api_key:
-    raise ValueError("❌ Missing SAMBANOVA_API_KEY in .env file")
-
-# 🔑 CONFIG: SambaNova setup
-client = SambaNova(
-    api_key=api_key,
-    base_url="https://api.sambanova.ai/v1",
-)
+
+# 🔑 CONFIG: SambaNova setup (OpenAI-compatible endpoint, SAMBANOVA_API_KEY is checked by the client)
 MODEL_NAME = "Meta-Llama-3.3-70B-Instruct"
+# Stream completions and abort them early once they can no longer pass (--stream)
+STREAM_RESPONSES = DEFAULT_STREAM
+client = get_client("sambanova", MODEL_NAME)
+# Token counts for the size report (provider count_tokens, else tiktoken / offline estimate)
+token_counter = get_token_counter(client)
 LOG_FILE = "full_test_run_log_sambanova.txt"
 
 # ============================================================================
@@ -249,18 +258,27 @@ def make_validation_prompt(json_llm, json_original):
 # ============================================================================
 # SAMBANOVA HELPER FUNCTION
 # ============================================================================
-def call_sambanova(prompt, max_tokens=1000, temperature=0.0):
-    """Call SambaNova model and return response text."""
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        temperature=temperature,
-        top_p=0.95,
-        max_tokens=max_tokens
-    )
-    return response.choices[0].message.content.strip()
+def call_sambanova(prompt, max_tokens=1000, temperature=0.0, guard_factory=None, stream_stats=None, prefix=None):
+    """
+    Call SambaNova model and return response text (429/5xx are retried with backoff).
+
+    With STREAM_RESPONSES, the completion is streamed and cut off (partial text
+    returned) as soon as the guard built by `guard_factory` reports that it can no
+    longer pass; `stream_stats` is filled with latency_s, ttft_s and aborted.
+    A `prefix` (the few-shot preamble) is sent as a cacheable system message with --prefix-cache.
+    """
+    try:
+        response = client.generate(prompt, max_tokens=max_tokens, temperature=temperature,
+                                   stream=STREAM_RESPONSES, guard_factory=guard_factory, prefix=prefix)
+    except RetryError as e:
+        # Permanent failure or retries exhausted: surface the provider's own exception
+        raise e.last_error from e
+    if stream_stats is not None:
+        stream_stats.update(latency_s=response["latency_s"], ttft_s=response.get("ttft_s"),
+                            aborted=response.get("aborted"))
+    if response.get("aborted"):
+        print(f"⏹️  Generation aborted early: {response['aborted']}")
+    return response["text"]
 
 # ============================================================================
 # MODIFIED TEST FUNCTION (uses call_sambanova)
@@ -270,25 +288,109 @@ def run_test_case(python_data, test_name="Test"):
     print(f"🧪 RUNNING: {test_name}")
     print('='*90)
 
-    json_A_original = json.dumps(python_data, indent=2)
-    toon_out_official = encode(python_data)
+    truth = ground_truth(python_data)  # memoized by content hash
+    json_A_original = truth["json_pretty"]
+    toon_out_official = truth["toon"]
+
+    stream_stats = {"decode": {}, "encode": {}}
+
+    # DECODING LEG (TOON → JSON, then LLM verdict on the decoded JSON)
+    def run_decoding_leg():
+        json_B = call_sambanova(toon_out_official, max_tokens=2000, temperature=0.0, prefix=toon_to_json_prompt_base,
+                                guard_factory=lambda: decode_guard(python_data), stream_stats=stream_stats["decode"])
+        json_B = json_B.replace("```json", "").replace("```", "").strip()
+        if stream_stats["decode"].get("aborted"):
+            # Already known to diverge from the ground truth: no verdict call needed
+            return json_B, False
+        if not json_B:
+            print("   [ERROR] LLM returned an empty string for JSON decoding.")
+            return json_B, False
+
+        val_prompt = make_validation_prompt(json_B, json_A_original)
+        raw_verdict = call_sambanova(val_prompt, max_tokens=20, temperature=0.0)
+        return json_B, re.search(r'\bYES\b', raw_verdict, re.IGNORECASE) is not None
+
+    # ENCODING LEG (JSON → TOON)
+    def run_encoding_leg():
+        toon_out = call_sambanova(json_A_original, max_tokens=2000, temperature=0.0, prefix=json_to_toon_prompt_base,
+                                  guard_factory=lambda: encode_guard(toon_out_official, python_data), stream_stats=stream_stats["encode"])
+        return toon_out.replace("```toon", "").replace("```", "").strip()
+
+    # Both legs are independent: dispatch them together and join before validation
+    print(">>> RUNNING DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    (json_B_from_llm, decode_passed), toon_out_from_llm = run_parallel(run_decoding_leg, run_encoding_leg)
+    return evaluate_test_case(python_data, test_name, json_A_original, toon_out_official,
+                              json_B_from_llm, decode_passed, toon_out_from_llm,
+                              stream_stats=stream_stats if STREAM_RESPONSES else None)
 
-    # DECODING TEST
-    print(">>> RUNNING DECODING TEST (TOON → JSON)")
-    conv_prompt = toon_to_json_prompt_base + "\n" + toon_out_official
-    json_B_from_llm = call_sambanova(conv_prompt, max_tokens=2000, temperature=0.0)
-    json_B_from_llm = json_B_from_llm.replace("```json", "").replace("```", "").strip()
-    
-    val_prompt = make_validation_prompt(json_B_from_llm, json_A_original)
-    raw_verdict = call_sambanova(val_prompt, max_tokens=20, temperature=0.0)
-    decode_passed = re.search(r'\bYES\b', raw_verdict, re.IGNORECASE) is not None
+# ============================================================================
+# BATCHED TEST FUNCTION (N cases per request, preamble sent once)
+# ============================================================================
+def run_test_batch(batch):
+    """
+    Run several test cases with one decoding, one verdict and one encoding request in total.
 
-    # ENCODING TEST
-    print("\n>>> RUNNING ENCODING TEST (JSON → TOON)")
-    encode_prompt = json_to_toon_prompt_base + "\n" + json_A_original
-    toon_out_from_llm = call_sambanova(encode_prompt, max_tokens=2000, temperature=0.0)
-    toon_out_from_llm = toon_out_from_llm.replace("```toon", "").replace("```", "").strip()
+    Args:
+        batch (dict): Mapping of test name → python data.
+
+    Returns:
+        dict: Mapping of test name → result dict (same shape as `run_test_case`).
+    """
+    names = list(batch)
+    print(f"\n{'='*90}")
+    print(f"🧪 RUNNING BATCH OF {len(names)}: {', '.join(names)}")
+    print('='*90)
+
+    truths = [ground_truth(batch[name]) for name in names]
+    json_originals = [truth["json_pretty"] for truth in truths]
+    toon_officials = [truth["toon"] for truth in truths]
+
+    # DECODING LEG (batched TOON → JSON, then batched LLM verdicts)
+    def run_decoding_leg():
+        response = call_sambanova(build_batch_suffix(toon_officials), max_tokens=batch_max_tokens(2000, len(names)),
+                                  temperature=0.0, prefix=toon_to_json_prompt_base)
+        json_Bs = [part.replace("```json", "").replace("```", "").strip()
+                   for part in split_batch_response(response, len(names))]
+
+        # Empty answers fail without a verdict, as in the single-case path
+        judged = [i for i, json_B in enumerate(json_Bs) if json_B]
+        for i in sorted(set(range(len(names))) - set(judged)):
+            print(f"   [ERROR] LLM returned an empty string for JSON decoding ({names[i]}).")
+        verdicts = [False] * len(names)
+        if judged:
+            val_prompt = build_batch_prompt(
+                "You compare pairs of JSON objects. Answer every case on its own.",
+                [make_validation_prompt(json_Bs[i], json_originals[i]) for i in judged],
+            )
+            raw_verdicts = split_batch_response(
+                call_sambanova(val_prompt, max_tokens=batch_max_tokens(20, len(judged)), temperature=0.0), len(judged))
+            for i, verdict in zip(judged, raw_verdicts):
+                verdicts[i] = re.search(r'\bYES\b', verdict, re.IGNORECASE) is not None
+        return json_Bs, verdicts
+
+    # ENCODING LEG (batched JSON → TOON)
+    def run_encoding_leg():
+        response = call_sambanova(build_batch_suffix(json_originals), max_tokens=batch_max_tokens(2000, len(names)),
+                                  temperature=0.0, prefix=json_to_toon_prompt_base)
+        return [part.replace("```toon", "").replace("```", "").strip()
+                for part in split_batch_response(response, len(names))]
+
+    print(">>> RUNNING BATCHED DECODING (TOON → JSON) AND ENCODING (JSON → TOON) TESTS IN PARALLEL")
+    (json_Bs, decode_verdicts), toon_outs = run_parallel(run_decoding_leg, run_encoding_leg)
+
+    return {
+        name: evaluate_test_case(batch[name], name, json_originals[i], toon_officials[i],
+                                 json_Bs[i], decode_verdicts[i], toon_outs[i])
+        for i, name in enumerate(names)
+    }
 
+# ============================================================================
+# VALIDATION + LOGGING (shared by single and batched runs)
+# ============================================================================
+def evaluate_test_case(python_data, test_name, json_A_original, toon_out_official,
+                       json_B_from_llm, decode_passed, toon_out_from_llm, stream_stats=None):
+    """Validate one case's encoding output and build its log entry (decoding was judged by the LLM)."""
+    # ENCODING TEST
     encode_passed = False
     try:
         decoded_llm_toon = decode(toon_out_from_llm)
@@ -302,6 +404,11 @@ def run_test_case(python_data, test_name="Test"):
     json_bytes = len(json_A_original.encode('utf-8'))
     toon_bytes = len(toon_out_official.encode('utf-8'))
     reduction = (1 - toon_bytes / json_bytes) * 100 if json_bytes > 0 else 0
+    json_tokens = token_counter.count(json_A_original)
+    toon_tokens = token_counter.count(toon_out_official)
+    token_reduction = (1 - toon_tokens / json_tokens) * 100 if json_tokens > 0 else 0
+    # Every JSON baseline and TOON encoder option: raw, gzip, zstd and tokens
+    sizes = size_matrix(python_data, token_counter)
 
     # === LOG EVERYTHING TO FILE ===
     log_lines = []
@@ -323,21 +430,36 @@ def run_test_case(python_data, test_name="Test"):
     
     # Add metrics to log
     log_lines.append(f"\n📊 MEMORY COMPARISON (for this case)")
-    log_lines.append(f"  JSON size  : {json_bytes:,} bytes")
-    log_lines.append(f"  TOON size  : {toon_bytes:,} bytes")
-    log_lines.append(f"  Reduction  : {reduction:.1f}%")
+    log_lines.append(f"  JSON size  : {json_bytes:,} bytes, {json_tokens:,} tokens")
+    log_lines.append(f"  TOON size  : {toon_bytes:,} bytes, {toon_tokens:,} tokens")
+    log_lines.append(f"  Reduction  : {reduction:.1f}% bytes, {token_reduction:.1f}% tokens")
+    log_lines.append(f"\n📏 WIRE SIZE (for this case)")
+    log_lines += format_size_matrix(sizes)
+
+    if stream_stats:
+        log_lines.append(format_stream_stats(stream_stats))
     
     log_lines.append(f"\n✅ RESULTS FOR: {test_name}")
     log_lines.append(f"  DECODING (TOON → JSON) : {'PASS' if decode_passed else 'FAIL'}")
     log_lines.append(f"  ENCODING (JSON → TOON) : {'PASS' if encode_passed else 'FAIL'}")
     log_lines.append("="*90)
 
+    # Printed and written to LOG_FILE by the runner, in test_data order
     full_log = "\n".join(log_lines)
-    print(full_log)  # Also print to console
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(full_log + "\n")
 
-    return decode_passed, encode_passed, json_bytes, toon_bytes
+    return {
+        "decode_passed": decode_passed,
+        "encode_passed": encode_passed,
+        "json_bytes": json_bytes,
+        "toon_bytes": toon_bytes,
+        "json_tokens": json_tokens,
+        "toon_tokens": toon_tokens,
+        "size_matrix": sizes,
+        "llm_decoded_json": json_B_from_llm,
+        "llm_encoded_toon": toon_out_from_llm,
+        "log": full_log,
+        "stream_stats": stream_stats,
+    }
 
 # ============================================================================
 # TEST CASES (Unchanged)
@@ -356,62 +478,106 @@ test_data = {
     "Ambiguous Data Types": {"product_id":"007","quantity":25,"is_active":"true","version":"1.0","null_value":"null"}
 }
 
+# ============================================================================
+# RUNNER WORKER
+# ============================================================================
+def run_test_case_worker(test_name, python_data):
+    """Runner worker: adapt run_test_case to the runner's (name, data) call order."""
+    return run_test_case(python_data, test_name)
+
 # ============================================================================
 # RUNNER WITH FULL METRICS LOGGING
 # ============================================================================
-import datetime
-start_time = datetime.datetime.now()
-with open(LOG_FILE, "w", encoding="utf-8") as f:
-    f.write(f"TOON Format Validation - Full Test Log\n")
-    f.write(f"Run started at: {start_time}\n")
-    f.write(f"Model: {MODEL_NAME}\n")
-    f.write("="*90 + "\n\n")
-
-print("🚀 STARTING ROBUST TOON VALIDATION PIPELINE (SambaNova)")
-results = {}
-total_json_bytes = 0
-total_toon_bytes = 0
-
-for test_name, python_data in test_data.items():
-    decode_passed, encode_passed, json_bytes, toon_bytes = run_test_case(python_data, test_name)
-    results[test_name] = (decode_passed, encode_passed)
-    total_json_bytes += json_bytes
-    total_toon_bytes += toon_bytes
-
-# Final metrics
-total_reduction = (1 - total_toon_bytes / total_json_bytes) * 100 if total_json_bytes > 0 else 0
-overall_passed = all(decode and encode for decode, encode in results.values())
-
-# Build final summary for log
-summary_lines = []
-summary_lines.append("\n" + "="*90)
-summary_lines.append("🎯 FINAL SUMMARY")
-summary_lines.append("="*90)
-summary_lines.append(f"| {'Test Case':<30} | {'DECODE':<10} | {'ENCODE':<10} |")
-summary_lines.append("-"*55)
-for test_name, (decode_passed, encode_passed) in results.items():
-    decode_status = 'PASS' if decode_passed else 'FAIL'
-    encode_status = 'PASS' if encode_passed else 'FAIL'
-    summary_lines.append(f"| {test_name:<30} | {decode_status:<10} | {encode_status:<10} |")
-
-summary_lines.append("\n" + "="*58)
-summary_lines.append("📊 AGGREGATE MEMORY ANALYSIS (ALL TEST CASES)")
-summary_lines.append(f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} |")
-summary_lines.append("-"*58)
-summary_lines.append(f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} |")
-summary_lines.append(f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} |")
-
-summary_lines.append(f"\nOVERALL RESULT: {'ALL PASSED' if overall_passed else 'SOME FAILED'}")
-end_time = datetime.datetime.now()
-summary_lines.append(f"\nRun completed at: {end_time}")
-summary_lines.append(f"Total duration: {end_time - start_time}")
-summary_lines.append("="*90)
-
-final_summary = "\n".join(summary_lines)
-print(final_summary)
-
-# Append final summary to log file
-with open(LOG_FILE, "a", encoding="utf-8") as f:
-    f.write(final_summary + "\n")
-
-print(f"\n✅ Full log (including all metrics) saved to: {LOG_FILE}")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = add_runner_arguments(argparse.ArgumentParser(description="TOON validation pipeline (SambaNova)"))
+    args = parser.parse_args()
+    test_data.update(synthetic_cases(args.synthetic))
+    STREAM_RESPONSES = args.stream
+    client.prefix_cache = args.prefix_cache
+
+    start_time = datetime.datetime.now()
+    # Finished cases are persisted right away; --resume skips them and keeps the old log
+    checkpoint = Checkpoint(checkpoint_path(LOG_FILE), resume=args.resume)
+    with open(LOG_FILE, "a" if args.resume else "w", encoding="utf-8") as f:
+        if args.resume:
+            f.write(f"\n♻️  Run resumed at: {start_time}\n")
+        f.write(f"TOON Format Validation - Full Test Log\n")
+        f.write(f"Run started at: {start_time}\n")
+        f.write(f"Model: {MODEL_NAME}\n")
+        f.write("="*90 + "\n\n")
+
+    print(f"🚀 STARTING ROBUST TOON VALIDATION PIPELINE (SambaNova, concurrency={args.concurrency}, batch size={args.batch_size}, stream={args.stream}, prefix cache={args.prefix_cache})")
+    results = {}
+    all_stream_stats = []
+    total_json_bytes = 0
+    total_toon_bytes = 0
+    total_json_tokens = 0
+    total_toon_tokens = 0
+    total_sizes = {}
+
+    def record_result(test_name, result):
+        global total_json_bytes, total_toon_bytes, total_json_tokens, total_toon_tokens
+        # Cases restored by --resume were already written to the log by the previous run
+        if not result.get("already_logged"):
+            print(result["log"])
+            with open(LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(result["log"] + "\n")
+        results[test_name] = (result["decode_passed"], result["encode_passed"])
+        all_stream_stats.append(result.get("stream_stats"))
+        total_json_bytes += result["json_bytes"]
+        total_toon_bytes += result["toon_bytes"]
+        # Checkpoints written before token counting have no counts
+        total_json_tokens += result.get("json_tokens", 0)
+        total_toon_tokens += result.get("toon_tokens", 0)
+        add_size_matrix(total_sizes, result.get("size_matrix"))
+
+    run_cases_sync(test_data, run_test_case_worker, concurrency=args.concurrency, on_result=record_result,
+                   batch_size=args.batch_size, batch_worker=run_test_batch, checkpoint=checkpoint)
+
+    # Final metrics
+    total_reduction = (1 - total_toon_bytes / total_json_bytes) * 100 if total_json_bytes > 0 else 0
+    total_token_reduction = (1 - total_toon_tokens / total_json_tokens) * 100 if total_json_tokens > 0 else 0
+    overall_passed = all(decode and encode for decode, encode in results.values())
+
+    # Build final summary for log
+    summary_lines = []
+    summary_lines.append("\n" + "="*90)
+    summary_lines.append("🎯 FINAL SUMMARY")
+    summary_lines.append("="*90)
+    summary_lines.append(f"| {'Test Case':<30} | {'DECODE':<10} | {'ENCODE':<10} |")
+    summary_lines.append("-"*55)
+    for test_name, (decode_passed, encode_passed) in results.items():
+        decode_status = 'PASS' if decode_passed else 'FAIL'
+        encode_status = 'PASS' if encode_passed else 'FAIL'
+        summary_lines.append(f"| {test_name:<30} | {decode_status:<10} | {encode_status:<10} |")
+
+    summary_lines.append("\n" + "="*95)
+    summary_lines.append("📊 AGGREGATE MEMORY ANALYSIS (ALL TEST CASES)")
+    summary_lines.append(f"| {'Format':<15} | {'Total Size (Bytes)':<20} | {'Reduction':<12} | {'Total Tokens':<14} | {'Reduction':<12} |")
+    summary_lines.append("-"*95)
+    summary_lines.append(f"| {'JSON (Baseline)':<15} | {total_json_bytes:<20,} | {'-':<12} | {total_json_tokens:<14,} | {'-':<12} |")
+    summary_lines.append(f"| {'TOON':<15} | {total_toon_bytes:<20,} | {f'{total_reduction:.1f}%':<12} | {total_toon_tokens:<14,} | {f'{total_token_reduction:.1f}%':<12} |")
+    summary_lines.append("\n📏 AGGREGATE WIRE SIZE (ALL TEST CASES)")
+    summary_lines += format_size_matrix(total_sizes)
+
+    stream_summary = summarize_stream_stats(all_stream_stats)
+    if stream_summary:
+        summary_lines.append("\n" + stream_summary)
+    summary_lines.append("\n" + client.usage_summary())
+    summary_lines.append(token_counter.summary())
+    summary_lines.append(ground_truth_summary())
+
+    summary_lines.append(f"\nOVERALL RESULT: {'ALL PASSED' if overall_passed else 'SOME FAILED'}")
+    end_time = datetime.datetime.now()
+    summary_lines.append(f"\nRun completed at: {end_time}")
+    summary_lines.append(f"Total duration: {end_time - start_time}")
+    summary_lines.append("="*90)
+
+    final_summary = "\n".join(summary_lines)
+    print(final_summary)
+
+    # Append final summary to log file
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(final_summary + "\n")
+
+    print(f"\n✅ Full log (including all metrics) saved to: {LOG_FILE}")
\ No newline at end of file
@@ -1,5 +1,4 @@
-from toon_format import encode, decode
-import json
+from ground_truth import ground_truth
 
 # ============================================================================
 # TEST CASES: From simple to complex + edge cases
@@ -182,18 +181,14 @@ def generate_fewshots():
         original = case["data"]
 
         try:
-            # Encode to TOON
-            toon_str = encode(original)
-            # Decode back
-            recovered = decode(toon_str)
-
-            # Validate round-trip
-            assert json.dumps(original, sort_keys=True, ensure_ascii=False) == \
-                   json.dumps(recovered, sort_keys=True, ensure_ascii=False), \
-                   f"Round-trip failed for {name}"
+            # Encode to TOON and validate the decode round-trip (memoized per content
+            # and toon_format version, see ground_truth.py)
+            truth = ground_truth(original, verify=True)
+            toon_str = truth["toon"]
+            assert truth["roundtrip_ok"], f"Round-trip failed for {name}"
 
             # Compact JSON for prompt
-            compact_json = json.dumps(original, separators=(',', ':'), ensure_ascii=False)
+            compact_json = truth["json_compact"]
 
             # Store for prompts
             json_to_toon_examples.append({
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import threading
+import toon_format
+from toon_format import encode, decode
+from llm_cache import LRUCache
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Persist artifacts across runs (and processes) in a diskcache next to the LLM cache
+GROUND_TRUTH_DISK = os.getenv("GROUND_TRUTH_DISK", "1").lower() in ("1", "true", "yes")
+GROUND_TRUTH_DIR = os.getenv("GROUND_TRUTH_DIR", os.path.join(os.getenv("TOON_CACHE_DIR", ".toon_cache"), "ground_truth"))
+# In-process tier; evicted artifacts are reloaded from disk (or recomputed)
+GROUND_TRUTH_MAX_ENTRIES = int(os.getenv("GROUND_TRUTH_MAX_ENTRIES", 1024))
+GROUND_TRUTH_MAX_BYTES = int(os.getenv("GROUND_TRUTH_MAX_BYTES", 64 * 1024 * 1024))
+
+# Artifacts are only valid for the toon_format release that produced them
+TOON_FORMAT_VERSION = getattr(toon_format, "__version__", "unknown")
+_ARTIFACT_SCHEMA = 1
+
+
+# ============================================================================
+# GROUND-TRUTH ARTIFACTS (memoized by content hash)
+# ============================================================================
+def content_hash(python_data):
+    """
+    Hash of a document's content *and* key order (TOON output depends on both).
+
+    Returns:
+        tuple: (hash hex digest, compact JSON) so callers can reuse the serialization.
+    """
+    compact = json.dumps(python_data, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(compact.encode("utf-8")).hexdigest(), compact
+
+
+class GroundTruthCache:
+    """
+    Memoize the ground-truth artifacts of a document:
+        {"toon", "json_pretty", "json_compact", "toon_bytes", "json_bytes", "json_compact_bytes"}
+    plus "roundtrip_ok" once `verify=True` has been requested.
+
+    Lookups go to a bounded in-process LRU first, then (optionally) to a diskcache
+    shared by every script on the machine. Keys include the installed
+    toon_format version, so upgrading the library invalidates everything.
+    """
+
+    def __init__(self, directory=GROUND_TRUTH_DIR, use_disk=GROUND_TRUTH_DISK,
+                 max_entries=GROUND_TRUTH_MAX_ENTRIES, max_bytes=GROUND_TRUTH_MAX_BYTES):
+        self._lock = threading.Lock()
+        self._memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._disk = None
+        if use_disk:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(directory)
+            except Exception as e:
+                print(f"⚠️  Ground-truth disk cache unavailable ({e}) - memoizing in memory only")
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, digest):
+        return f"gt:{_ARTIFACT_SCHEMA}:{TOON_FORMAT_VERSION}:{digest}"
+
+    def get(self, python_data, verify=False):
+        """
+        Ground-truth artifacts for `python_data`, computed at most once per content.
+
+        Args:
+            python_data: The document (any JSON-compatible value).
+            verify (bool): Also check (and memoize) that decode(encode(data)) == data.
+
+        Returns:
+            dict: The artifacts described on the class. Treat it as read-only.
+        """
+        digest, compact = content_hash(python_data)
+        key = self._key(digest)
+
+        artifacts = self._memory.get(key)
+        # Hits are only reported to a shared store; there is none here
+        self._memory.drain_hits()
+        if artifacts is None and self._disk is not None:
+            artifacts = self._disk.get(key)
+            if artifacts is not None:
+                self._memory.put(key, artifacts)
+
+        with self._lock:
+            if artifacts is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if artifacts is None:
+            toon = encode(python_data)
+            pretty = json.dumps(python_data, indent=2)
+            artifacts = {
+                "toon": toon,
+                "json_pretty": pretty,
+                "json_compact": compact,
+                "toon_bytes": len(toon.encode("utf-8")),
+                "json_bytes": len(pretty.encode("utf-8")),
+                "json_compact_bytes": len(compact.encode("utf-8")),
+            }
+            self._store(key, artifacts)
+
+        if verify and "roundtrip_ok" not in artifacts:
+            artifacts = dict(artifacts, roundtrip_ok=self._roundtrip_ok(python_data, artifacts["toon"]))
+            self._store(key, artifacts)
+        return artifacts
+
+    def _store(self, key, artifacts):
+        self._memory.put(key, artifacts)
+        if self._disk is not None:
+            self._disk.set(key, artifacts)
+
+    @staticmethod
+    def _roundtrip_ok(python_data, toon):
+        try:
+            recovered = decode(toon)
+        except Exception:
+            return False
+        return json.dumps(python_data, sort_keys=True, ensure_ascii=False) == \
+               json.dumps(recovered, sort_keys=True, ensure_ascii=False)
+
+    def stats(self):
+        memory = self._memory.stats()
+        return {"hits": self.hits, "misses": self.misses, "entries": memory["entries"],
+                "evictions": memory["evictions"], "toon_format": TOON_FORMAT_VERSION}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def ground_truth(python_data, verify=False):
+    """Ground-truth artifacts from the process-wide cache (see GroundTruthCache.get)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GroundTruthCache()
+    return _default_cache.get(python_data, verify=verify)
+
+
+def ground_truth_stats():
+    if _default_cache is not None:
+        return _default_cache.stats()
+    return {"hits": 0, "misses": 0, "entries": 0, "evictions": 0, "toon_format": TOON_FORMAT_VERSION}
+
+
+def ground_truth_summary():
+    """One summary line for the runners' final report."""
+    stats = ground_truth_stats()
+    return (f"🧾 Ground truth: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['entries']} in memory, {stats['evictions']} evictions, toon_format {stats['toon_format']})")
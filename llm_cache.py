@@ -0,0 +1,702 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from batching import build_batch_prompt, build_batch_suffix
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# How long a process may hold the "I'm calling the model for this key" lease
+CACHE_LEASE_TTL = float(os.getenv("CACHE_LEASE_TTL", 120))
+CACHE_LEASE_POLL = float(os.getenv("CACHE_LEASE_POLL", 0.25))
+
+# In-process LRU tier in front of Redis
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 1024))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Local hits are reported to the shared store (TTL refresh + LFU count) in batches of this many
+LOCAL_CACHE_HIT_FLUSH = int(os.getenv("LOCAL_CACHE_HIT_FLUSH", 100))
+
+# Shared store: "auto" uses Redis when reachable and falls back to diskcache
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "auto").lower()
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 2))
+CACHE_DIR = os.getenv("TOON_CACHE_DIR", ".toon_cache")
+
+# Sliding TTL of cache entries (refreshed on every hit)
+CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))
+# Byte budget of the shared store (0 = unbounded); over budget, the least frequently used entries go first
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 0))
+
+# Negative entries: prompts that failed deterministically, remembered for a short while
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 900))
+# Failure classes (see llm_clients.failure_class) that are worth remembering per prompt;
+# quota, auth and transport errors say nothing about the prompt itself
+NEGATIVE_CACHE_CLASSES = ("blocked", "empty", "server_error")
+
+LEASE_PREFIX = "lease:"
+NEGATIVE_PREFIX = "fail:"
+META_PREFIX = "meta:"
+KEY_PREFIX = "toon:"
+# Bookkeeping keys stored next to the cache entries (skipped by scans)
+_INTERNAL_PREFIXES = (LEASE_PREFIX, NEGATIVE_PREFIX, META_PREFIX)
+
+# Redis byte-budget accounting: hit counts (ZSET), value sizes (HASH) and their total
+LFU_FREQ_KEY = META_PREFIX + "lfu:freq"
+LFU_SIZE_KEY = META_PREFIX + "lfu:size"
+LFU_BYTES_KEY = META_PREFIX + "lfu:bytes"
+
+# Delete the lease only if we still own it (it may have expired and been re-taken)
+_RELEASE_LEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Store a value, account for its size and evict the least frequently used other
+# entries until the total fits the budget. Entries that already expired (TTL) are
+# dropped from the accounting as they come up. Returns the number of evicted entries.
+#   KEYS: entry, LFU_FREQ_KEY, LFU_SIZE_KEY, LFU_BYTES_KEY   ARGV: value, ttl, max bytes
+_STORE_LFU_LUA = """
+local size = string.len(ARGV[1])
+local old = tonumber(redis.call('hget', KEYS[3], KEYS[1]) or '0')
+redis.call('setex', KEYS[1], ARGV[2], ARGV[1])
+redis.call('hset', KEYS[3], KEYS[1], size)
+redis.call('zadd', KEYS[2], 'NX', 1, KEYS[1])
+local total = redis.call('incrby', KEYS[4], size - old)
+local max = tonumber(ARGV[3])
+local evicted = 0
+while max > 0 and total > max do
+    local victim = nil
+    for _, member in ipairs(redis.call('zrange', KEYS[2], 0, 1)) do
+        if member ~= KEYS[1] then
+            victim = member
+            break
+        end
+    end
+    if not victim then
+        break
+    end
+    local victim_size = tonumber(redis.call('hget', KEYS[3], victim) or '0')
+    evicted = evicted + redis.call('del', victim)
+    redis.call('hdel', KEYS[3], victim)
+    redis.call('zrem', KEYS[2], victim)
+    total = redis.call('incrby', KEYS[4], -victim_size)
+end
+return evicted
+"""
+
+
+# ============================================================================
+# PROMPT TEMPLATES + CACHE KEYS
+# ============================================================================
+class PromptTemplate:
+    """
+    A few-shot prompt preamble with an explicit version.
+
+    The fingerprint is computed once, over the whitespace-normalized preamble,
+    so cache keys never rehash the preamble and cosmetic whitespace edits keep
+    existing entries. Bump `version` to invalidate entries on purpose.
+    """
+
+    def __init__(self, name, base, version):
+        self.name = name
+        self.base = base
+        self.version = version
+        normalized = " ".join(base.split())
+        self.fingerprint = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def label(self):
+        return f"{self.name}@v{self.version}"
+
+    def render(self, payload):
+        """Full prompt for one payload (str) or a batch of payloads (list of str)."""
+        if isinstance(payload, list):
+            return build_batch_prompt(self.base, payload)
+        return self.base + "\n" + payload
+
+    def render_suffix(self, payload):
+        """The part of `render(payload)` after the preamble (sent separately as a cacheable prefix)."""
+        if isinstance(payload, list):
+            return build_batch_suffix(payload)
+        return payload
+
+
+def canonical_payload(payload):
+    """
+    Canonical form of a prompt payload for cache keys.
+
+    JSON is re-serialized with sorted keys and compact separators, so inputs that
+    only differ in key order or formatting share an entry (the runners compare
+    parsed values, which are order-insensitive). Other text (TOON) only has its
+    line endings and trailing whitespace normalized.
+    """
+    try:
+        return json.dumps(json.loads(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except ValueError:
+        return "\n".join(line.rstrip() for line in payload.strip().splitlines())
+
+
+def make_cache_key(model_name, template, payload, max_tokens, temperature):
+    """
+    Readable, versioned cache key:
+        toon:<template>@v<version>:<template fingerprint>:<model>:<max_tokens>:<temperature>:<payload hash>
+
+    Only the canonical payload is hashed; a batch (list of payloads) is keyed by
+    all its payloads in order.
+    """
+    if isinstance(payload, list):
+        label = template.label + "+batch"
+        canonical = "\x1e".join(canonical_payload(item) for item in payload)
+    else:
+        label = template.label
+        canonical = canonical_payload(payload)
+    payload_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}{label}:{template.fingerprint}:{model_name}:{max_tokens}:{temperature}:{payload_hash}"
+
+
+_KEY_LABEL_RE = re.compile(r"^" + re.escape(KEY_PREFIX) + r"([^:]+):([0-9a-f]+):")
+
+
+def key_report(backend, limit=100000):
+    """
+    Count stored keys per template version and fingerprint.
+
+    Returns:
+        list[tuple]: ((template label, fingerprint), key count), most keys first;
+        keys written before versioned keys existed are grouped as ("legacy", "-").
+    """
+    counts = Counter()
+    for key in backend.scan_keys(limit):
+        match = _KEY_LABEL_RE.match(key)
+        counts[(match.group(1), match.group(2)) if match else ("legacy", "-")] += 1
+    return counts.most_common()
+
+
+# ============================================================================
+# IN-PROCESS SINGLE-FLIGHT
+# ============================================================================
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight wait on the leader's future and get its result
+    (or its exception) instead of running the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """
+        Run `fn()` once per in-flight `key`.
+
+        Returns:
+            tuple: (result, shared) where `shared` is True for callers that
+            reused another caller's result.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+# ============================================================================
+# IN-PROCESS LRU TIER
+# ============================================================================
+class LRUCache:
+    """
+    Bounded, thread-safe LRU of decoded cache values, kept in front of Redis.
+
+    Entries are evicted least-recently-used first once either `max_entries` or
+    `max_bytes` (measured on the JSON-encoded value) is exceeded. With a `ttl`,
+    an entry expires `ttl` seconds after it was stored. Entries are stored on
+    every shared read and write, which also reset the shared TTL, so the local
+    copy never outlives the shared entry. Local hits do not extend it; they are
+    counted per key until `drain_hits` hands them to the shared store.
+    """
+
+    def __init__(self, max_entries=LOCAL_CACHE_MAX_ENTRIES, max_bytes=LOCAL_CACHE_MAX_BYTES, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._pending_hits = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expiry(self):
+        return time.monotonic() + self.ttl if self.ttl else None
+
+    def get(self, key):
+        """Return the cached value (refreshing its recency, not its expiry), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._pending_hits[key] += 1
+            self.hits += 1
+            return entry[0]
+
+    @property
+    def pending_hits(self):
+        """Local hits not yet reported to the shared store."""
+        with self._lock:
+            return sum(self._pending_hits.values())
+
+    def drain_hits(self):
+        """Return {key: local hits} since the last call and reset the counts."""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, Counter()
+        return dict(pending)
+
+    def put(self, key, value):
+        """Store `value` (a JSON-serializable dict); values larger than `max_bytes` are not kept."""
+        size = len(json.dumps(value).encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (value, size, self._expiry())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+# ============================================================================
+# SHARED CACHE BACKENDS (Redis, diskcache)
+# ============================================================================
+class CacheBackend:
+    """
+    Shared store behind `call_gemini_cached`.
+
+    Values are opaque bytes (the compressed cache value) stored with a sliding
+    TTL: `set` stores with `ttl` seconds to live and `touch` resets it on a hit.
+    The lease methods let exactly one process fill a key while the others wait
+    for the value instead of calling the model themselves.
+
+    The bulk helpers (`get_touch`, `get_many_touch`, `set_and_release`) have
+    generic fallbacks here; backends with a network hop override them to save
+    round trips.
+
+    With `max_bytes`, the store keeps its cache entries within that many bytes and
+    evicts the least frequently used ones first (LFU); the TTL still applies.
+    """
+
+    name = "base"
+    max_bytes = 0
+
+    def get(self, cache_key):
+        raise NotImplementedError
+
+    def touch(self, cache_key, ttl):
+        raise NotImplementedError
+
+    def set(self, cache_key, value, ttl):
+        raise NotImplementedError
+
+    def get_touch(self, cache_key, ttl):
+        """Read a value and, on a hit, reset its TTL."""
+        value = self.get(cache_key)
+        if value:
+            self.touch(cache_key, ttl)
+        return value
+
+    def get_many_touch(self, cache_keys, ttl):
+        """`get_touch` for many keys; returns {key: value} for the hits only."""
+        values = {}
+        for cache_key in cache_keys:
+            value = self.get_touch(cache_key, ttl)
+            if value:
+                values[cache_key] = value
+        return values
+
+    def get_many(self, cache_keys):
+        """`get` for many keys without refreshing their TTL; returns {key: value} for the hits only."""
+        values = {}
+        for cache_key in cache_keys:
+            value = self.get(cache_key)
+            if value:
+                values[cache_key] = value
+        return values
+
+    def set_and_release(self, cache_key, value, ttl, token):
+        """Store a freshly filled value and give up its lease."""
+        self.set(cache_key, value, ttl)
+        self.release_lease(cache_key, token)
+
+    def record_hits(self, hits, ttl):
+        """Report hits served by a local tier ({key: count}): reset their TTL and count them for LFU."""
+        for cache_key in hits:
+            self.touch(cache_key, ttl)
+
+    def footprint(self):
+        """
+        Current size of the cache entries.
+
+        Returns:
+            dict: {"entries", "bytes", "max_bytes", "policy"}
+        """
+        raise NotImplementedError
+
+    def scan_values(self, limit):
+        """Yield up to `limit` stored values (leases and negative entries excluded), e.g. as a compression corpus."""
+        raise NotImplementedError
+
+    def scan_keys(self, limit):
+        """Yield up to `limit` stored cache keys as str (leases and negative entries excluded)."""
+        raise NotImplementedError
+
+    def acquire_lease(self, cache_key, ttl=CACHE_LEASE_TTL):
+        """Try to become the only process filling `cache_key`; returns a token or None."""
+        raise NotImplementedError
+
+    def release_lease(self, cache_key, token):
+        raise NotImplementedError
+
+    def lease_exists(self, cache_key):
+        raise NotImplementedError
+
+    def wait_for_fill(self, cache_key, timeout=CACHE_LEASE_TTL, poll=CACHE_LEASE_POLL):
+        """
+        Wait for another process (the lease holder) to write `cache_key`.
+
+        Returns the raw cached value as soon as it appears, or None once the lease
+        is gone without a value (the holder failed) or `timeout` elapses.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = self.get(cache_key)
+            if value:
+                return value
+            if not self.lease_exists(cache_key):
+                # Lease released or expired: one last look in case the write raced the release
+                return self.get(cache_key)
+            time.sleep(poll)
+        return None
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis server shared by every runner (and machine) pointed at it.
+
+    With `max_bytes`, every entry's size and hit count are tracked next to it
+    (meta:lfu:* keys) and each write evicts the least frequently used entries,
+    atomically in a Lua script, until the total fits the budget.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, description="redis", max_bytes=CACHE_MAX_BYTES):
+        self.r = client
+        self.description = description
+        self.max_bytes = max_bytes
+
+    def _accounted(self, cache_key):
+        return self.max_bytes > 0 and not cache_key.startswith(_INTERNAL_PREFIXES)
+
+    def _count_hit(self, pipe, cache_key, hits=1):
+        # XX: only entries that are being accounted for get a hit
+        pipe.zadd(LFU_FREQ_KEY, {cache_key: hits}, xx=True, incr=True)
+
+    def _store(self, pipe, cache_key, value, ttl):
+        if self._accounted(cache_key):
+            pipe.eval(_STORE_LFU_LUA, 4, cache_key, LFU_FREQ_KEY, LFU_SIZE_KEY, LFU_BYTES_KEY, value, int(ttl), self.max_bytes)
+        else:
+            pipe.setex(cache_key, ttl, value)
+
+    def get(self, cache_key):
+        return self.r.get(cache_key)
+
+    def touch(self, cache_key, ttl):
+        self.r.expire(cache_key, ttl)
+
+    def set(self, cache_key, value, ttl):
+        pipe = self.r.pipeline(transaction=False)
+        self._store(pipe, cache_key, value, ttl)
+        pipe.execute()
+
+    def get_touch(self, cache_key, ttl):
+        # GETEX (Redis >= 6.2): read and refresh the TTL in one command
+        if not self._accounted(cache_key):
+            return self.r.getex(cache_key, ex=ttl)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.getex(cache_key, ex=ttl)
+        self._count_hit(pipe, cache_key)
+        return pipe.execute()[0]
+
+    def get_many_touch(self, cache_keys, ttl):
+        # One pipelined round trip; plain MGET would not refresh the sliding TTL
+        pipe = self.r.pipeline(transaction=False)
+        for cache_key in cache_keys:
+            pipe.getex(cache_key, ex=ttl)
+            if self._accounted(cache_key):
+                self._count_hit(pipe, cache_key)
+        results = iter(pipe.execute())
+        values = {}
+        for cache_key in cache_keys:
+            value = next(results)
+            if self._accounted(cache_key):
+                next(results)
+            if value:
+                values[cache_key] = value
+        return values
+
+    def get_many(self, cache_keys):
+        # One MGET; a read-only look (e.g. a dry-run plan) must not extend TTLs
+        return {cache_key: value for cache_key, value in zip(cache_keys, self.r.mget(cache_keys)) if value} if cache_keys else {}
+
+    def set_and_release(self, cache_key, value, ttl, token):
+        pipe = self.r.pipeline(transaction=False)
+        self._store(pipe, cache_key, value, ttl)
+        pipe.eval(_RELEASE_LEASE_LUA, 1, LEASE_PREFIX + cache_key, token)
+        pipe.execute()
+
+    def record_hits(self, hits, ttl):
+        # One pipelined round trip for the whole batch
+        if not hits:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for cache_key, count in hits.items():
+            pipe.expire(cache_key, ttl)
+            if self._accounted(cache_key):
+                self._count_hit(pipe, cache_key, count)
+        pipe.execute()
+
+    def reconcile(self):
+        """Drop accounting for entries that expired (TTL) since they were stored; returns how many."""
+        sizes = self.r.hgetall(LFU_SIZE_KEY)
+        keys = list(sizes)
+        stale, freed = [], 0
+        for i in range(0, len(keys), 500):
+            pipe = self.r.pipeline(transaction=False)
+            for key in keys[i:i + 500]:
+                pipe.exists(key)
+            for key, exists in zip(keys[i:i + 500], pipe.execute()):
+                if not exists:
+                    stale.append(key)
+                    freed += int(sizes[key])
+        if stale:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.hdel(LFU_SIZE_KEY, *stale)
+            pipe.zrem(LFU_FREQ_KEY, *stale)
+            pipe.decrby(LFU_BYTES_KEY, freed)
+            pipe.execute()
+        return len(stale)
+
+    def footprint(self):
+        if self.max_bytes > 0:
+            self.reconcile()
+            pipe = self.r.pipeline(transaction=False)
+            pipe.zcard(LFU_FREQ_KEY)
+            pipe.get(LFU_BYTES_KEY)
+            entries, total = pipe.execute()
+            return {"entries": entries, "bytes": int(total or 0), "max_bytes": self.max_bytes, "policy": "lfu"}
+        # Unbounded: measure the entries directly
+        entries, total = 0, 0
+        keys = list(self.scan_keys(10 ** 9))
+        for i in range(0, len(keys), 500):
+            pipe = self.r.pipeline(transaction=False)
+            for key in keys[i:i + 500]:
+                pipe.strlen(key)
+            for size in pipe.execute():
+                entries += 1
+                total += size
+        return {"entries": entries, "bytes": total, "max_bytes": 0, "policy": "ttl"}
+
+    def scan_keys(self, limit):
+        count = 0
+        for key in self.r.scan_iter(count=500):
+            if count >= limit:
+                break
+            key = key.decode("utf-8", "replace")
+            if not key.startswith(_INTERNAL_PREFIXES):
+                count += 1
+                yield key
+
+    def scan_values(self, limit):
+        keys = list(self.scan_keys(limit))
+        for i in range(0, len(keys), 500):
+            for value in self.r.mget(keys[i:i + 500]):
+                if value:
+                    yield value
+
+    def acquire_lease(self, cache_key, ttl=CACHE_LEASE_TTL):
+        token = uuid.uuid4().hex
+        if self.r.set(LEASE_PREFIX + cache_key, token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+
+    def release_lease(self, cache_key, token):
+        self.r.eval(_RELEASE_LEASE_LUA, 1, LEASE_PREFIX + cache_key, token)
+
+    def lease_exists(self, cache_key):
+        return bool(self.r.exists(LEASE_PREFIX + cache_key))
+
+
+class DiskCacheBackend(CacheBackend):
+    """
+    Local SQLite-backed store (diskcache); shared by the processes of one machine.
+
+    Used when no Redis server is reachable. Expiry, `add` (the lease) and the
+    compare-and-delete release are all atomic across processes. With `max_bytes`,
+    diskcache's own size limit and least-frequently-used eviction are enabled;
+    without it, eviction is off and entries leave by TTL only.
+
+    Leases and negative entries live in a separate small store (`<directory>/meta`)
+    that is never size-culled, so eviction cannot drop a lease mid-fill or forget
+    a failure before its TTL.
+    """
+
+    name = "disk"
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        import diskcache
+
+        if max_bytes > 0:
+            self.cache = diskcache.Cache(directory, size_limit=max_bytes, eviction_policy="least-frequently-used")
+        else:
+            # diskcache defaults to a 1 GB size_limit with least-recently-stored eviction; unbounded means TTL only
+            self.cache = diskcache.Cache(directory, eviction_policy="none")
+        self.meta = diskcache.Cache(os.path.join(directory, "meta"), eviction_policy="none")
+        self.max_bytes = max_bytes
+        self.description = f"diskcache at {directory}"
+
+    def _cache_for(self, cache_key):
+        return self.meta if cache_key.startswith(NEGATIVE_PREFIX) else self.cache
+
+    def get(self, cache_key):
+        return self._cache_for(cache_key).get(cache_key)
+
+    def touch(self, cache_key, ttl):
+        self._cache_for(cache_key).touch(cache_key, expire=ttl)
+
+    def record_hits(self, hits, ttl):
+        for cache_key in hits:
+            self.cache.touch(cache_key, expire=ttl)
+            if self.max_bytes > 0:
+                # diskcache counts accesses on reads only: one per batch, not per local hit
+                self.cache.get(cache_key)
+
+    def set(self, cache_key, value, ttl):
+        self._cache_for(cache_key).set(cache_key, value, expire=ttl)
+
+    def acquire_lease(self, cache_key, ttl=CACHE_LEASE_TTL):
+        token = uuid.uuid4().hex
+        if self.meta.add(LEASE_PREFIX + cache_key, token, expire=ttl):
+            return token
+        return None
+
+    def release_lease(self, cache_key, token):
+        lease_key = LEASE_PREFIX + cache_key
+        with self.meta.transact():
+            if self.meta.get(lease_key) == token:
+                self.meta.delete(lease_key)
+
+    def lease_exists(self, cache_key):
+        return (LEASE_PREFIX + cache_key) in self.meta
+
+    def scan_keys(self, limit):
+        count = 0
+        for key in self.cache.iterkeys():
+            if count >= limit:
+                break
+            if isinstance(key, str) and not key.startswith(_INTERNAL_PREFIXES):
+                count += 1
+                yield key
+
+    def scan_values(self, limit):
+        for key in self.scan_keys(limit):
+            value = self.cache.get(key)
+            if value:
+                yield value
+
+    def footprint(self):
+        self.cache.expire()
+        self.meta.expire()
+        entries = sum(1 for _ in self.scan_keys(10 ** 9))
+        # volume() is the on-disk size (values plus the SQLite index), which is what the size limit bounds
+        return {"entries": entries, "bytes": self.cache.volume(), "max_bytes": self.max_bytes,
+                "policy": "lfu" if self.max_bytes > 0 else "ttl"}
+
+
+def open_cache_backend(kind=CACHE_BACKEND, redis_host=REDIS_HOST, redis_port=REDIS_PORT, directory=CACHE_DIR,
+                       max_bytes=CACHE_MAX_BYTES):
+    """
+    Open the shared cache store.
+
+    Args:
+        kind (str): "redis" (fail if unreachable), "disk", or "auto" (Redis, else disk).
+        redis_host (str): Redis host.
+        redis_port (int): Redis port.
+        directory (str): diskcache directory.
+        max_bytes (int): Byte budget with LFU eviction (0 = unbounded, TTL only).
+
+    Returns:
+        CacheBackend: The connected backend.
+    """
+    if kind not in ("auto", "redis", "disk"):
+        raise ValueError(f"❌ Unknown CACHE_BACKEND {kind!r} (expected auto, redis or disk)")
+    if kind in ("auto", "redis"):
+        try:
+            import redis
+
+            client = redis.Redis(host=redis_host, port=redis_port, socket_connect_timeout=REDIS_CONNECT_TIMEOUT)
+            client.ping()
+            print("✅ Connected to Redis")
+            return RedisBackend(client, description=f"redis at {redis_host}:{redis_port}", max_bytes=max_bytes)
+        except Exception as e:
+            if kind == "redis":
+                raise RuntimeError(f"❌ Redis connection failed: {e}")
+            print(f"⚠️  Redis unavailable ({e}) → using on-disk cache at {directory}")
+    return DiskCacheBackend(directory, max_bytes=max_bytes)
@@ -0,0 +1,156 @@
+import os
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from batching import DEFAULT_BATCH_SIZE, chunk_names
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+DEFAULT_CONCURRENCY = int(os.getenv("TOON_CONCURRENCY", 4))
+DEFAULT_STREAM = os.getenv("TOON_STREAM", "0").lower() in ("1", "true", "yes")
+DEFAULT_PREFIX_CACHE = os.getenv("TOON_PREFIX_CACHE", "0").lower() in ("1", "true", "yes")
+DEFAULT_SYNTHETIC = os.getenv("TOON_SYNTHETIC", "")
+
+
+def add_runner_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Register the command-line options shared by every final_test_* runner."""
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help=f"Maximum number of test cases (or batches) in flight at once (default: {DEFAULT_CONCURRENCY}, env TOON_CONCURRENCY)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help=f"Pack this many cases into one LLM request per direction (default: {DEFAULT_BATCH_SIZE}, env TOON_BATCH_SIZE)",
+    )
+    parser.add_argument(
+        "--stream", action="store_true", default=DEFAULT_STREAM,
+        help="Stream completions, record time-to-first-token and abort outputs that can no longer pass (env TOON_STREAM=1)",
+    )
+    parser.add_argument(
+        "--prefix-cache", action="store_true", default=DEFAULT_PREFIX_CACHE,
+        help="Send the few-shot preamble as a provider-cached prompt prefix and report cached tokens (env TOON_PREFIX_CACHE=1)",
+    )
+    parser.add_argument(
+        "--synthetic", default=DEFAULT_SYNTHETIC, metavar="SPEC",
+        help='Add generated cases from synthetic_corpus.py, e.g. "tabular:100,nested:8KB" (env TOON_SYNTHETIC)',
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Skip cases already completed in the previous run's checkpoint and append to its log file",
+    )
+    return parser
+
+
+# ============================================================================
+# CONCURRENT CASE RUNNER
+# ============================================================================
+async def run_cases(cases, worker, concurrency=DEFAULT_CONCURRENCY, on_result=None,
+                    batch_size=1, batch_worker=None, checkpoint=None):
+    """
+    Run `worker(test_name, python_data)` for every case with bounded concurrency.
+
+    The worker is a regular (blocking) function; it is executed on a thread pool
+    so the provider SDKs can be used unchanged. Results are returned in the same
+    order as `cases`, and `on_result(test_name, result)` is called in that order
+    as soon as every earlier case has finished, so log files and summary tables
+    stay stable no matter which case completes first.
+
+    With `batch_size > 1`, consecutive cases are grouped and each group is handed
+    to `batch_worker(batch_cases)`, which must return a mapping of test name →
+    result; results are still emitted one case at a time, in input order.
+
+    With a `checkpoint`, every case is persisted as soon as it finishes, cases
+    already completed in a previous run are not executed again (their stored
+    results are emitted with `resumed=True`), and each case is marked once its
+    `on_result` callback has run.
+
+    Args:
+        cases (dict): Mapping of test name → python data (e.g. `test_data`).
+        worker (callable): Function called as `worker(test_name, python_data)`.
+        concurrency (int): Maximum number of cases (or batches) running at the same time.
+        on_result (callable): Optional in-order callback for finished cases.
+        batch_size (int): Number of cases per `batch_worker` call (1 disables batching).
+        batch_worker (callable): Function called as `batch_worker({name: data, ...})`.
+        checkpoint (Checkpoint): Optional per-case checkpoint (see checkpoint.py).
+
+    Returns:
+        dict: Mapping of test name → worker result, in input order.
+    """
+    concurrency = max(1, concurrency)
+    names = list(cases)
+    semaphore = asyncio.Semaphore(concurrency)
+    finished = checkpoint.completed(cases) if checkpoint is not None else {}
+    next_to_emit = 0
+    if finished:
+        print(f"♻️  Resuming: {len(finished)} of {len(names)} cases restored from checkpoint")
+
+    pending = [name for name in names if name not in finished]
+    if batch_size > 1 and batch_worker is not None:
+        units = chunk_names(pending, batch_size)
+    else:
+        units = [[name] for name in pending]
+
+    loop = asyncio.get_running_loop()
+    # One thread per in-flight unit; its decode/encode legs fan out via run_parallel.
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="toon-case")
+    loop.set_default_executor(executor)
+
+    def emit_ready():
+        nonlocal next_to_emit
+        while next_to_emit < len(names) and names[next_to_emit] in finished:
+            name = names[next_to_emit]
+            if on_result is not None:
+                on_result(name, finished[name])
+            if checkpoint is not None:
+                checkpoint.mark_logged(name)
+            next_to_emit += 1
+
+    async def run_one(unit):
+        async with semaphore:
+            if len(unit) == 1 and not (batch_size > 1 and batch_worker is not None):
+                name = unit[0]
+                results = {name: await asyncio.to_thread(worker, name, cases[name])}
+            else:
+                results = await asyncio.to_thread(batch_worker, {name: cases[name] for name in unit})
+        if checkpoint is not None:
+            for name, result in results.items():
+                checkpoint.save(name, cases[name], result)
+        finished.update(results)
+        emit_ready()
+
+    emit_ready()  # cases restored from the checkpoint that lead the list
+    try:
+        await asyncio.gather(*(run_one(unit) for unit in units))
+    finally:
+        executor.shutdown(wait=False)
+
+    return {name: finished[name] for name in names}
+
+
+def run_cases_sync(cases, worker, concurrency=DEFAULT_CONCURRENCY, on_result=None,
+                   batch_size=1, batch_worker=None, checkpoint=None):
+    """Blocking wrapper around `run_cases` for the scripts' `__main__` blocks."""
+    return asyncio.run(run_cases(cases, worker, concurrency=concurrency, on_result=on_result,
+                                 batch_size=batch_size, batch_worker=batch_worker, checkpoint=checkpoint))
+
+
+# ============================================================================
+# PARALLEL LEGS WITHIN ONE CASE
+# ============================================================================
+def run_parallel(*calls):
+    """
+    Dispatch independent blocking calls at the same time and join them.
+
+    Used by `run_test_case` to send the TOON → JSON and JSON → TOON prompts
+    together; each call still goes through the provider's rate limiter.
+
+    Args:
+        *calls (callable): Zero-argument callables (e.g. `lambda: call_gemini(prompt)`).
+
+    Returns:
+        list: The callables' return values, in argument order.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(calls)), thread_name_prefix="toon-leg") as pool:
+        futures = [pool.submit(call) for call in calls]
+        return [future.result() for future in futures]
@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+
+# ----------------------------
+# DEFAULT QUOTAS (per provider)
+# ----------------------------
+# Overridable with <PROVIDER>_RPM / <PROVIDER>_TPM env vars; 0 disables that quota.
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 10, "tpm": 250_000},
+    "sambanova": {"rpm": 20, "tpm": 100_000},
+    "openrouter": {"rpm": 20, "tpm": 0},
+    # Token counting (token_counter.py) has its own, much larger quota; counts never wait on model calls
+    "gemini_count": {"rpm": 3000, "tpm": 0},
+}
+
+
+# ============================================================================
+# TOKEN BUCKET
+# ============================================================================
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `capacity` units per minute.
+
+    `acquire` reserves units up front and lets the level go negative, so callers
+    are served in arrival order and each one sleeps exactly as long as needed for
+    its own reservation to be covered by the refill.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Reserve `amount` units and return how many seconds the caller must wait."""
+        with self.lock:
+            self._refill()
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def time_for(self, amount):
+        """Seconds until `amount` more units could have been reserved, starting from the current level."""
+        with self.lock:
+            self._refill()
+            return max(0.0, (amount - self.level) / self.rate)
+
+    def adjust(self, amount):
+        """Correct a previous reservation (positive = consume more, negative = give back)."""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+# ============================================================================
+# PROVIDER RATE LIMITER (RPM + TPM)
+# ============================================================================
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute quotas for one provider."""
+
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, estimated_tokens=0):
+        """
+        Block until one more API request fits in the quotas.
+
+        Only call this right before a real API call; cache hits must never wait.
+
+        Args:
+            estimated_tokens (int): Expected token usage of the request.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and estimated_tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            print(f"⏳ [{self.name}] rate limit reached - waiting {wait:.1f}s")
+            time.sleep(wait)
+        return wait
+
+    def estimate_duration(self, requests, tokens=0):
+        """
+        Minimum time the quotas need to let `requests` calls using `tokens` in total through.
+
+        Starts from the buckets' current level (a fresh process starts with full
+        buckets, i.e. one minute of burst). Does not include the calls' own latency.
+
+        Returns:
+            dict: {"seconds": overall bound, "rpm_seconds": ..., "tpm_seconds": ...}
+        """
+        rpm_seconds = self.requests.time_for(requests) if self.requests is not None else 0.0
+        tpm_seconds = self.tokens.time_for(tokens) if self.tokens is not None and tokens else 0.0
+        return {"seconds": max(rpm_seconds, tpm_seconds), "rpm_seconds": rpm_seconds, "tpm_seconds": tpm_seconds}
+
+    def record_usage(self, actual_tokens, estimated_tokens=0):
+        """Settle the TPM bucket once the provider reports the real token usage."""
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def estimate_tokens(text):
+    """Cheap pre-call token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider):
+    """Return the process-wide limiter for `provider`, creating it from env/defaults on first use."""
+    with _limiters_lock:
+        if provider not in _limiters:
+            defaults = DEFAULT_LIMITS.get(provider, {"rpm": 0, "tpm": 0})
+            rpm = int(os.getenv(f"{provider.upper()}_RPM", defaults["rpm"]))
+            tpm = int(os.getenv(f"{provider.upper()}_TPM", defaults["tpm"]))
+            _limiters[provider] = RateLimiter(provider, rpm=rpm, tpm=tpm)
+        return _limiters[provider]
@@ -0,0 +1,193 @@
+import os
+import re
+import time
+import random
+from email.utils import parsedate_to_datetime
+
+try:
+    import httpx
+except ImportError:  # optional: `uv pip install httpx` (comes with openai)
+    httpx = None
+try:
+    import openai
+except ImportError:  # optional: `uv pip install openai`
+    openai = None
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # optional: `uv pip install google-generativeai`
+    google_exceptions = None
+
+# ----------------------------
+# DEFAULTS (overridable via env)
+# ----------------------------
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 5))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30.0))
+RETRY_MAX_TOTAL = float(os.getenv("RETRY_MAX_TOTAL", 180.0))
+
+# Request timeout, too early, throttled, and server-side errors
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Gemini/gRPC quota errors carry the hint in the message, e.g. "retry_delay { seconds: 27 }"
+_RETRY_DELAY_PATTERNS = [
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)"),
+    re.compile(r"[Pp]lease retry in\s+(\d+(?:\.\d+)?)\s*s"),
+]
+
+
+class TransientError(Exception):
+    """Base class for our own errors that are worth retrying (e.g. an empty completion)."""
+
+
+class RetryError(Exception):
+    """All attempts failed, a permanent error occurred, or the retry budget ran out."""
+
+    def __init__(self, message, last_error=None, attempts=0):
+        super().__init__(message)
+        self.last_error = last_error
+        self.attempts = attempts
+
+
+# ============================================================================
+# ERROR CLASSIFICATION
+# ============================================================================
+def get_status_code(exc):
+    """Best-effort HTTP status of a provider exception (openai, google-api-core, httpx)."""
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def get_retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After header or gRPC RetryInfo), or None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after-ms")
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+
+    for detail in getattr(exc, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(str(exc))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _transient_types():
+    """Exception types that mean "try again": timeouts and dropped connections of every client library."""
+    types = [TimeoutError, ConnectionError, TransientError]
+    if httpx is not None:
+        types += [httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError]
+    if openai is not None:
+        types += [openai.APIConnectionError]  # APITimeoutError included
+    if google_exceptions is not None:
+        types += [google_exceptions.RetryError, google_exceptions.DeadlineExceeded, google_exceptions.ServiceUnavailable,
+                  google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted]
+    return tuple(types)
+
+
+TRANSIENT_ERRORS = _transient_types()
+
+
+def is_transport_error(exc):
+    """True for timeouts and dropped connections (the allow-listed types without an HTTP status)."""
+    return isinstance(exc, TRANSIENT_ERRORS) and not isinstance(exc, TransientError)
+
+
+def is_retryable(exc):
+    """
+    True for throttling (429), server-side (5xx) errors and the transient types of
+    `TRANSIENT_ERRORS`; everything else is permanent. That covers other 4xx (bad
+    request, auth), a blocked response, and programming errors such as TypeError.
+    """
+    status = get_status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+
+# ============================================================================
+# RETRY POLICY
+# ============================================================================
+class RetryPolicy:
+    """
+    Exponential backoff with decorrelated jitter, Retry-After support and a total time cap.
+
+    Each delay is drawn from uniform(base_delay, previous_delay * 3) and capped at
+    `max_delay`, so runners sharing one API key spread their retries out instead of
+    retrying in lockstep. A server Retry-After hint is honoured (plus a little jitter).
+    No retry is started if it would end after `max_total` seconds from the first attempt.
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, max_total=RETRY_MAX_TOTAL):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total = max_total
+
+    def next_delay(self, previous_delay, retry_after=None):
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
+
+    def call(self, fn, label="call"):
+        """
+        Run `fn()` until it succeeds or the policy gives up.
+
+        Returns:
+            Whatever `fn` returns.
+
+        Raises:
+            RetryError: Wrapping the last exception (see `.last_error`).
+        """
+        start = time.monotonic()
+        delay = self.base_delay
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return fn()
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    print(f"❗️ [{label}] permanent failure on attempt {attempt}: {type(e).__name__}: {e}")
+                    raise RetryError(f"{label}: permanent failure", last_error=e, attempts=attempt) from e
+
+                print(f"❗️ [{label}] attempt {attempt} of {self.max_attempts} failed: {type(e).__name__}: {e}")
+                if attempt == self.max_attempts:
+                    break
+
+                delay = self.next_delay(delay, get_retry_after(e))
+                if time.monotonic() - start + delay > self.max_total:
+                    print(f"❌ [{label}] retry budget of {self.max_total:.0f}s exhausted")
+                    raise RetryError(f"{label}: retry budget exhausted", last_error=e, attempts=attempt) from e
+                print(f"   Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+
+        raise RetryError(f"{label}: all {self.max_attempts} attempts failed", last_error=last_error,
+                         attempts=self.max_attempts) from last_error
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,127 @@
+import os
+import gzip
+import json
+import argparse
+from toon_format import encode
+from cache_codec import zstandard
+from ground_truth import ground_truth
+from token_counter import get_token_counter
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+SIZE_GZIP_LEVEL = int(os.getenv("SIZE_GZIP_LEVEL", 6))
+SIZE_ZSTD_LEVEL = int(os.getenv("SIZE_ZSTD_LEVEL", 3))
+
+# Format → how its text is produced. The first JSON entry is the historical baseline of
+# the MEMORY COMPARISON block; compact JSON is what production traffic (and the few-shot
+# prompts) actually carry.
+FORMATS = {
+    "JSON pretty": lambda data, truth: truth["json_pretty"],
+    "JSON compact": lambda data, truth: json.dumps(data, separators=(",", ":")),
+    "JSON minified": lambda data, truth: truth["json_compact"],  # ensure_ascii=False
+    "TOON": lambda data, truth: truth["toon"],
+    "TOON tab": lambda data, truth: encode(data, {"delimiter": "\t"}),
+    "TOON pipe": lambda data, truth: encode(data, {"delimiter": "|"}),
+    "TOON #length": lambda data, truth: encode(data, {"lengthMarker": "#"}),
+    "TOON indent 1": lambda data, truth: encode(data, {"indent": 1}),
+}
+BASELINE = "JSON compact"
+COLUMNS = ("bytes", "gzip", "zstd", "tokens")
+
+
+def _zstd_size(raw):
+    if zstandard is None:
+        return None
+    return len(zstandard.ZstdCompressor(level=SIZE_ZSTD_LEVEL).compress(raw))
+
+
+# ============================================================================
+# SIZE MATRIX
+# ============================================================================
+def size_matrix(python_data, token_counter=None):
+    """
+    Wire size of one document in every format of `FORMATS`.
+
+    Args:
+        python_data: The document.
+        token_counter (TokenCounter): Counter for the token column (default: the
+            client-less counter, i.e. tiktoken or the offline estimate).
+
+    Returns:
+        dict: {format: {"bytes", "gzip", "zstd" (None without `zstandard`), "tokens"}}
+    """
+    token_counter = token_counter or get_token_counter()
+    truth = ground_truth(python_data)  # memoized by content hash
+    matrix = {}
+    for name, render in FORMATS.items():
+        text = render(python_data, truth)
+        raw = text.encode("utf-8")
+        matrix[name] = {
+            "bytes": len(raw),
+            "gzip": len(gzip.compress(raw, compresslevel=SIZE_GZIP_LEVEL, mtime=0)),
+            "zstd": _zstd_size(raw),
+            "tokens": token_counter.count(text),
+        }
+    return matrix
+
+
+def add_size_matrix(total, matrix):
+    """Accumulate a case's `size_matrix` into the running `total` (a dict, updated in place)."""
+    for name, sizes in (matrix or {}).items():
+        row = total.setdefault(name, {column: 0 for column in COLUMNS})
+        for column in COLUMNS:
+            row[column] = None if row[column] is None or sizes[column] is None else row[column] + sizes[column]
+    return total
+
+
+def format_size_matrix(matrix, baseline=BASELINE):
+    """Table lines for a size matrix; each cell shows the value and its change against `baseline`."""
+    base = matrix.get(baseline)
+
+    def cell(name, column):
+        value = matrix[name][column]
+        if value is None:
+            return "-"
+        if not base or not base[column] or name == baseline:
+            return f"{value:,}"
+        return f"{value:,} ({(value / base[column] - 1) * 100:+.0f}%)"
+
+    lines = [
+        f"| {'Format':<14} | {'Bytes':>16} | {'gzip':>16} | {'zstd':>16} | {'Tokens':>16} |",
+        "-" * 94,
+    ]
+    for name in matrix:
+        lines.append(f"| {name:<14} | {cell(name, 'bytes'):>16} | {cell(name, 'gzip'):>16} "
+                     f"| {cell(name, 'zstd'):>16} | {cell(name, 'tokens'):>16} |")
+    lines.append(f"(change vs {baseline}; zstd level {SIZE_ZSTD_LEVEL}{'' if zstandard is not None else ' unavailable: install zstandard'}, "
+                 f"gzip level {SIZE_GZIP_LEVEL})")
+    return lines
+
+
+def main(argv=None):
+    from generate_toon_few_shots import test_cases
+    from synthetic_corpus import synthetic_cases
+
+    parser = argparse.ArgumentParser(description="Wire-size matrix: JSON baselines vs TOON encoder options, raw / gzip / zstd / tokens")
+    parser.add_argument("--synthetic", metavar="SPEC", default="",
+                        help='Also report generated documents (synthetic_corpus.py spec, e.g. "tabular:1000,nested:64KB")')
+    parser.add_argument("--aggregate-only", action="store_true", help="Print the aggregate only")
+    args = parser.parse_args(argv)
+
+    cases = {case["name"]: case["data"] for case in test_cases}
+    cases.update(synthetic_cases(args.synthetic))
+    counter = get_token_counter()
+    total = {}
+    for name, data in cases.items():
+        matrix = size_matrix(data, counter)
+        add_size_matrix(total, matrix)
+        if not args.aggregate_only:
+            print(f"\n📏 {name}")
+            print("\n".join(format_size_matrix(matrix)))
+    print(f"\n📊 AGGREGATE WIRE SIZE ({len(cases)} documents, tokens: {counter.name})")
+    print("\n".join(format_size_matrix(total)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import json
+from toon_format import encode
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Abort once the output is this many times longer than the expected result
+STREAM_MAX_RATIO = float(os.getenv("STREAM_MAX_RATIO", 1.5))
+
+# Outside strings only: "e" and "E" are ordinary letters inside a string
+_NUMBER_CHARS = set("0123456789.eE+-")
+
+
+# ============================================================================
+# STREAM GUARDS
+# ============================================================================
+# A guard is fed the streamed text piece by piece and returns an abort reason
+# (str) as soon as the output can no longer match the expected result, or None.
+
+class LengthGuard:
+    """Abort when the non-whitespace output outgrows `expected_chars` by `max_ratio`."""
+
+    def __init__(self, expected_chars, max_ratio=STREAM_MAX_RATIO):
+        self.expected_chars = expected_chars
+        self.limit = int(self.expected_chars * max_ratio) + 64
+        self.seen = 0
+
+    def feed(self, delta):
+        self.seen += sum(1 for ch in delta if not ch.isspace())
+        if self.seen > self.limit:
+            return f"output exceeded {self.limit} non-whitespace chars (expected up to {self.expected_chars})"
+        return None
+
+
+class JsonPrefixGuard:
+    """
+    Abort a TOON → JSON completion as soon as its JSON has diverged from the ground truth.
+
+    The streamed text is compacted on the fly (whitespace outside strings dropped,
+    leading ```json fences skipped) and compared character by character with the
+    compact ground-truth JSON. Differences that could still parse to an equal
+    value switch the prefix check off instead of aborting, and the length limit
+    still applies. These are number spellings such as `0` vs `0.0`, string escapes
+    such as `\\u00e9`, and object keys in a different order: validation compares
+    parsed values, so `{"b":1,"a":2}` still passes for `{"a":2,"b":1}`.
+    """
+
+    def __init__(self, expected_data, max_ratio=STREAM_MAX_RATIO):
+        self.expected = json.dumps(expected_data, ensure_ascii=False, separators=(",", ":"))
+        self.limit = int(len(self.expected) * max_ratio) + 64
+        self.position = 0  # chars of self.expected matched so far
+        self.started = False
+        self.done = False
+        self.checking = self.expected[:1] in ("{", "[")
+        self.in_string = False
+        self.escape = False
+        self.stack = []  # open containers, "{" or "["
+        self.expect_key = False  # inside an object, before a key (after "{" or ",")
+        self.in_key = False
+
+    def feed(self, delta):
+        for ch in delta:
+            if self.done:
+                return None
+            if not self.started:
+                # Skip markdown fences / preamble until the JSON document starts
+                if ch not in "{[":
+                    continue
+                self.started = True
+            if not self.in_string and ch.isspace():
+                continue
+
+            reason = self._compare(ch)
+            if reason:
+                return reason
+            self._track_structure(ch)
+            if self.position > self.limit:
+                return f"JSON output exceeded {self.limit} compact chars (expected {len(self.expected)})"
+        return None
+
+    def _compare(self, ch):
+        if not self.checking:
+            self.position += 1
+            return None
+        expected_ch = self.expected[self.position] if self.position < len(self.expected) else ""
+        if ch == expected_ch:
+            self.position += 1
+            return None
+        if self._may_still_match(ch, expected_ch):
+            # Possibly an equivalent spelling or key order; stop comparing, keep the length limit
+            self.checking = False
+            self.position += 1
+            return None
+        return (f"JSON diverged from ground truth at compact offset {self.position}: "
+                f"got {ch!r}, expected {expected_ch or 'end of document'!r}")
+
+    def _may_still_match(self, ch, expected_ch):
+        """Whether output that differs here from the ground truth can still parse to an equal value."""
+        if self.in_string:
+            # Escaped characters, and keys (another key order, same object)
+            return ch == "\\" or self.escape or self.in_key
+        if self.stack[-1:] == ["{"] and ((self.expect_key and ch != "}") or (ch == "," and expected_ch == "}")):
+            # A different key, or one more key (a duplicate would parse to the same object)
+            return True
+        return ch in _NUMBER_CHARS or expected_ch in _NUMBER_CHARS
+
+    def _track_structure(self, ch):
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = self.in_key = False
+        elif ch == '"':
+            self.in_string = True
+            self.in_key = self.stack[-1:] == ["{"] and self.expect_key
+        elif ch in "{[":
+            self.stack.append(ch)
+            self.expect_key = ch == "{"
+        elif ch in "}]":
+            self.stack.pop()
+            self.expect_key = False
+            if not self.stack:
+                # Document closed; anything after it (e.g. a closing fence) is ignored
+                self.done = True
+        elif ch == ",":
+            self.expect_key = self.stack[-1:] == ["{"]
+        elif ch == ":":
+            self.expect_key = False
+
+
+class CombinedGuard:
+    """Run several guards; the first abort reason wins."""
+
+    def __init__(self, *guards):
+        self.guards = guards
+
+    def feed(self, delta):
+        for guard in self.guards:
+            reason = guard.feed(delta)
+            if reason:
+                return reason
+        return None
+
+
+def decode_guard(python_data):
+    """Guard for a TOON → JSON completion of `python_data`."""
+    return JsonPrefixGuard(python_data)
+
+
+def encode_guard(toon_text, python_data):
+    """
+    Guard for a JSON → TOON completion (TOON spellings vary, so only its size is checked).
+
+    The size is measured against the longest of the official encoding and the
+    block-style spelling of `longest_toon_chars`, so any valid TOON fits.
+    """
+    official = sum(1 for ch in toon_text if not ch.isspace())
+    return LengthGuard(max(official, longest_toon_chars(python_data)))
+
+
+def _solid(text):
+    return sum(1 for ch in text if not ch.isspace())
+
+
+def _longest_toon(value, key):
+    key_chars = _solid(json.dumps(key, ensure_ascii=False)) if key is not None else 0
+    if isinstance(value, list):
+        header = key_chars + len(f"[#{len(value)}]:")
+        if all(not isinstance(item, (dict, list)) for item in value):
+            return header + sum(_longest_toon(item, None) for item in value) + max(0, len(value) - 1)
+        return header + sum(1 + _longest_toon(item, None) for item in value)  # "- " per item
+    head = key_chars + 1 if key is not None else 0  # "key":
+    if isinstance(value, dict):
+        return head + sum(_longest_toon(v, k) for k, v in value.items())
+    if isinstance(value, str):
+        return head + _solid(json.dumps(value, ensure_ascii=False))
+    return head + max(len(json.dumps(value)), len(encode(value)))
+
+
+def longest_toon_chars(python_data):
+    """
+    Non-whitespace chars of the most verbose TOON that still decodes to `python_data`.
+
+    That is block style everywhere: arrays of objects as `- ` list items, which repeat
+    every key, instead of tabular rows. Every key and string is quoted and array
+    lengths carry the `#` marker.
+    """
+    return _longest_toon(python_data, None)
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+def format_stream_stats(stream_stats):
+    """Log block for one case's {"decode": {...}, "encode": {...}} streaming stats."""
+    lines = ["\n⏱️  STREAMING (time to first token / total)"]
+    for leg, stats in stream_stats.items():
+        if not stats:
+            continue  # e.g. served from cache
+        ttft = stats.get("ttft_s")
+        line = f"  {leg.upper():<7}: {f'{ttft:.2f}s' if ttft is not None else '-'} / {stats['latency_s']:.2f}s"
+        if stats.get("aborted"):
+            line += f"  ABORTED ({stats['aborted']})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def summarize_stream_stats(all_stream_stats):
+    """One summary line over every case's streaming stats (None when nothing was streamed)."""
+    legs = [stats for case in all_stream_stats if case for stats in case.values() if stats]
+    if not legs:
+        return None
+    ttfts = [stats["ttft_s"] for stats in legs if stats.get("ttft_s") is not None]
+    aborted = sum(1 for stats in legs if stats.get("aborted"))
+    mean_ttft = f"{sum(ttfts) / len(ttfts):.2f}s" if ttfts else "-"
+    return f"⏱️  Streaming: {len(legs)} calls, mean time to first token {mean_ttft}, {aborted} aborted early"
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from toon_format.encoder import resolve_options
+from toon_format.encoders import encode_array_of_arrays, encode_mixed_array_as_list_items
+from toon_format.normalize import normalize_value, is_json_array, is_json_object, is_json_primitive
+from toon_format.primitives import encode_primitive, format_header, join_encoded_values
+from toon_format.writer import LineWriter
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Characters read per chunk; memory use is about this plus the largest single record
+STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", 1 << 20))
+
+DELIMITERS = {"comma": ",", "tab": "\t", "pipe": "|"}
+
+
+# ============================================================================
+# INCREMENTAL READER (one array element at a time)
+# ============================================================================
+class ArrayReader:
+    """
+    Read the elements of a large JSON array without loading the document.
+
+    The input is a top-level array, or an object with a single key holding one
+    (e.g. {"records": [...]}). Elements are parsed with `JSONDecoder.raw_decode`
+    from a sliding text buffer, so memory use is bounded by `chunk_size` plus the
+    largest element.
+    """
+
+    def __init__(self, f, chunk_size=STREAM_CHUNK_CHARS):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.key = None
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop what was consumed so the buffer does not grow with the input
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character ("" at the end of the input)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n\ufeff":
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def _expect(self, char, what):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected {what}, found {found or 'end of input'!r}")
+        self._pos += 1
+
+    def _decode(self):
+        self._peek()  # raw_decode does not skip leading whitespace
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut by the chunk boundary ("12|34", "1|e5") parses as a shorter number
+            if (isinstance(value, (int, float)) and not isinstance(value, bool) and not self._eof
+                    and self._buf[end:end + 1] in ("", *"0123456789+-.eE") and self._fill()):
+                continue
+            self._pos = end
+            return value
+
+    def open(self):
+        """Consume everything up to the array's "["; returns the wrapping key or None."""
+        if self._peek() == "{":
+            self._pos += 1
+            if self._peek() != '"':
+                raise ValueError("Expected a top-level array or an object with one array-valued key")
+            self.key = self._decode()
+            self._expect(":", '":" after the key')
+        self._expect("[", '"["')
+        return self.key
+
+    def items(self):
+        """Yield the array's elements in order, then check that nothing but the closing brackets follows."""
+        if self._peek() == "]":
+            self._pos += 1
+        else:
+            while True:
+                yield self._decode()
+                separator = self._peek()
+                self._pos += 1
+                if separator == "]":
+                    break
+                if separator != ",":
+                    raise ValueError(f"Expected ',' or ']' between elements, found {separator or 'end of input'!r}")
+        if self.key is not None:
+            self._expect("}", '"}" (only objects with a single key are streamed)')
+        if self._peek():
+            raise ValueError("Unexpected data after the array")
+
+
+def _records(f, chunk_size):
+    f.seek(0)
+    reader = ArrayReader(f, chunk_size)
+    key = reader.open()
+    return key, (normalize_value(item) for item in reader.items())
+
+
+# ============================================================================
+# PASS 1: count and classify (which of TOON's array layouts applies)
+# ============================================================================
+def scan(f, chunk_size=STREAM_CHUNK_CHARS):
+    """
+    Count the elements and pick the layout `toon_format.encode` would use for the whole array.
+
+    Returns:
+        dict: {"key", "count", "layout": "empty" | "inline" | "arrays" | "tabular" | "list",
+            "fields": tabular field order (from the first record) or None}
+    """
+    key, records = _records(f, chunk_size)
+    count = 0
+    all_primitive = all_arrays = all_objects = tabular = True
+    fields, field_set = None, None
+    for item in records:
+        count += 1
+        all_primitive = all_primitive and is_json_primitive(item)
+        all_arrays = all_arrays and is_json_array(item)
+        all_objects = all_objects and is_json_object(item)
+        if all_objects and tabular:
+            if fields is None:
+                fields, field_set = list(item), set(item)
+            tabular = set(item) == field_set and all(is_json_primitive(v) for v in item.values())
+    if count == 0:
+        layout = "empty"
+    elif all_primitive:
+        layout = "inline"
+    elif all_arrays:
+        layout = "arrays"
+    elif all_objects and tabular and fields:
+        layout = "tabular"
+    else:
+        layout = "list"
+    return {"key": key, "count": count, "layout": layout, "fields": fields if layout == "tabular" else None}
+
+
+# ============================================================================
+# PASS 2: write TOON line by line
+# ============================================================================
+def _item_lines(item, layout, options):
+    """TOON lines of one non-tabular element, indented one level (the array's header is dropped)."""
+    writer = LineWriter(options.indent)
+    encode_items = encode_array_of_arrays if layout == "arrays" else encode_mixed_array_as_list_items
+    encode_items([item], options, writer, 0, None)
+    return writer.to_string().partition("\n")[2]
+
+
+def write_toon(f, out, plan, options, chunk_size=STREAM_CHUNK_CHARS):
+    """
+    Write the array as TOON to the text stream `out`, one element at a time.
+
+    The output is identical to `toon_format.encode(json.load(f), options)` (no trailing newline).
+
+    Returns:
+        int: Number of elements written.
+    """
+    _, records = _records(f, chunk_size)
+    delimiter = options.delimiter
+    header = format_header(plan["key"], plan["count"], plan["fields"], delimiter, options.lengthMarker)
+    if plan["layout"] == "empty":
+        out.write(header)
+        return 0
+
+    written = 0
+    if plan["layout"] == "inline":
+        out.write(header + " ")
+        for item in records:
+            out.write((delimiter if written else "") + encode_primitive(item, delimiter))
+            written += 1
+        return written
+
+    out.write(header)
+    row_indent = " " * (options.indent or 1)
+    for item in records:
+        if plan["layout"] == "tabular":
+            out.write("\n" + row_indent + join_encoded_values([encode_primitive(item[name], delimiter) for name in plan["fields"]], delimiter))
+        else:
+            out.write("\n" + _item_lines(item, plan["layout"], options))
+        written += 1
+    return written
+
+
+def convert(f, out, options=None, chunk_size=STREAM_CHUNK_CHARS):
+    """
+    Convert the JSON array in the seekable text file `f` to TOON on `out`, in two passes.
+
+    Args:
+        f: Seekable text file with a top-level array (or {"key": [...]}).
+        out: Text stream for the TOON output.
+        options (dict): toon_format EncodeOptions (indent, delimiter, lengthMarker).
+        chunk_size (int): Characters read at a time.
+
+    Returns:
+        dict: The pass-1 plan (see `scan`).
+    """
+    resolved = resolve_options(options)
+    plan = scan(f, chunk_size)
+    write_toon(f, out, plan, resolved, chunk_size)
+    return plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a large JSON array to TOON with bounded memory (two passes)")
+    parser.add_argument("input", nargs="?", default="-", help="JSON file with a top-level array or {\"key\": [...]} (default: stdin)")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--delimiter", choices=list(DELIMITERS), default="comma", help="Array delimiter (default: comma)")
+    parser.add_argument("--indent", type=int, default=2, help="Spaces per indentation level (default: 2)")
+    parser.add_argument("--length-marker", action="store_true", help="Prefix array lengths with #")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_CHARS,
+                        help=f"Characters read per chunk (default: {STREAM_CHUNK_CHARS}, env STREAM_CHUNK_CHARS)")
+    args = parser.parse_args(argv)
+
+    options = {"delimiter": DELIMITERS[args.delimiter], "indent": args.indent, "lengthMarker": "#" if args.length_marker else False}
+    if args.input == "-":
+        # Two passes need a seekable input: spool stdin to a temporary file first
+        source = tempfile.TemporaryFile("w+", encoding="utf-8")
+        shutil.copyfileobj(sys.stdin, source, STREAM_CHUNK_CHARS)
+    else:
+        source = open(args.input, encoding="utf-8-sig")
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        with source:
+            plan = convert(source, out, options, args.chunk_size)
+        if not args.output:
+            out.write("\n")
+    except ValueError as e:  # json.JSONDecodeError included
+        sys.exit(f"❌ {e}")
+    finally:
+        if args.output:
+            out.close()
+
+    fields = f" {{{','.join(plan['fields'])}}}" if plan["fields"] else ""
+    print(f"✅ {plan['count']:,} elements, {plan['layout']} layout{fields}"
+          f"{f' → {args.output}' if args.output else ''}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import date, timedelta
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# Seed of every generated document (same seed + spec = same bytes)
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", 42))
+# Default nesting depth of the "nested" shape
+SYNTHETIC_DEPTH = int(os.getenv("SYNTHETIC_DEPTH", 6))
+# Records sampled to estimate the row count of a size target
+_SIZE_SAMPLE_ROWS = 200
+
+_FIRST_NAMES = ["Ada", "Alice", "Bob", "Chen", "Dmitri", "Fatima", "Grace", "Hiro", "Ines", "Jamal",
+                "Kofi", "Lena", "Maya", "Nikhil", "Olga", "Priya", "Ravi", "Sofia", "Tomás", "Zoë"]
+_LAST_NAMES = ["Doe", "García", "Ivanova", "Kim", "Mehta", "Müller", "Nakamura", "Okafor", "Rossi", "Smith"]
+_DEPARTMENTS = ["engineering", "sales", "support", "finance", "marketing", "operations"]
+_WORDS = ["alpha", "beta", "cache", "delta", "edge", "flux", "graph", "hash", "index", "json",
+          "kernel", "lambda", "merge", "node", "queue", "shard", "token", "vector"]
+# Strings a TOON encoder must quote: delimiters, colons, quotes, escapes, keyword and number look-alikes
+_TRICKY_STRINGS = ["a, b, c", "key: value", 'She said "hi"', "line one\nline two", "tab\tseparated",
+                   "  padded  ", "", "true", "false", "null", "007", "1.0", "-5", "1e3", "- list item",
+                   "users[2]{id,name}:", "[1]", "{braces}", "pipe|separated", "C:\\path\\to\\file",
+                   "naïve café ☕", "#hashtag", "trailing comma,"]
+
+
+# ============================================================================
+# RECORD GENERATORS (one record per call; `rng` is the document's random.Random)
+# ============================================================================
+def _name(rng):
+    return f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+
+
+def _tabular_record(rng, i, depth):
+    first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+    return {
+        "id": 1000 + i,
+        "name": f"{first} {last}",
+        "email": f"{first.lower()}.{last.lower()}{i}@example.com",
+        "department": rng.choice(_DEPARTMENTS),
+        "salary": rng.randrange(40_000, 200_000, 500),
+        "active": rng.random() < 0.8,
+        "joined": (date(2015, 1, 1) + timedelta(days=rng.randrange(3650))).isoformat(),
+    }
+
+
+def _nested_record(rng, i, depth):
+    node = {"value": rng.randint(0, 10_000), "tags": rng.sample(_WORDS, 2)}
+    for level in range(depth, 0, -1):
+        node = {"level": level, "name": rng.choice(_WORDS), "enabled": rng.random() < 0.5, "child": node}
+    return {"id": f"node-{i}", "root": node}
+
+
+def _heterogeneous_record(rng, i, depth):
+    kind = rng.choice(("book", "movie", "audiobook", "podcast", "bundle"))
+    record = {"type": kind, "title": " ".join(rng.sample(_WORDS, rng.randint(1, 3))).title()}
+    if kind == "book":
+        record["pages"] = rng.randint(80, 1200)
+        record["authors"] = [_name(rng) for _ in range(rng.randint(1, 3))]
+    elif kind == "movie":
+        record["duration_mins"] = rng.randint(70, 200)
+        record["rating"] = round(rng.uniform(1, 10), 1)
+    elif kind == "audiobook":
+        record["narrator"] = _name(rng)
+        record["chapters"] = None
+    elif kind == "podcast":
+        record["episodes"] = [{"n": n, "mins": rng.randint(10, 90)} for n in range(1, rng.randint(2, 4))]
+    else:
+        record["items"] = [rng.choice((rng.randint(1, 99), rng.choice(_WORDS), None, True, rng.random()))
+                           for _ in range(rng.randint(0, 5))]
+    if rng.random() < 0.3:
+        record["metadata"] = {"source": rng.choice(_WORDS), "ids": []}
+    return record
+
+
+def _quoting_record(rng, i, depth):
+    return {
+        "id": f"msg-{i:06d}",
+        "subject": rng.choice(_TRICKY_STRINGS),
+        "body": " ".join(rng.choice(_TRICKY_STRINGS + _WORDS) for _ in range(rng.randint(2, 6))),
+        "author": f'{rng.choice(_FIRST_NAMES)} "{rng.choice(_WORDS)}" {rng.choice(_LAST_NAMES)}',
+        "code": rng.choice(("007", "0x1F", "1.0", "true", "N/A", "-")),
+    }
+
+
+def _metrics_record(rng, i, depth):
+    views = rng.randint(1_000, 100_000)
+    clicks = rng.randint(0, views // 10)
+    return {
+        "date": (date(2025, 1, 1) + timedelta(days=i)).isoformat(),
+        "views": views,
+        "clicks": clicks,
+        "conversions": rng.randint(0, max(1, clicks // 10)),
+        "revenue": round(rng.uniform(0, 20_000), 2),
+        "bounceRate": round(rng.random(), 2),
+    }
+
+
+# Shape → (top-level key, record generator, description)
+SHAPES = {
+    "tabular": ("employees", _tabular_record, "uniform flat records (TOON's tabular array best case)"),
+    "nested": ("nodes", _nested_record, "records nested `depth` objects deep"),
+    "heterogeneous": ("items", _heterogeneous_record, "records with differing keys, nested lists, nulls and mixed arrays"),
+    "quoting": ("messages", _quoting_record, "strings that need quoting or escaping"),
+    "metrics": ("metrics", _metrics_record, 'numeric time series, like "Analytics Data"'),
+}
+
+
+# ============================================================================
+# DOCUMENTS
+# ============================================================================
+def _check_shape(shape):
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape {shape!r} (expected one of: {', '.join(SHAPES)})")
+
+
+def iter_records(shape, rows, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED):
+    """Yield the `rows` records of a document one at a time (constant memory)."""
+    _check_shape(shape)
+    rng = random.Random(f"{seed}:{shape}")
+    generator = SHAPES[shape][1]
+    for i in range(rows):
+        yield generator(rng, i, depth)
+
+
+def generate(shape, rows, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED, top_level_array=False):
+    """
+    Build a document of `rows` records in memory.
+
+    Returns:
+        dict | list: {"<shape key>": [records]}, or the bare list with `top_level_array`.
+    """
+    records = list(iter_records(shape, rows, depth, seed))
+    return records if top_level_array else {SHAPES[shape][0]: records}
+
+
+def rows_for_size(shape, target_bytes, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED):
+    """Row count whose compact JSON is about `target_bytes`, estimated from a sample of records."""
+    sample = list(iter_records(shape, _SIZE_SAMPLE_ROWS, depth, seed))
+    per_row = sum(len(json.dumps(r, separators=(",", ":"), ensure_ascii=False).encode("utf-8")) + 1 for r in sample)
+    return max(1, round(target_bytes / (per_row / len(sample))))
+
+
+def write_json(f, shape, rows, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED, top_level_array=False):
+    """
+    Stream a document as compact JSON to the text file `f`, one record at a time.
+
+    The output is identical to `json.dumps(generate(...), separators=(",", ":"), ensure_ascii=False)`,
+    so documents of hundreds of MB can be written without holding them in memory.
+
+    Returns:
+        int: Number of characters written.
+    """
+    written = 0
+
+    def out(text):
+        nonlocal written
+        f.write(text)
+        written += len(text)
+
+    out("[" if top_level_array else "{" + json.dumps(SHAPES[shape][0]) + ":[")
+    for i, record in enumerate(iter_records(shape, rows, depth, seed)):
+        out(("," if i else "") + json.dumps(record, separators=(",", ":"), ensure_ascii=False))
+    out("]" if top_level_array else "]}")
+    return written
+
+
+# ============================================================================
+# SPECS ("shape:rows" or "shape:size", for runners and benchmarks)
+# ============================================================================
+_UNITS = {"b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}
+
+
+def parse_size(text):
+    """Bytes of a size such as 512B, 64KB or 1.5MB; None when `text` has no unit (it is a row count)."""
+    text = text.strip().lower()
+    for unit in ("kb", "mb", "gb", "b"):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * _UNITS[unit])
+    return None
+
+
+def parse_spec(spec, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED):
+    """
+    Parse a comma-separated corpus spec such as "tabular:1000,nested:64KB,quoting:50".
+
+    Each item is a shape with a row count or a size target (B / KB / MB / GB of compact JSON).
+
+    Returns:
+        list[tuple]: (shape, rows) per item.
+    """
+    items = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        shape, _, amount = item.partition(":")
+        _check_shape(shape)
+        if not amount:
+            raise ValueError(f"Missing row count or size in {item!r} (e.g. {shape}:100 or {shape}:64KB)")
+        size = parse_size(amount)
+        items.append((shape, rows_for_size(shape, size, depth, seed) if size is not None else int(amount)))
+    return items
+
+
+def synthetic_cases(spec, depth=SYNTHETIC_DEPTH, seed=SYNTHETIC_SEED):
+    """
+    Test cases for a corpus spec, shaped like the runners' `test_data` (name → document).
+
+    Returns:
+        dict: {"Synthetic <shape> x<rows>": document}; empty for an empty spec.
+    """
+    if not spec:
+        return {}
+    return {f"Synthetic {shape} x{rows}": generate(shape, rows, depth, seed) for shape, rows in parse_spec(spec, depth, seed)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seeded synthetic JSON documents by shape, from KB to hundreds of MB")
+    parser.add_argument("shape", nargs="?", choices=list(SHAPES), help="Document shape")
+    parser.add_argument("--rows", type=int, help="Number of records")
+    parser.add_argument("--size", help="Target compact JSON size instead of --rows, e.g. 64KB, 200MB")
+    parser.add_argument("--depth", type=int, default=SYNTHETIC_DEPTH, help=f"Nesting depth of the nested shape (default: {SYNTHETIC_DEPTH})")
+    parser.add_argument("--seed", type=int, default=SYNTHETIC_SEED, help=f"Random seed (default: {SYNTHETIC_SEED}, env SYNTHETIC_SEED)")
+    parser.add_argument("--array", action="store_true", help="Write a bare top-level array of records")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--list", action="store_true", help="List the shapes and exit")
+    args = parser.parse_args(argv)
+
+    if args.list or not args.shape:
+        for shape, (key, _, description) in SHAPES.items():
+            print(f"{shape:<14} {{\"{key}\": [...]}}  {description}")
+        return
+    if (args.rows is None) == (args.size is None):
+        parser.error("pass exactly one of --rows and --size")
+    rows = args.rows if args.rows is not None else rows_for_size(args.shape, parse_size(args.size) or int(args.size), args.depth, args.seed)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            write_json(f, args.shape, rows, args.depth, args.seed, args.array)
+        print(f"✅ {args.shape}: {rows:,} records, {os.path.getsize(args.output):,} bytes → {args.output}", file=sys.stderr)
+    else:
+        written = write_json(sys.stdout, args.shape, rows, args.depth, args.seed, args.array)
+        sys.stdout.write("\n")
+        print(f"✅ {args.shape}: {rows:,} records, {written:,} characters", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+from batching import batch_max_tokens, build_batch_suffix, chunk_names, split_batch_response, BATCH_MAX_TOKENS
+
+
+def test_split_recovers_every_case_in_order():
+    answers = ['{"a": 1}', "users[1]{id}:\n  1", "plain"]
+    response = "\n".join(f"### CASE {i} ###\n{answer}" for i, answer in enumerate(answers, 1))
+    assert split_batch_response(response, 3) == answers
+
+
+def test_split_tolerates_preamble_loose_markers_and_missing_cases():
+    response = "Sure, here you go:\n###  CASE 2  ###\nsecond\n### CASE 9 ###\nout of range\n"
+    assert split_batch_response(response, 3) == ["", "second", ""]
+
+
+def test_split_keeps_first_answer_of_a_repeated_marker():
+    response = "### CASE 1 ###\nfirst\n### CASE 1 ###\nagain"
+    assert split_batch_response(response, 1) == ["first"]
+
+
+def test_split_of_empty_response():
+    assert split_batch_response("", 2) == ["", ""]
+    assert split_batch_response(None, 1) == [""]
+
+
+def test_suffix_marks_every_payload():
+    suffix = build_batch_suffix(["x", "y"])
+    assert "### CASE 1 ###\nx" in suffix and "### CASE 2 ###\ny" in suffix
+
+
+def test_chunk_names_and_token_budget():
+    assert chunk_names("abcde", 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert chunk_names(["a"], 0) == [["a"]]
+    assert batch_max_tokens(100, 3) == 300
+    assert batch_max_tokens(BATCH_MAX_TOKENS, 2) == BATCH_MAX_TOKENS
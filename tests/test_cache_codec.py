@@ -0,0 +1,43 @@
+import zlib
+
+import pytest
+
+from cache_codec import CacheCodec, CacheCodecError, split_samples, zstandard
+
+VALUE = {"text": "users[2]{id,name}:\n  1,Alice\n  2,Bob\n" * 8, "input_tokens": 900, "output_tokens": 120}
+
+
+@pytest.mark.parametrize("codec", ["raw", "zlib"] + (["zstd"] if zstandard is not None else []))
+def test_codec_round_trip(codec):
+    encoder = CacheCodec(codec)
+    blob = encoder.encode(VALUE)
+    assert encoder.decode(blob) == VALUE
+    # Any codec reads any other codec's values (the header names the codec)
+    assert CacheCodec("raw").decode(blob) == VALUE
+
+
+@pytest.mark.skipif(zstandard is None, reason="needs zstandard")
+def test_codec_round_trip_with_dictionary():
+    samples = [CacheCodec("raw").encode({"text": f"row {i}: " + "value," * (i % 7), "n": i})[4:] for i in range(200)]
+    dictionary = zstandard.train_dictionary(2048, samples).as_bytes()
+    encoder = CacheCodec("zstd", dictionary=dictionary)
+    assert encoder.name == "zstd+dict"
+    assert encoder.decode(encoder.encode(VALUE)) == VALUE
+    # Without the dictionary the value cannot be read
+    with pytest.raises(CacheCodecError):
+        CacheCodec("zstd").decode(encoder.encode(VALUE))
+
+
+def test_codec_reads_legacy_zlib_and_rejects_garbage():
+    legacy = zlib.compress(b'{"text": "old"}')
+    assert CacheCodec("raw").decode(legacy) == {"text": "old"}
+    with pytest.raises(CacheCodecError):
+        CacheCodec("raw").decode(b"not a cache value")
+
+
+def test_split_samples_holds_out_whole_documents():
+    groups = [[f"doc{i}-{spelling}".encode() for spelling in ("toon", "json")] for i in range(8)]
+    train, test = split_samples(groups, holdout=0.25)
+    assert len(test) == 4 and len(train) == 12
+    assert {s.split(b"-")[0] for s in train}.isdisjoint({s.split(b"-")[0] for s in test})
+    assert split_samples(groups, holdout=0.25) == (train, test)
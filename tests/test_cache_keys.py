@@ -0,0 +1,30 @@
+from llm_cache import PromptTemplate, canonical_payload, make_cache_key
+
+TEMPLATE = PromptTemplate("decode", "Convert TOON to JSON.\n\nExample:\n", version=2)
+
+
+def test_canonical_payload_normalizes_json_and_toon():
+    assert canonical_payload('{"b": 1,\n "a": [1, 2]}') == canonical_payload('{"a":[1,2],"b":1}')
+    assert canonical_payload("a: 1  \r\nb: 2\n") == "a: 1\nb: 2"
+    assert canonical_payload('{"a": 1}') != canonical_payload('{"a": 2}')
+
+
+def test_key_names_template_version_and_model():
+    key = make_cache_key("gemini-2.5-flash", TEMPLATE, '{"a": 1}', 4000, 0.0)
+    assert key.startswith(f"toon:decode@v2:{TEMPLATE.fingerprint}:gemini-2.5-flash:4000:0.0:")
+    assert key == make_cache_key("gemini-2.5-flash", TEMPLATE, '{ "a" : 1 }', 4000, 0.0)
+    assert key != make_cache_key("gemini-2.5-flash", TEMPLATE, '{"a": 1}', 2000, 0.0)
+
+
+def test_template_fingerprint_ignores_whitespace_but_not_version():
+    reflowed = PromptTemplate("decode", "Convert TOON  to JSON.\nExample:", version=2)
+    bumped = PromptTemplate("decode", TEMPLATE.base, version=3)
+    assert reflowed.fingerprint == TEMPLATE.fingerprint
+    assert make_cache_key("m", bumped, "x", 1, 0) != make_cache_key("m", TEMPLATE, "x", 1, 0)
+
+
+def test_batch_keys_depend_on_payload_order():
+    key = make_cache_key("m", TEMPLATE, ["a: 1", "b: 2"], 1, 0)
+    assert key.startswith("toon:decode@v2+batch:")
+    assert key != make_cache_key("m", TEMPLATE, ["b: 2", "a: 1"], 1, 0)
+    assert key != make_cache_key("m", TEMPLATE, "a: 1", 1, 0)
@@ -0,0 +1,41 @@
+import json
+
+from checkpoint import Checkpoint, case_fingerprint
+
+
+def test_resume_restores_finished_cases(tmp_path):
+    path = str(tmp_path / "run.checkpoint.jsonl")
+    checkpoint = Checkpoint(path)
+    checkpoint.save("A", {"x": 1}, {"decode_passed": True})
+    checkpoint.save("B", {"y": 2}, {"decode_passed": False})
+    checkpoint.mark_logged("A")
+
+    restored = Checkpoint(path, resume=True).completed({"A": {"x": 1}, "B": {"y": 2}, "C": {"z": 3}})
+    assert set(restored) == {"A", "B"}
+    assert restored["A"] == {"decode_passed": True, "resumed": True, "already_logged": True}
+    assert restored["B"]["already_logged"] is False
+
+
+def test_resume_skips_edited_cases(tmp_path):
+    path = str(tmp_path / "run.checkpoint.jsonl")
+    Checkpoint(path).save("A", {"x": 1}, {"ok": True})
+    assert Checkpoint(path, resume=True).completed({"A": {"x": 2}}) == {}
+
+
+def test_fingerprint_ignores_key_order():
+    assert case_fingerprint({"a": 1, "b": 2}) == case_fingerprint({"b": 2, "a": 1})
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = tmp_path / "run.checkpoint.jsonl"
+    Checkpoint(str(path)).save("A", {"x": 1}, {"ok": True})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"test_name": "B", "fingerprint": "f", "result": {}})[:20])
+    assert set(Checkpoint(str(path), resume=True).completed({"A": {"x": 1}, "B": {}})) == {"A"}
+
+
+def test_fresh_run_truncates_the_checkpoint(tmp_path):
+    path = str(tmp_path / "run.checkpoint.jsonl")
+    Checkpoint(path).save("A", {"x": 1}, {"ok": True})
+    Checkpoint(path)
+    assert Checkpoint(path, resume=True).completed({"A": {"x": 1}}) == {}
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("diskcache")
+
+from llm_cache import NEGATIVE_PREFIX, DiskCacheBackend
+
+
+def test_leases_and_failures_survive_size_culling(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_bytes=64 * 1024)
+    token = backend.acquire_lease("toon:k", ttl=60)
+    backend.set(NEGATIVE_PREFIX + "toon:bad", b"blocked", 60)
+    for i in range(200):
+        backend.set(f"toon:{i}", bytes(4096), 60)
+
+    assert backend.cache.volume() < 200 * 4096  # values were culled
+    assert backend.lease_exists("toon:k")
+    assert backend.acquire_lease("toon:k") is None
+    assert backend.get(NEGATIVE_PREFIX + "toon:bad") == b"blocked"
+    backend.release_lease("toon:k", token)
+    assert not backend.lease_exists("toon:k")
+
+
+def test_bookkeeping_entries_are_not_counted_as_cache_entries(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_bytes=0)
+    backend.set("toon:a", b"value", 60)
+    backend.set(NEGATIVE_PREFIX + "toon:b", b"blocked", 60)
+    backend.acquire_lease("toon:c")
+    assert list(backend.scan_keys(10)) == ["toon:a"]
+    assert backend.footprint()["entries"] == 1
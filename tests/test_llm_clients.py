@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from llm_clients import GeminiClient, _cancel_gemini_stream
+
+
+@pytest.fixture
+def gemini():
+    client = GeminiClient("gemini-test", api_key="offline")
+    client.prefix_cache = True
+    return client
+
+
+def test_prefix_model_is_created_once_outside_the_lock(gemini):
+    release = threading.Event()
+    created = []
+    other = []
+    served = []
+
+    def create(prefix):
+        if prefix == "slow":
+            # Another prefix is served while this one is still being created
+            lookup = threading.Thread(target=lambda: other.append(gemini._model_for("q", "fast")), daemon=True)
+            lookup.start()
+            lookup.join(1)
+            served.extend(other)
+            release.wait(5)
+        created.append(prefix)
+        return f"{prefix}-model", time.monotonic() + 60
+
+    gemini._create_prefix_model = create
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gemini._model_for("p", "slow"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert served == [("fast-model", "q")]
+    assert results == [("slow-model", "p")] * 4
+    assert sorted(created) == ["fast", "slow"]
+
+
+def test_expired_or_refused_prefix_models(gemini):
+    entries = iter([(None, time.monotonic() - 1), ("model", time.monotonic() + 60)])
+    gemini._create_prefix_model = lambda prefix: next(entries)
+    assert gemini._model_for("p", "pre") == (gemini.model, "pre\np")  # refused: sent inline
+    assert gemini._model_for("p", "pre") == ("model", "p")  # expired: created again
+    assert gemini._model_for("p", "pre") == ("model", "p")
+
+
+def test_cancel_gemini_stream_is_best_effort():
+    class Iterator:
+        cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    class Response:
+        _iterator = Iterator()
+
+    _cancel_gemini_stream(Response())
+    assert Response._iterator.cancelled
+    # Responses without the private iterator (another SDK version) are left alone
+    _cancel_gemini_stream(object())
+    Response._iterator.cancel = lambda: 1 / 0
+    _cancel_gemini_stream(Response())
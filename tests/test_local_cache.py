@@ -0,0 +1,24 @@
+from llm_cache import LRUCache
+
+
+def test_local_tier_counts_hits_without_extending_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("llm_cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.put("k", {"text": "v"})
+    now[0] += 6
+    assert cache.get("k") == {"text": "v"}
+    now[0] += 6  # 12s after the store: expired although it was read 6s ago
+    assert cache.get("k") is None
+    assert cache.drain_hits() == {"k": 1}
+    assert cache.pending_hits == 0
+
+
+def test_local_tier_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, max_bytes=10 ** 6)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    cache.get("a")
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None and cache.get("a") == {"v": 1}
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from checkpoint import Checkpoint
+from pipeline_runner import run_cases_sync, run_parallel
+
+CASES = {f"case{i}": {"n": i} for i in range(6)}
+
+
+def test_results_and_callbacks_follow_input_order():
+    emitted = []
+
+    def worker(name, data):
+        time.sleep(0.01 * (6 - data["n"]))  # later cases finish first
+        return data["n"] * 10
+
+    results = run_cases_sync(CASES, worker, concurrency=6, on_result=lambda name, result: emitted.append(name))
+    assert list(results) == list(CASES)
+    assert list(results.values()) == [0, 10, 20, 30, 40, 50]
+    assert emitted == list(CASES)
+
+
+def test_concurrency_is_bounded():
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def worker(name, data):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return name
+
+    run_cases_sync(CASES, worker, concurrency=2)
+    assert peak[0] == 2
+
+
+def test_batches_are_emitted_one_case_at_a_time():
+    batches = []
+    emitted = []
+
+    def batch_worker(batch):
+        batches.append(list(batch))
+        return {name: data["n"] for name, data in batch.items()}
+
+    results = run_cases_sync(CASES, None, concurrency=2, batch_size=4, batch_worker=batch_worker,
+                             on_result=lambda name, result: emitted.append(name))
+    assert sorted(batches) == [["case0", "case1", "case2", "case3"], ["case4", "case5"]]
+    assert emitted == list(CASES) and list(results.values()) == list(range(6))
+
+
+def test_checkpointed_cases_are_not_run_again(tmp_path):
+    path = str(tmp_path / "run.checkpoint.jsonl")
+    run_cases_sync(dict(list(CASES.items())[:3]), lambda name, data: {"n": data["n"]}, checkpoint=Checkpoint(path))
+
+    ran = []
+
+    def worker(name, data):
+        ran.append(name)
+        return {"n": data["n"]}
+
+    results = run_cases_sync(CASES, worker, checkpoint=Checkpoint(path, resume=True))
+    assert sorted(ran) == ["case3", "case4", "case5"]
+    assert results["case0"] == {"n": 0, "resumed": True, "already_logged": True}
+    assert results["case5"] == {"n": 5}
+
+
+def test_run_parallel_keeps_argument_order():
+    assert run_parallel(lambda: time.sleep(0.02) or "slow", lambda: "fast") == ["slow", "fast"]
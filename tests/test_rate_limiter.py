@@ -0,0 +1,39 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket, get_rate_limiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("rate_limiter.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_waits_for_the_refill(clock):
+    bucket = TokenBucket(per_minute=60)  # one unit per second
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)  # reservations queue up
+    clock[0] += 2
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    bucket.adjust(-1)  # give one back
+    assert bucket.time_for(0) == pytest.approx(0.0)
+
+
+def test_record_usage_settles_the_token_estimate(clock):
+    limiter = RateLimiter("test", rpm=0, tpm=600)  # ten tokens per second
+    limiter.tokens.reserve(100)
+    limiter.record_usage(700, estimated_tokens=100)
+    assert limiter.estimate_duration(0, tokens=10)["tpm_seconds"] == pytest.approx(11.0)
+
+
+def test_limiters_read_quotas_from_env(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setenv("GEMINI_RPM", "5")
+    assert get_rate_limiter("gemini").requests.capacity == 5
+    assert get_rate_limiter("gemini") is get_rate_limiter("gemini")
+    # Token counting has its own quota; unknown providers are unlimited
+    assert get_rate_limiter("gemini_count").requests.capacity == rate_limiter.DEFAULT_LIMITS["gemini_count"]["rpm"]
+    assert get_rate_limiter("nobody").requests is None
@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from llm_cache import SingleFlight
+
+
+@pytest.fixture
+def waiting(monkeypatch):
+    """Semaphore released once per follower that is blocked on the leader's future."""
+    waiting = threading.Semaphore(0)
+
+    class CountingFuture(Future):
+        def result(self, timeout=None):
+            waiting.release()
+            return super().result(timeout)
+
+    monkeypatch.setattr("llm_cache.Future", CountingFuture)
+    return waiting
+
+
+def test_concurrent_callers_share_one_call(waiting):
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fill():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", fill)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", fill))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for _ in followers:
+        assert waiting.acquire(timeout=5)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [("value", False)] + [("value", True)] * 3
+
+
+def test_followers_get_the_leaders_exception(waiting):
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    assert waiting.acquire(timeout=5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ["boom", "boom"]
+
+
+def test_a_finished_flight_runs_again():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == (1, False)
+    assert flight.do("k", lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flight.do("k", lambda: {}["missing"])
+    assert flight.do("k", lambda: 3) == (3, False)
@@ -0,0 +1,116 @@
+import json
+
+from toon_format import decode, encode
+from toon_format.encoder import resolve_options
+from toon_format.encoders import encode_mixed_array_as_list_items
+from toon_format.writer import LineWriter
+
+from stream_guard import CombinedGuard, LengthGuard, decode_guard, encode_guard, longest_toon_chars, summarize_stream_stats
+
+USERS = {
+    "app": "FitTrack",
+    "users": [{"userId": 200 + i, "displayName": f"U{i}", "accountIsActive": i % 2 == 0, "loginCount": i} for i in range(30)],
+}
+
+
+def solid(text):
+    return sum(1 for ch in text if not ch.isspace())
+
+
+def feed(guard, text, step=5):
+    """Stream `text` into `guard` in small pieces; returns the first abort reason or None."""
+    for i in range(0, len(text), step):
+        reason = guard.feed(text[i:i + step])
+        if reason:
+            return reason
+    return None
+
+
+# ============================================================================
+# DECODE (JSON prefix) GUARD
+# ============================================================================
+def test_exact_answer_with_fences_and_whitespace_passes():
+    answer = "```json\n" + json.dumps(USERS, indent=2) + "\n```"
+    assert feed(decode_guard(USERS), answer) is None
+
+
+def test_reordered_top_level_keys_pass():
+    answer = json.dumps({"users": USERS["users"], "app": USERS["app"]})
+    assert json.loads(answer) == USERS
+    assert feed(decode_guard(USERS), answer) is None
+
+
+def test_reordered_keys_inside_array_items_pass():
+    assert feed(decode_guard([{"id": 201, "name": "Maya"}]), '[{"name":"Maya","id":201}]') is None
+
+
+def test_number_spelling_passes():
+    assert feed(decode_guard({"price": 10}), '{"price": 10.0}') is None
+
+
+def test_wrong_string_value_aborts():
+    reason = feed(decode_guard({"app": "FitTrack"}), '{"app": "FitTrak"}')
+    assert reason and "diverged" in reason
+
+
+def test_exponent_letter_inside_string_aborts():
+    # "e" / "E" only look like a number spelling outside strings
+    assert feed(decode_guard({"word": "hello"}), '{"word": "hellE"}')
+
+
+def test_missing_key_aborts():
+    assert feed(decode_guard({"a": 1, "b": 2}), '{"a": 1}')
+
+
+def test_overlong_output_aborts():
+    reason = feed(decode_guard({"a": 1}), '{"a": 1' + "0" * 500 + "}")
+    assert reason and "exceeded" in reason
+
+
+# ============================================================================
+# ENCODE (length) GUARD
+# ============================================================================
+def block_style_toon(data):
+    """`data` with the users array written as `- ` list items instead of tabular rows."""
+    writer = LineWriter(2)
+    writer.push(0, f"app: {data['app']}")
+    encode_mixed_array_as_list_items(data["users"], resolve_options(None), writer, 0, "users")
+    return writer.to_string()
+
+
+def test_block_style_toon_passes():
+    toon = encode(USERS)
+    block = block_style_toon(USERS)
+    assert decode(block) == USERS
+    # Past the old limit of 1.5x the tabular encoding + 64 (non-whitespace chars)
+    assert solid(block) > 1.5 * solid(toon) + 64
+    assert feed(encode_guard(toon, USERS), block) is None
+
+
+def test_longest_toon_covers_official_encoding():
+    toon = encode(USERS)
+    assert longest_toon_chars(USERS) >= solid(toon)
+
+
+def test_runaway_toon_aborts():
+    toon = encode(USERS)
+    assert feed(encode_guard(toon, USERS), toon * 10)
+
+
+# ============================================================================
+# COMBINED GUARDS AND REPORTING
+# ============================================================================
+def test_combined_guard_returns_the_first_abort_reason():
+    guard = CombinedGuard(LengthGuard(1, max_ratio=1.0), decode_guard({"a": 1}))
+    assert feed(guard, '{"a": 1}') is None
+    reason = feed(guard, "x" * 100)
+    assert reason and "non-whitespace" in reason
+
+
+def test_stream_summary_counts_calls_and_aborts():
+    stats = [
+        {"decode": {"ttft_s": 0.5, "latency_s": 1.0}, "encode": {"ttft_s": 1.5, "latency_s": 2.0, "aborted": "too long"}},
+        {"decode": None, "encode": None},  # served from cache
+    ]
+    assert "2 calls, mean time to first token 1.00s, 1 aborted early" in summarize_stream_stats(stats)
+    assert summarize_stream_stats([None, {"decode": None}]) is None
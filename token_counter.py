@@ -0,0 +1,189 @@
+import os
+import re
+import hashlib
+import threading
+from rate_limiter import get_rate_limiter
+from retry_policy import DEFAULT_RETRY_POLICY, RetryError, is_retryable
+
+try:
+    import tiktoken
+except ImportError:  # optional: `uv pip install tiktoken`
+    tiktoken = None
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+# auto = the provider's count_tokens, then tiktoken, then the offline estimate; or provider / tiktoken / estimate
+TOKEN_COUNTER = os.getenv("TOKEN_COUNTER", "auto").lower()
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "o200k_base")
+# Persist counts across runs (and processes) in a diskcache next to the LLM cache
+TOKEN_COUNT_DISK = os.getenv("TOKEN_COUNT_DISK", "1").lower() in ("1", "true", "yes")
+TOKEN_COUNT_DIR = os.getenv("TOKEN_COUNT_DIR", os.path.join(os.getenv("TOON_CACHE_DIR", ".toon_cache"), "token_counts"))
+
+SOURCES = ("provider", "tiktoken", "estimate")
+
+# Runs that BPE tokenizers tend to keep together: letters, digits, whitespace, punctuation
+_PIECES = re.compile(r"[A-Za-z]+|[0-9]+|\s+|[^\w\s]+|[^\W\d_A-Za-z]+")
+
+
+# ============================================================================
+# OFFLINE ESTIMATE
+# ============================================================================
+def estimate_tokens(text):
+    """
+    Offline token estimate that follows how BPE tokenizers split JSON and TOON.
+
+    Words cost one token per ~6 letters, numbers one per 3 digits, punctuation
+    one per 2 characters, and non-Latin text one per character. A single space
+    is merged into the next word, while indentation runs are one token. Used
+    when neither the provider nor tiktoken can count.
+    """
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        first = piece[0]
+        if first.isspace():
+            tokens += 0 if piece == " " else 1
+        elif first.isascii() and first.isalpha():
+            tokens += -(-len(piece) // 6)
+        elif first.isdigit():
+            tokens += -(-len(piece) // 3)
+        elif first.isalpha():
+            tokens += len(piece)
+        else:
+            tokens += -(-len(piece) // 2)
+    return max(1, tokens) if text else 0
+
+
+# ============================================================================
+# COUNTER
+# ============================================================================
+class TokenCounter:
+    """
+    Count tokens with the best source available, memoized by content hash.
+
+    Sources are tried in order: the provider's `count_tokens` (exact for the
+    model the runner calls), tiktoken (`TIKTOKEN_ENCODING`, local once its
+    vocabulary is downloaded) and `estimate_tokens`. Provider calls go through
+    the provider's counting limiter (`<PROVIDER>_COUNT_RPM`, separate from the
+    model-call quota) and `retry_policy`. A source that fails
+    permanently (no endpoint, 4xx, tiktoken unavailable) is disabled for the rest
+    of the run, so an offline machine pays for the failure once. When a transient
+    error outlasts the retries, only that text falls back to the next source, and
+    `summary` reports that the totals mix tokenizers. Counts are kept in memory
+    and (optionally) in a diskcache, keyed by source and text hash, so each text
+    costs at most one provider call.
+    """
+
+    def __init__(self, client=None, mode=TOKEN_COUNTER, encoding=TIKTOKEN_ENCODING,
+                 directory=TOKEN_COUNT_DIR, use_disk=TOKEN_COUNT_DISK, retry_policy=None):
+        if mode != "auto" and mode not in SOURCES:
+            raise ValueError(f"❌ Unknown TOKEN_COUNTER {mode!r} (expected auto, {', '.join(SOURCES)})")
+        self.client = client
+        self.encoding = encoding
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        # Counting has its own quota (<PROVIDER>_COUNT_RPM), so it never takes model-call slots
+        self._limiter = get_rate_limiter(f"{client.provider}_count") if client is not None else None
+        sources = SOURCES if mode == "auto" else SOURCES[SOURCES.index(mode):]
+        self._sources = [s for s in sources if not (s == "provider" and client is None) and not (s == "tiktoken" and tiktoken is None)]
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._tokenizer = None
+        self._disk = None
+        if use_disk:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(directory)
+            except Exception as e:
+                print(f"⚠️  Token count disk cache unavailable ({e}) - memoizing in memory only")
+        self.counted = {source: 0 for source in SOURCES}
+        self.used = {source: 0 for source in SOURCES}  # new and memoized counts
+        self.hits = 0
+
+    def _label(self, source):
+        if source == "provider":
+            return f"{self.client.provider}/{self.client.model_name}"
+        if source == "tiktoken":
+            return f"tiktoken/{self.encoding}"
+        return "estimate"
+
+    @property
+    def name(self):
+        """The source counting new texts right now, e.g. "gemini/gemini-2.5-flash" or "estimate"."""
+        return self._label(self._sources[0])
+
+    def _count_with(self, source, text):
+        if source == "provider":
+            def attempt():
+                self._limiter.acquire()
+                return self.client.count_tokens(text)
+            return self.retry_policy.call(attempt, label=f"count_tokens:{self._label(source)}")
+        if source == "tiktoken":
+            if self._tokenizer is None:
+                self._tokenizer = tiktoken.get_encoding(self.encoding)
+            return len(self._tokenizer.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def count(self, text):
+        """Token count of `text` (0 for an empty string)."""
+        if not text:
+            return 0
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        for source in list(self._sources):
+            key = f"tok:{self._label(source)}:{digest}"
+            with self._lock:
+                tokens = self._memory.get(key)
+            if tokens is None and self._disk is not None:
+                tokens = self._disk.get(key)
+            if tokens is not None:
+                with self._lock:
+                    self._memory[key] = tokens
+                    self.hits += 1
+                    self.used[source] += 1
+                return tokens
+            try:
+                tokens = self._count_with(source, text)
+            except Exception as e:
+                if source == "estimate":
+                    raise
+                error = e.last_error if isinstance(e, RetryError) and e.last_error is not None else e
+                if source == "provider" and is_retryable(error):
+                    # Transient and out of retries: count this text with the next source only
+                    print(f"⚠️  Token counting via {self._label(source)} failed ({type(error).__name__}: {error}) "
+                          f"- counting this text with the next source")
+                    continue
+                with self._lock:
+                    if source in self._sources:
+                        self._sources.remove(source)
+                        print(f"⚠️  Token counting via {self._label(source)} unavailable ({type(error).__name__}: {error}) "
+                              f"- using {self.name}")
+                continue
+            with self._lock:
+                self._memory[key] = tokens
+                self.counted[source] += 1
+                self.used[source] += 1
+            if self._disk is not None:
+                self._disk.set(key, tokens)
+            return tokens
+
+    def summary(self):
+        """One summary line with where the run's token counts came from."""
+        counted = ", ".join(f"{self._label(s)} {n}" for s, n in self.counted.items() if n) or "none"
+        line = f"🔢 Token counts: {self.name} (new counts: {counted}; memoized: {self.hits})"
+        mixed = [self._label(s) for s, n in self.used.items() if n]
+        if len(mixed) > 1:
+            line += f"\n⚠️  Token totals mix {len(mixed)} tokenizers ({', '.join(mixed)}): compare them with care"
+        return line
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(client=None):
+    """Return the shared counter for `client` (None: tiktoken / offline estimate only)."""
+    key = id(client)
+    with _counters_lock:
+        if key not in _counters:
+            _counters[key] = TokenCounter(client)
+        return _counters[key]
+